@@ -8,13 +8,35 @@ class HelloAgentsLLM:
         self.args = parse_parameters()
         self.client = ClientManager(args=self.args)
 
-    def think(self, messages: List[Dict[str, str]], temperature: float = 0) -> str:
+    @property
+    def structured_output(self) -> bool:
+        return self.client.structured_output
+
+    def think(self, messages: List[Dict[str, str]], temperature: float = 0, schema: str | None = None, kind: str = "chat") -> str:
 
         print(f"🧠 Calling {self.args.model} model...")
         try:
 
             response = self.client.chat_completion(
                 messages=messages,
+                schema=schema,
+                kind=kind,
+            )
+
+            return response
+        except Exception as e:
+            print(f"❌ Error while calling LLM API: {e}")
+            return None
+
+    async def think_async(self, messages: List[Dict[str, str]], schema: str | None = None, kind: str = "chat") -> str:
+
+        print(f"🧠 Calling {self.args.model} model...")
+        try:
+
+            response = await self.client.chat_completion_async(
+                messages=messages,
+                schema=schema,
+                kind=kind,
             )
 
             return response
@@ -1,20 +1,34 @@
 import ast
+import asyncio
 import base64
+import hashlib
+import json
 import mimetypes
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from urllib.parse import urlparse
 
 from traitlets import Bool
 
 from llm.tools.image_quality import find_duplicates_in_items, duplicate_pairs_to_groups
+from llm.tools.image_prep import image_prep_enabled, prepare_image_part
+from llm.tools.image_store import configure_image_store, get_image_store
 from llm.agents.hello_agent import HelloAgentsLLM
+from llm.structured_output import parse_structured, record_parse
+from llm.tools.plan_cache import PlanCache, get_plan_cache
+from llm.tools.step_classifier import get_step_classifier, looks_english, record_agreement
+from utils.metrics import metrics
 
-PLANNER_PROMPT_TEMPLATE = """
+_PLANNER_PROMPT_HEAD = """
 You are a top-tier AI planning functional test expert.
 Your task is to analyze user-provided test case text and screenshots to develop an action plan for each step (Step Number).
 Please ensure that each step in the plan is an independent, executable task, and arranged strictly in logical order.
 Each step will have text and image information,
 and we categorize each step as follows: UI_INTERACTION, STATE_VERIFICATION, CONDITIONAL, NAVIGATION, WAITING, DESCRIPTIVE, INPUT, SCROLL
+""".strip()
+
+PLANNER_PROMPT_TEMPLATE = _PLANNER_PROMPT_HEAD + """
 
 Your output must be a Python list, where each element is a string describing a subtask.
 
@@ -28,31 +42,498 @@ Please strictly adhere to the following format when outputting your plan, with `
     "text": "English step description, based on the standard text and image.",
 }]
 ```
-""".strip()
+""".rstrip()
+
+# Used with --structured_output: the response is constrained by PLAN_SCHEMA,
+# so the prompt only describes the fields instead of a fenced literal.
+PLANNER_STRUCTURED_PROMPT_TEMPLATE = _PLANNER_PROMPT_HEAD + """
+
+Input: [text + image_url]
+
+Return a JSON object whose "steps" array holds exactly one element per Step Number, in order:
+- "step_number": the Step Number.
+- "step_type": the single best matching category from the allowed list.
+- "text": English step description, based on the standard text and image.
+"""
+
+
+def _parse_step_object(text: str) -> dict | None:
+    for loads in (json.loads, ast.literal_eval):
+        try:
+            value = loads(text)
+        except Exception:
+            continue
+        return value if isinstance(value, dict) and "step_number" in value else None
+    return None
+
+
+class StreamingPlanParser:
+    """Pull completed step objects out of a planner reply while it is still streaming.
+
+    Step objects are flat, so every innermost `{...}` outside a string is a
+    candidate. In the legacy format only the ```python fenced block is scanned.
+    """
+
+    def __init__(self, structured: bool):
+        self._buffer = ""
+        self._pos = 0
+        self._started = structured
+        self._done = False
+        self._quote = None
+        self._escape = False
+        self._object_start = None
+
+    def feed(self, delta: str) -> list[dict]:
+        self._buffer += delta
+        steps: list[dict] = []
+        if self._done:
+            return steps
+        if not self._started:
+            fence = self._buffer.find("```python")
+            if fence == -1:
+                return steps
+            self._started = True
+            self._pos = fence + len("```python")
+
+        buf = self._buffer
+        i = self._pos
+        while i < len(buf):
+            ch = buf[i]
+            if self._quote:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == self._quote:
+                    self._quote = None
+            elif ch in "\"'":
+                self._quote = ch
+            elif ch == "`":
+                if buf.startswith("```", i):
+                    self._done = True
+                    break
+                if len(buf) - i < 3:
+                    # Might be the start of the closing fence; wait for more text.
+                    break
+            elif ch == "{":
+                self._object_start = i
+            elif ch == "}" and self._object_start is not None:
+                step = _parse_step_object(buf[self._object_start : i + 1])
+                if step is not None:
+                    steps.append(step)
+                self._object_start = None
+            i += 1
+        self._pos = i
+        return steps
 
 
 class Planner:
     def __init__(self):
         self.llm_client = HelloAgentsLLM()
+        configure_image_store(self.llm_client.args)
+        self.plan_cache = get_plan_cache(getattr(self.llm_client.args, "plan_cache_dir", None))
+
+    @property
+    def prompt_template(self) -> str:
+        return PLANNER_STRUCTURED_PROMPT_TEMPLATE if self.llm_client.structured_output else PLANNER_PROMPT_TEMPLATE
+
+    @property
+    def prompt_version(self) -> str:
+        return hashlib.sha256(self.prompt_template.encode("utf-8")).hexdigest()[:16]
+
+    def cached_plan(self, question):
+        """Return (cache_key, cached raw plan or None); the key is None when caching is off."""
+
+        if self.plan_cache is None:
+            return None, None
+        key = PlanCache.key(question, self.prompt_version, self.llm_client.client.model_for("plan"), self._fetch_workers)
+        return key, self.plan_cache.get(key)
 
     def plan(self, question) -> list[dict]:
 
-        content_structured, user_content_structured, user_act_images = self.assemble_json(question)
+        messages, user_content_structured, group_duplicates = self.prepare(question)
+
+        cache_key, cached = self.cached_plan(question)
+        if cached is not None:
+            print("--- Plan cache hit ---")
+            return self.merge_plan_with_user_content(cached, user_content_structured), group_duplicates
+
+        classified = self.classify_plan(question)
+        if classified is not None:
+            print("--- Plan from local step classifier ---")
+            return self.merge_plan_with_user_content(classified, user_content_structured), group_duplicates
+
+        windows = self.chunk_windows(len(question))
+        if windows:
+            print(f"--- Generating plan in {len(windows)} chunks ---")
+            with ThreadPoolExecutor(max_workers=len(windows)) as pool:
+                replies = list(pool.map(
+                    lambda w: self.llm_client.think(messages=self.window_messages(question, *w), schema="plan", kind="plan") or "",
+                    windows,
+                ))
+            plan, complete = self.merge_chunk_plans(question, windows, replies)
+            self._record_llm_plan(cache_key, plan, question, complete)
+            return self.merge_plan_with_user_content(plan, user_content_structured), group_duplicates
 
-        group_duplicates = self.found_duplicates_images(user_act_images)
+        print("--- Generating plan ---")
+
+        response_text = self.llm_client.think(messages=messages, schema="plan", kind="plan") or ""
+
+        print(f"✅ Plan generated:\n{response_text}")
+
+        return self.finish_plan(response_text, user_content_structured, question, cache_key), group_duplicates
+
+    async def plan_async(self, question) -> list[dict]:
+        """Non-blocking `plan`: local image work runs in a thread and the LLM call is awaited.
+
+        Duplicate detection (downloading and hashing the actual screenshots)
+        runs while the planner call is in flight.
+        """
+
+        messages, user_content_structured, user_act_images = await asyncio.to_thread(self.prepare_messages, question)
+        duplicates = asyncio.create_task(asyncio.to_thread(self.duplicate_groups, user_act_images))
+        try:
+            plans = await self._plan_from_messages_async(question, messages, user_content_structured)
+        except BaseException:
+            duplicates.cancel()
+            raise
+        return plans, await duplicates
+
+    async def _plan_from_messages_async(self, question, messages, user_content_structured) -> list[dict]:
+
+        cache_key, cached = await asyncio.to_thread(self.cached_plan, question)
+        if cached is not None:
+            print("--- Plan cache hit ---")
+            return self.merge_plan_with_user_content(cached, user_content_structured)
+
+        classified = self.classify_plan(question)
+        if classified is not None:
+            print("--- Plan from local step classifier ---")
+            return self.merge_plan_with_user_content(classified, user_content_structured)
+
+        windows = self.chunk_windows(len(question))
+        if windows:
+            plan = await self._plan_chunked_async(question, windows, cache_key)
+            return self.merge_plan_with_user_content(plan, user_content_structured)
+
+        print("--- Generating plan ---")
+
+        response_text = await self.llm_client.think_async(messages=messages, schema="plan", kind="plan") or ""
+
+        print(f"✅ Plan generated:\n{response_text}")
+
+        return self.finish_plan(response_text, user_content_structured, question, cache_key)
+
+    async def plan_stream_async(self, question, prepared, on_step) -> list[dict]:
+        """Stream the planner reply and call `on_step(merged_step)` as soon as each step is complete.
+
+        `prepared` is the result of `prepare(question)` or `prepare_messages(question)`.
+        Returns the same plan as `plan_async`; steps the incremental parser
+        missed are emitted at the end.
+        """
+
+        messages, user_content_structured, _ = prepared
+
+        cache_key, cached = await asyncio.to_thread(self.cached_plan, question)
+        if cached is not None:
+            print("--- Plan cache hit ---")
+            plans = self.merge_plan_with_user_content(cached, user_content_structured)
+            for step in plans:
+                on_step(step)
+            return plans
+
+        classified = self.classify_plan(question)
+        if classified is not None:
+            print("--- Plan from local step classifier ---")
+            plans = self.merge_plan_with_user_content(classified, user_content_structured)
+            for step in plans:
+                on_step(step)
+            return plans
+
+        windows = self.chunk_windows(len(question))
+        if windows:
+            # Chunks are planned concurrently instead of streamed; emit once merged.
+            plan = await self._plan_chunked_async(question, windows, cache_key)
+            plans = self.merge_plan_with_user_content(plan, user_content_structured)
+            for step in plans:
+                on_step(step)
+            return plans
+
+        print("--- Generating plan (streaming) ---")
+
+        parser = StreamingPlanParser(self.llm_client.structured_output)
+        chunks: list[str] = []
+        emitted: list[dict] = []
+        started = time.perf_counter()
+        stream_failed = False
+        try:
+            async for delta in self.llm_client.client.chat_completion_stream(messages=messages, schema="plan", kind="plan"):
+                chunks.append(delta)
+                for step in parser.feed(delta):
+                    index = len(emitted)
+                    if index >= len(user_content_structured):
+                        continue
+                    merged = self.merge_plan_with_user_content([step], user_content_structured[index : index + 1])[0]
+                    if not emitted:
+                        metrics.observe("plan_stream.first_step", time.perf_counter() - started)
+                    emitted.append(merged)
+                    on_step(merged)
+        except Exception as e:
+            stream_failed = True
+            print(f"❌ Error while calling LLM API: {e}")
+        metrics.observe("plan_stream.full", time.perf_counter() - started)
+
+        response_text = "".join(chunks)
+        print(f"✅ Plan generated:\n{response_text}")
+
+        # A stream cut off mid-reply can still parse as a shorter plan; never cache that.
+        plans = self.finish_plan(response_text, user_content_structured, question, cache_key, complete=not stream_failed)
+        if any(a != b for a, b in zip(emitted, plans)) or len(plans) < len(emitted):
+            metrics.incr("plan_stream.mismatch")
+            print("Warning: streamed plan steps differ from the final parsed plan")
+        for step in plans[len(emitted):]:
+            on_step(step)
+        return plans
+
+    def prepare(self, question):
+        """Build the planner messages, the local per-step data the reply is merged with, and duplicate groups."""
+
+        messages, user_content_structured, user_act_images = self.prepare_messages(question)
+        return messages, user_content_structured, self.duplicate_groups(user_act_images)
+
+    def prepare_messages(self, question):
+        """Planner messages and per-step merge data; returns the actual images for `duplicate_groups`."""
 
-        group_duplicates = [[i + 1 for i in g] for g in group_duplicates]
+        if image_prep_enabled(self.llm_client.args):
+            # Standard images are inlined into the planner request; fetch them concurrently first.
+            get_image_store().prefetch(
+                [step.get("standard_image_url") for step in question],
+                max_workers=self._fetch_workers,
+            )
+
+        content_structured, user_content_structured, user_act_images = self.assemble_json(question)
 
         messages=[
-            {"role": "system", "content": PLANNER_PROMPT_TEMPLATE},
+            {"role": "system", "content": self.prompt_template},
             {"role": "user", "content": content_structured},
         ]
+        return messages, user_content_structured, user_act_images
 
-        print("--- Generating plan ---")
+    def duplicate_groups(self, user_act_images) -> list[list[int]]:
+        """1-based step groups whose actual screenshots are perceptual duplicates."""
 
-        response_text = self.llm_client.think(messages=messages) or ""
+        group_duplicates = self.found_duplicates_images(user_act_images)
+        return [[i + 1 for i in g] for g in group_duplicates]
+
+    @property
+    def _fetch_workers(self) -> int:
+        return int(getattr(self.llm_client.args, "image_fetch_workers", 8) or 1)
+
+    def finish_plan(
+        self,
+        response_text: str,
+        user_content_structured,
+        question=None,
+        cache_key: str | None = None,
+        complete: bool = True,
+    ) -> list[dict]:
+
+        plan = self.parse_plan(response_text, self.llm_client.structured_output)
+        if plan is None:
+            print(f"Raw response: {response_text}")
+            return []
+
+        if isinstance(plan, list):
+            self._record_llm_plan(cache_key, plan, question, complete)
+            return self.merge_plan_with_user_content(plan, user_content_structured)
+        return user_content_structured
+
+    def _record_llm_plan(self, cache_key: str | None, plan: list[dict], question, complete: bool = True) -> None:
+        """Measure classifier agreement with a fresh planner-LLM plan and cache it.
+
+        Only whole plans are cached: not when `complete` is False (a window
+        failed or the reply was cut off), when the plan has fewer steps than
+        the case, or when a step has no step type (a chunk placeholder).
+        Otherwise a transient failure would be served from the cache forever.
+        """
+
+        if self._classifier_enabled and question:
+            classifier = get_step_classifier(self._plan_cache_dir)
+            predictions = [classifier.predict(step.get("standard_text", "")) for step in question]
+            record_agreement(predictions, plan, self._classifier_min_confidence)
+
+        if not plan or not cache_key or self.plan_cache is None:
+            return
+        if (
+            not complete
+            or (question and len(plan) != len(question))
+            or any(not str(step.get("step_type") or "").strip() for step in plan if isinstance(step, dict))
+        ):
+            metrics.incr("plan_cache.skipped_partial")
+            print("Warning: plan is incomplete; not storing it in the plan cache")
+            return
+        try:
+            standard_texts = [str(step.get("standard_text") or "") for step in (question or [])]
+            self.plan_cache.put(cache_key, plan, standard_texts, self.prompt_version)
+        except Exception as e:
+            print(f"Warning: could not store plan in cache: {e}")
 
-        print(f"✅ Plan generated:\n{response_text}")
+    @property
+    def _plan_cache_dir(self) -> str | None:
+        return getattr(self.llm_client.args, "plan_cache_dir", None)
+
+    @property
+    def _classifier_enabled(self) -> bool:
+        args = self.llm_client.args
+        return bool(getattr(args, "step_classifier", False) or getattr(args, "step_classifier_shadow", False))
+
+    @property
+    def _classifier_min_confidence(self) -> float:
+        return float(getattr(self.llm_client.args, "step_classifier_min_confidence", 0.3))
+
+    @property
+    def _classifier_min_examples(self) -> int:
+        return int(getattr(self.llm_client.args, "step_classifier_min_examples", 200))
+
+    def classify_plan(self, question) -> list[dict] | None:
+        """Plan from the local step-type classifier when it is confident for every step, else None.
+
+        Only cases whose standard texts are all English are bypassed: the
+        planner's "text" is an English step description, and the standard
+        text is the closest local stand-in for it. Until the classifier has
+        enough training examples and has seen every planner step type it runs
+        in shadow mode only.
+        """
+
+        if not self._classifier_enabled or not question:
+            return None
+        metrics.incr("step_classifier.cases")
+        if getattr(self.llm_client.args, "step_classifier_shadow", False):
+            return None
+
+        classifier = get_step_classifier(self._plan_cache_dir)
+        if classifier.unready_reason(self._classifier_min_examples):
+            metrics.incr("step_classifier.not_ready")
+            return None
+        plan = []
+        for index, step in enumerate(question):
+            standard_text = " ".join(str(step.get("standard_text") or "").split())
+            if not looks_english(standard_text):
+                metrics.incr("step_classifier.non_english")
+                return None
+            step_type, confidence = classifier.predict(standard_text)
+            if step_type is None or confidence < self._classifier_min_confidence:
+                return None
+            plan.append({
+                "step_number": step.get("step_number", index + 1),
+                "step_type": step_type,
+                "text": standard_text,
+            })
+        metrics.incr("step_classifier.bypassed")
+        return plan
+
+    def chunk_windows(self, step_count: int) -> list[tuple[int, int]]:
+        """Overlapping [start, end) step windows, or [] when the case fits in one request."""
+
+        size = int(getattr(self.llm_client.args, "plan_chunk_size", 0) or 0)
+        if size <= 0 or step_count <= size:
+            return []
+        overlap = min(max(int(getattr(self.llm_client.args, "plan_chunk_overlap", 0) or 0), 0), size - 1)
+        stride = size - overlap
+        windows = []
+        start = 0
+        while True:
+            end = min(start + size, step_count)
+            windows.append((start, end))
+            if end == step_count:
+                return windows
+            start += stride
+
+    def window_messages(self, question, start: int, end: int) -> list[dict]:
+        """Planner messages for steps [start, end) of a longer case."""
+
+        content_structured, _, _ = self.assemble_json(question[start:end])
+        first = question[start].get("step_number", start + 1)
+        last = question[end - 1].get("step_number", end)
+        note = {
+            "type": "text",
+            "text": (
+                f"These are Step Numbers {first} to {last} of a longer test case ({len(question)} steps in total). "
+                "Plan exactly these steps and keep their Step Numbers."
+            ),
+        }
+        return [
+            {"role": "system", "content": self.prompt_template},
+            {"role": "user", "content": [note, *content_structured]},
+        ]
+
+    async def _plan_chunked_async(self, question, windows: list[tuple[int, int]], cache_key: str | None) -> list[dict]:
+        print(f"--- Generating plan in {len(windows)} chunks ---")
+        messages = await asyncio.to_thread(lambda: [self.window_messages(question, *w) for w in windows])
+        replies = await asyncio.gather(*(
+            self.llm_client.think_async(messages=m, schema="plan", kind="plan") for m in messages
+        ))
+        plan, complete = self.merge_chunk_plans(question, windows, [r or "" for r in replies])
+        self._record_llm_plan(cache_key, plan, question, complete)
+        return plan
+
+    def merge_chunk_plans(self, question, windows: list[tuple[int, int]], replies: list[str]) -> list[dict]:
+        """Merge per-window plans into one plan numbered like `question`.
+
+        Each step is taken from the window where it sits furthest from a window
+        edge, since that window saw the most surrounding context. Steps no
+        window planned get a placeholder so positions still line up.
+        Returns (plan, complete); complete is False when any window failed
+        to parse or any step is a placeholder.
+        """
+
+        number_to_index = {step.get("step_number", i + 1): i for i, step in enumerate(question)}
+        candidates: dict[int, list[tuple[int, dict]]] = {}
+        complete = True
+
+        for (start, end), reply in zip(windows, replies):
+            plan = self.parse_plan(reply, self.llm_client.structured_output)
+            if not isinstance(plan, list):
+                metrics.incr("plan_chunk.failed_windows")
+                complete = False
+                print(f"Warning: plan chunk for steps {start + 1}-{end} could not be parsed")
+                continue
+            positional = len(plan) == end - start
+            for offset, entry in enumerate(plan):
+                if not isinstance(entry, dict):
+                    continue
+                index = start + offset if positional else number_to_index.get(entry.get("step_number"))
+                if index is None or not start <= index < end:
+                    continue
+                margin = min(index - start, end - 1 - index)
+                candidates.setdefault(index, []).append((margin, entry))
+
+        merged = []
+        for index, step in enumerate(question):
+            step_number = step.get("step_number", index + 1)
+            options = candidates.get(index)
+            if options:
+                entry = max(options, key=lambda item: item[0])[1]
+            else:
+                metrics.incr("plan_chunk.missing_steps")
+                complete = False
+                entry = {"step_type": "", "text": str(step.get("standard_text") or "")}
+            merged.append({**entry, "step_number": step_number} if "step_number" in entry else {"step_number": step_number, **entry})
+        metrics.incr("plan_chunk.windows", len(windows))
+        return merged, complete
+
+    def parse_plan(self, response_text: str, structured: bool):
+        """Parse the planner reply; returns None when the reply is unusable."""
+
+        if structured:
+            parsed = parse_structured(response_text)
+            steps = parsed.get("steps") if parsed else None
+            ok = isinstance(steps, list)
+            record_parse("plan", True, ok)
+            if not ok:
+                print("❌ Error parsing plan: structured response is not a steps object")
+                return None
+            return steps
 
         try:
 
@@ -60,19 +541,17 @@ class Planner:
 
             plan = ast.literal_eval(plan_str)
 
-            if isinstance(plan, list):
-                plan = self.merge_plan_with_user_content(plan, user_content_structured)
-            else:
-                plan = user_content_structured
-
-            return plan, group_duplicates
         except (ValueError, SyntaxError, IndexError) as e:
             print(f"❌ Error parsing plan: {e}")
-            print(f"Raw response: {response_text}")
-            return [], group_duplicates
+            record_parse("plan", False, False)
+            return None
         except Exception as e:
             print(f"❌ Unknown error while parsing plan: {e}")
-            return [], group_duplicates
+            record_parse("plan", False, False)
+            return None
+
+        record_parse("plan", False, isinstance(plan, list))
+        return plan
 
     def assemble_json(self, steps_json) -> list[dict]:
 
@@ -94,10 +573,7 @@ class Planner:
                     "text": f"=== Step Number {step['step_number']} ===\nStandard Text: {step['standard_text']}\nStandard Image:"
                 })
 
-                content_structured.append({
-                    "type": "image_url",
-                    "image_url": {"url": standard_image_url}
-                })
+                content_structured.append(prepare_image_part(standard_image_url, args=self.llm_client.args))
             else:
                 content_structured.append({
                     "type": "text",
@@ -150,6 +626,10 @@ class Planner:
             candidate = Path(url)
         if not candidate.exists() or not candidate.is_file():
             return None
+        try:
+            return get_image_store().data_url(str(candidate))
+        except Exception:
+            pass
         mime, _ = mimetypes.guess_type(candidate.name)
         if not mime:
             mime = "image/png"
@@ -180,7 +660,7 @@ class Planner:
 
     def found_duplicates_images(self, items):
 
-        _, duplicates = find_duplicates_in_items(items)
+        _, duplicates = find_duplicates_in_items(items, hash_fn=get_image_store().phash, max_workers=self._fetch_workers)
         groups = duplicate_pairs_to_groups(duplicates)
 
         return groups
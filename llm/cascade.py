@@ -0,0 +1,108 @@
+import random
+
+from utils.metrics import metrics
+
+
+CASCADE_CONFIDENCE_INSTRUCTION = (
+    "In final_summary also return \"confidence\": a number between 0 and 1 for how certain you are "
+    "that final_result is right. Use a value below 0.5 whenever the screenshot or description is "
+    "ambiguous, partially visible, or the step type rule does not clearly decide the case."
+)
+
+
+def with_confidence_request(messages: list[dict]) -> list[dict]:
+    """Append the confidence instruction at the very end so the cached prefix is unchanged."""
+
+    out = [dict(m) for m in messages]
+    last = out[-1]
+    content = last.get("content")
+    if isinstance(content, list):
+        last["content"] = [*content, {"type": "text", "text": CASCADE_CONFIDENCE_INSTRUCTION}]
+    else:
+        last["content"] = f"{content or ''}\n\n{CASCADE_CONFIDENCE_INSTRUCTION}"
+    return out
+
+
+def _confidence_of(verdict: dict | None) -> float:
+    try:
+        return float((verdict or {}).get("confidence"))
+    except (TypeError, ValueError):
+        return 0.0
+
+
+async def cascade_judge(client, messages: list[dict], step_type: str, interpret, kind: str = "judge") -> dict | None:
+    """Judge with the cheap model first and escalate to the primary model when needed.
+
+    `interpret(content)` turns a reply into the worker's verdict dict (or None).
+    Only a Correct verdict at or above --cascade_min_confidence is accepted
+    from the cheap model; everything else is re-judged by the primary model
+    as a `kind` call.
+    """
+
+    args = client.args
+    step_key = step_type or "unknown"
+    metrics.incr(f"cascade.{step_key}.total")
+
+    cheap_content = await client.chat_completion_async(
+        messages=with_confidence_request(messages),
+        schema="final_summary_confidence",
+        kind="judge_cheap",
+        model=args.cascade_model,
+        step_type=step_type,
+    )
+    cheap = interpret(cheap_content)
+    confidence = _confidence_of(cheap)
+
+    accept = (
+        cheap is not None
+        and cheap["final_result"] == "Correct"
+        and confidence >= float(args.cascade_min_confidence)
+    )
+    audit = accept and random.random() < float(getattr(args, "cascade_audit_rate", 0) or 0)
+    if accept and not audit:
+        metrics.incr(f"cascade.{step_key}.accepted")
+        return cheap
+
+    if not accept:
+        metrics.incr(f"cascade.{step_key}.escalated")
+        print(
+            f"[cascade] {step_key}: escalating "
+            f"(cheap={cheap['final_result'] if cheap else 'invalid'}, confidence={confidence:.2f})"
+        )
+    else:
+        metrics.incr(f"cascade.{step_key}.audited")
+
+    primary_content = await client.chat_completion_async(
+        messages=messages,
+        schema="final_summary",
+        kind=kind,
+        step_type=step_type,
+    )
+    primary = interpret(primary_content)
+
+    if cheap is not None and primary is not None:
+        metrics.incr(f"cascade.{step_key}.compared")
+        if cheap["final_result"] == primary["final_result"]:
+            metrics.incr(f"cascade.{step_key}.agree")
+    return primary
+
+
+def cascade_report() -> list[str]:
+    counters = metrics.snapshot()["counters"]
+    step_types = sorted({k[len("cascade."):].rsplit(".", 1)[0] for k in counters if k.startswith("cascade.")})
+    lines = []
+    for step_type in step_types:
+        total = counters.get(f"cascade.{step_type}.total", 0)
+        escalated = counters.get(f"cascade.{step_type}.escalated", 0)
+        compared = counters.get(f"cascade.{step_type}.compared", 0)
+        agree = counters.get(f"cascade.{step_type}.agree", 0)
+        escalation = escalated / total if total else 0.0
+        agreement = f"{agree / compared:.1%}" if compared else "n/a"
+        lines.append(
+            f"{step_type}: escalated {int(escalated)}/{int(total)} ({escalation:.1%}), "
+            f"agreement with primary {agreement} over {int(compared)} compared"
+        )
+    return lines
+
+
+metrics.add_report_section("Model cascade", cascade_report)
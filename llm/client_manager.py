@@ -1,13 +1,123 @@
 import os
 import sys
-import logging
+import time
 import asyncio
+import threading
+from collections import deque
 
 # Allow running this file directly (python llm/client_manager.py)
 if __package__ is None or __package__ == "":
     sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
 
 from llm.models import ModelSelector, build_chat_request_kwargs
+from llm.structured_output import matches_schema, response_format_for
+from llm.routing import RoutingTable, record_route_latency
+from utils.metrics import metrics
+
+
+def usage_of(response) -> dict:
+    """Token usage of a chat completion, including provider-side cached prompt tokens."""
+
+    # Batch output files carry the response body as a plain dict.
+    def _get(obj, name):
+        if isinstance(obj, dict):
+            return obj.get(name)
+        return getattr(obj, name, None)
+
+    usage = _get(response, "usage")
+    if usage is None:
+        return {"prompt_tokens": 0, "cached_tokens": 0, "completion_tokens": 0}
+    details = _get(usage, "prompt_tokens_details")
+    return {
+        "prompt_tokens": int(_get(usage, "prompt_tokens") or 0),
+        "cached_tokens": int(_get(details, "cached_tokens") or 0) if details is not None else 0,
+        "completion_tokens": int(_get(usage, "completion_tokens") or 0),
+    }
+
+
+def _first_content(response) -> str | None:
+    if response.choices and len(response.choices) > 0:
+        return (response.choices[0].message.content or "").strip()
+    return None
+
+
+def record_usage(kind: str, usage: dict, elapsed: float | None) -> None:
+    metrics.incr(f"calls.{kind}")
+    metrics.incr(f"tokens.{kind}.prompt", usage["prompt_tokens"])
+    metrics.incr(f"tokens.{kind}.cached", usage["cached_tokens"])
+    metrics.incr(f"tokens.{kind}.completion", usage["completion_tokens"])
+    latency = ""
+    if elapsed is not None:
+        metrics.observe(f"latency.{kind}", elapsed)
+        latency = f" latency={elapsed:.2f}s"
+    print(
+        f"[usage] {kind}: prompt_tokens={usage['prompt_tokens']} "
+        f"cached_tokens={usage['cached_tokens']} completion_tokens={usage['completion_tokens']}{latency}"
+    )
+
+
+def token_usage_report() -> list[str]:
+    lines = []
+    counters = metrics.snapshot()["counters"]
+    kinds = sorted({k.split(".")[1] for k in counters if k.startswith("calls.")})
+    for kind in kinds:
+        prompt = counters.get(f"tokens.{kind}.prompt", 0)
+        cached = counters.get(f"tokens.{kind}.cached", 0)
+        ratio = (cached / prompt) if prompt else 0.0
+        lines.append(
+            f"{kind}: calls={int(counters.get(f'calls.{kind}', 0))} prompt_tokens={int(prompt)} "
+            f"cached_tokens={int(cached)} ({ratio:.1%}) completion_tokens={int(counters.get(f'tokens.{kind}.completion', 0))}"
+        )
+    return lines
+
+
+def hedge_report() -> list[str]:
+    lines = []
+    counters = metrics.snapshot()["counters"]
+    kinds = sorted({k.split(".")[1] for k in counters if k.startswith("hedge.") and k.endswith(".calls")})
+    for kind in kinds:
+        calls = counters.get(f"hedge.{kind}.calls", 0)
+        fired = counters.get(f"hedge.{kind}.fired", 0)
+        won = counters.get(f"hedge.{kind}.won", 0)
+        wasted = counters.get(f"hedge.{kind}.wasted_tokens", 0)
+        rate = fired / calls if calls else 0.0
+        lines.append(
+            f"{kind}: hedged {int(fired)}/{int(calls)} calls ({rate:.1%}), "
+            f"hedge won {int(won)}, wasted_tokens={int(wasted)}"
+        )
+    return lines
+
+
+metrics.add_report_section("Token usage", token_usage_report)
+metrics.add_report_section("Hedged requests", hedge_report)
+
+
+class LatencyTracker:
+    """Rolling per-kind latency window used to pick the hedging threshold.
+
+    Shared by every ClientManager in the process so the p95 estimate keeps
+    improving across rows.
+    """
+
+    def __init__(self, window: int = 200):
+        self._lock = threading.Lock()
+        self._window = window
+        self._samples: dict[str, deque] = {}
+
+    def add(self, kind: str, elapsed: float) -> None:
+        with self._lock:
+            self._samples.setdefault(kind, deque(maxlen=self._window)).append(elapsed)
+
+    def quantile(self, kind: str, q: float, min_samples: int) -> float | None:
+        with self._lock:
+            values = sorted(self._samples.get(kind, ()))
+        if len(values) < min_samples:
+            return None
+        idx = min(len(values) - 1, max(0, int(round(q * (len(values) - 1)))))
+        return values[idx]
+
+
+latency_tracker = LatencyTracker()
 
 
 class ClientManager:
@@ -19,51 +129,245 @@ class ClientManager:
 
         selector = ModelSelector(mode=self.mode, model_name=self.model)
         self.client = getattr(selector, "client", None)
+        self.async_client = getattr(selector, "async_client", None)
+        self._selectors: dict[str, ModelSelector] = {self.model: selector}
 
-    def chat_completion(
-        self,
-        messages: list,
-    ):
+        self.routing = None
+        if getattr(args, "routing", False) or getattr(args, "routing_table", None):
+            self.routing = RoutingTable.load(getattr(args, "routing_table", None))
+
+    def _async_client_for(self, model: str):
+        # Different deployments can live on different endpoints (see ModelSelector).
+        selector = self._selectors.get(model)
+        if selector is None:
+            selector = ModelSelector(mode=self.mode, model_name=model)
+            self._selectors[model] = selector
+        return getattr(selector, "async_client", None), getattr(selector, "client", None)
+
+    @property
+    def structured_output(self) -> bool:
+        return bool(getattr(self.args, "structured_output", False))
+
+    def _response_format(self, schema: str | None) -> dict | None:
+        if not schema or not self.structured_output:
+            return None
+        return response_format_for(schema)
+
+    def _content_of(self, response, kind: str, started: float) -> str | None:
+        record_usage(kind, usage_of(response), time.perf_counter() - started)
+
+        return _first_content(response)
+
+    def _route(self, kind: str, step_type: str | None):
+        return self.routing.resolve(kind, step_type) if self.routing else None
 
-        request_kwargs = build_chat_request_kwargs(
+    def model_for(self, kind: str, step_type: str | None = None) -> str:
+        route = self._route(kind, step_type)
+        return (route.model if route else None) or self.model
+
+    def _request_kwargs(self, messages: list, schema: str | None, model: str | None = None, route=None) -> dict:
+        model = model or (route.model if route else None) or self.model
+        return build_chat_request_kwargs(
             messages=messages,
-            model=self.model,
-            max_tokens=self.args.max_tokens,
+            model=model,
+            max_tokens=(route.max_tokens if route else None) or self.args.max_tokens,
             temperature=self.args.temperature,
             top_p=self.args.top_p,
             timeout=self.args.timeout,
+            response_format=self._response_format(schema),
+            reasoning_effort=route.reasoning_effort if route else None,
+            # The route's reasoning flag describes the route's model, not a model passed in explicitly.
+            reasoning=route.reasoning if route and route.model == model else None,
         )
 
-        response = self.client.chat.completions.create(**request_kwargs)
+    def _client_for(self, model: str | None):
+        if model in (None, self.model):
+            return self.client
+        return self._async_client_for(model)[1]
+
+    def _should_hedge(self, kind: str) -> bool:
+        if not getattr(self.args, "hedge", False):
+            return False
+        kinds = {k.strip() for k in str(getattr(self.args, "hedge_kinds", "judge") or "").split(",") if k.strip()}
+        return kind in kinds
+
+    async def _create_async(self, request_kwargs: dict):
+        async_client, client = self._async_client_for(request_kwargs["model"])
+        if async_client is not None:
+            return await async_client.chat.completions.create(**request_kwargs)
+        return await asyncio.to_thread(client.chat.completions.create, **request_kwargs)
+
+    async def _hedged_create(self, messages: list, schema: str | None, kind: str, route=None):
+        """Send the request; if it is slower than the adaptive p95, race a duplicate.
+
+        The first response with non-empty content wins and the other request
+        is cancelled. For structured calls the content must also parse for
+        `schema`; a reply that does not keeps the race going.
+        """
+
+        delay = latency_tracker.quantile(
+            kind,
+            float(getattr(self.args, "hedge_quantile", 0.95)),
+            int(getattr(self.args, "hedge_min_samples", 20)),
+        )
+        if delay is None:
+            delay = float(getattr(self.args, "hedge_delay", 30))
+        delay = max(delay, float(getattr(self.args, "hedge_min_delay", 5)))
+
+        metrics.incr(f"hedge.{kind}.calls")
+        primary_kwargs = self._request_kwargs(messages, schema, route=route)
+        primary = asyncio.create_task(self._create_async(primary_kwargs))
+        done, _ = await asyncio.wait({primary}, timeout=delay)
+        if done:
+            return primary.result()
+
+        metrics.incr(f"hedge.{kind}.fired")
+        hedge_model = getattr(self.args, "hedge_model", None) or primary_kwargs["model"]
+        print(f"[hedge] {kind}: no answer after {delay:.1f}s, sending duplicate to {hedge_model}")
+        backup = asyncio.create_task(self._create_async(self._request_kwargs(messages, schema, model=hedge_model, route=route)))
+
+        pending = {primary, backup}
+        winner = None
+        try:
+            while pending and winner is None:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None and self._usable(task.result(), schema):
+                        winner = task
+                        break
+        finally:
+            for task in pending:
+                task.cancel()
+
+        loser = backup if winner is primary else primary
+        if winner is None:
+            # Neither produced a usable reply; surface the primary outcome like an unhedged call.
+            return primary.result()
+
+        if winner is backup:
+            metrics.incr(f"hedge.{kind}.won")
+        winner_usage = usage_of(winner.result())
+        if loser.done() and not loser.cancelled() and loser.exception() is None:
+            loser_usage = usage_of(loser.result())
+            wasted = loser_usage["prompt_tokens"] + loser_usage["completion_tokens"]
+        else:
+            # A cancelled request is still billed for its input; estimate with the winner's prompt.
+            wasted = winner_usage["prompt_tokens"]
+        metrics.incr(f"hedge.{kind}.wasted_tokens", wasted)
+        return winner.result()
+
+    def _usable(self, response, schema: str | None) -> bool:
+        content = _first_content(response)
+        if not content:
+            return False
+        return self._response_format(schema) is None or matches_schema(content, schema)
+
+    def _finish(self, response, kind: str, started: float, route) -> str | None:
+        elapsed = time.perf_counter() - started
+        latency_tracker.add(kind, elapsed)
+        if route is not None:
+            record_route_latency(route, elapsed)
+        return self._content_of(response, kind, started)
+
+    def chat_completion(
+        self,
+        messages: list,
+        schema: str | None = None,
+        kind: str = "chat",
+        step_type: str | None = None,
+    ):
+
+        route = self._route(kind, step_type)
+        request_kwargs = self._request_kwargs(messages, schema, route=route)
 
-        if response.choices and len(response.choices) > 0:
-            return response.choices[0].message.content.strip()
+        started = time.perf_counter()
+        response = self._client_for(request_kwargs["model"]).chat.completions.create(**request_kwargs)
 
-        return None
+        return self._finish(response, kind, started, route)
 
     async def chat_completion_async(
         self,
         messages: list,
+        schema: str | None = None,
+        kind: str = "chat",
+        model: str | None = None,
+        step_type: str | None = None,
     ):
 
-        request_kwargs = build_chat_request_kwargs(
-            messages=messages,
-            model=self.model,
-            max_tokens=self.args.max_tokens,
-            temperature=self.args.temperature,
-            top_p=self.args.top_p,
-            timeout=self.args.timeout,
-        )
+        route = self._route(kind, step_type)
+
+        if model is None and self._should_hedge(kind):
+            started = time.perf_counter()
+            response = await self._hedged_create(messages, schema, kind, route=route)
+            return self._finish(response, kind, started, route)
 
+        request_kwargs = self._request_kwargs(messages, schema, model=model, route=route)
+        client = self._client_for(request_kwargs["model"])
 
+        started = time.perf_counter()
         response = await asyncio.to_thread(
-            self.client.chat.completions.create, **request_kwargs
+            client.chat.completions.create, **request_kwargs
         )
 
-        if response.choices and len(response.choices) > 0:
-            return response.choices[0].message.content.strip()
+        return self._finish(response, kind, started, route)
+
+    async def chat_completion_stream(
+        self,
+        messages: list,
+        schema: str | None = None,
+        kind: str = "chat",
+        step_type: str | None = None,
+    ):
+        """Async generator of content deltas; usage and latency are recorded when the stream ends."""
+
+        route = self._route(kind, step_type)
+        request_kwargs = self._request_kwargs(messages, schema, route=route)
+        async_client, _ = self._async_client_for(request_kwargs["model"])
+
+        started = time.perf_counter()
+        if async_client is None:
+            # No async client for this deployment: fall back to one blocking call.
+            client = self._client_for(request_kwargs["model"])
+            response = await asyncio.to_thread(client.chat.completions.create, **request_kwargs)
+            content = self._finish(response, kind, started, route)
+            if content:
+                yield content
+            return
+
+        stream = await async_client.chat.completions.create(
+            **request_kwargs,
+            stream=True,
+            stream_options={"include_usage": True},
+        )
+        usage = None
+        try:
+            async for chunk in stream:
+                if getattr(chunk, "usage", None) is not None:
+                    usage = chunk
+                if chunk.choices:
+                    delta = chunk.choices[0].delta.content
+                    if delta:
+                        yield delta
+        finally:
+            close = getattr(stream, "close", None)
+            if close is not None:
+                try:
+                    await close()
+                except Exception:
+                    pass
 
-        return None
+        elapsed = time.perf_counter() - started
+        latency_tracker.add(kind, elapsed)
+        if route is not None:
+            record_route_latency(route, elapsed)
+        record_usage(kind, usage_of(usage), elapsed)
 
     async def aclose(self):
+        for selector in self._selectors.values():
+            async_client = getattr(selector, "async_client", None)
+            if async_client is not None:
+                try:
+                    await async_client.close()
+                except Exception:
+                    pass
         return None
\ No newline at end of file
@@ -0,0 +1,140 @@
+import json
+
+
+# Message layout is ordered for provider-side prefix caching: the system
+# message only holds text that is identical for every step of a given step
+# type (role, output format, then the step type rule), and everything that
+# changes per step (history, descriptions, screenshot) goes into the user
+# message after it.
+COMPARISON_SYSTEM_PROMPT="""
+## ROLE
+You are a top-notch functional testing expert: extremely proficient in functional testing.
+
+## GOAL
+The plot and step descriptions, as well as historical steps, are used to determine the current step's test result.
+
+## Output JSON Format
+Output actions for EACH Section in the following JSON format:
+{{
+    "final_summary": {{
+        "final_result": "Correct" | "Incorrect" | "Spam" | "NeedDiscussion",
+        "reason": "Explanation for the final result."
+    }}
+}}
+
+## INPUT VARIABLES
+
+step_type_rule:{step_type_rule}
+"""
+
+
+HISTORY_ENCODINGS = ("json", "ranges")
+
+
+def history_encoding_of(args) -> str:
+    """The --history_encoding of `args`, "json" when unset."""
+
+    return str(getattr(args, "history_encoding", "json") or "json")
+
+
+def _step_ranges(step_numbers: list[int]) -> str:
+    ranges = []
+    for number in sorted(set(step_numbers)):
+        if ranges and number == ranges[-1][1] + 1:
+            ranges[-1][1] = number
+        else:
+            ranges.append([number, number])
+    return ", ".join(str(a) if a == b else f"{a}-{b}" for a, b in ranges)
+
+
+def encode_history_ranges(history_steps: list[dict]) -> str:
+    """History as step ranges per result, e.g. "steps 1-14, 16: Correct"; reasons are dropped."""
+
+    if not history_steps:
+        return "none"
+    by_result: dict[str, list[int]] = {}
+    other = []
+    for entry in history_steps:
+        try:
+            by_result.setdefault(str(entry.get("final_result", "")), []).append(int(entry.get("step_number")))
+        except (TypeError, ValueError):
+            other.append(entry)
+    parts = [f"steps {_step_ranges(numbers)}: {result}" for result, numbers in by_result.items()]
+    if other:
+        parts.append(json.dumps(other, ensure_ascii=False))
+    return "; ".join(parts)
+
+
+def format_history(history_steps: list[dict], encoding: str = "json") -> str:
+    if encoding == "ranges":
+        return encode_history_ranges(history_steps)
+    return json.dumps(history_steps, ensure_ascii=False)
+
+
+def build_judge_messages(
+    step_type_rule: str,
+    history_steps: list[dict],
+    user_content_structured: list[dict],
+    history_encoding: str = "json",
+) -> list[dict]:
+
+    system_prompt_step = COMPARISON_SYSTEM_PROMPT.format(step_type_rule=step_type_rule or "")
+    history_part = {"type": "text", "text": f"history_step_results: {format_history(history_steps, history_encoding)}"}
+
+    return [
+        {"role": "system", "content": system_prompt_step},
+        {"role": "user", "content": [history_part, *user_content_structured]},
+    ]
+
+
+# Several consecutive steps judged in one request. Each step type rule is
+# sent once, and the steps before the window that were judged Correct still
+# travel as history_step_results.
+MULTI_STEP_SYSTEM_PROMPT="""
+## ROLE
+You are a top-notch functional testing expert: extremely proficient in functional testing.
+
+## GOAL
+Several consecutive steps of one test case are given, each with its step type, descriptions and screenshot.
+Determine the test result of every given step, in order. Judge each step as if all earlier steps in this request were Correct;
+history_step_results lists the earlier steps of the case that were already judged Correct.
+Apply to each step the step type rule of its own step type.
+
+## Output JSON Format
+Output exactly one element per given step, in the given order, in the following JSON format:
+{{
+    "final_summary": [
+        {{
+            "step_number": Step Number,
+            "final_result": "Correct" | "Incorrect" | "Spam" | "NeedDiscussion",
+            "reason": "Explanation for the final result."
+        }}
+    ]
+}}
+
+## INPUT VARIABLES
+
+step_type_rules:
+{step_type_rules}
+"""
+
+
+def build_multi_step_judge_messages(
+    step_type_rules: dict[str, str],
+    history_steps: list[dict],
+    steps: list[tuple[int, str, list[dict]]],
+    history_encoding: str = "json",
+) -> list[dict]:
+    """Judge messages for a window of `(step_number, step_type, user_content)` steps."""
+
+    rules = "\n\n".join(f"### {step_type or 'General'}\n{rule}" for step_type, rule in step_type_rules.items())
+    system_prompt = MULTI_STEP_SYSTEM_PROMPT.format(step_type_rules=rules)
+    content = [{"type": "text", "text": f"history_step_results: {format_history(history_steps, history_encoding)}"}]
+    for step_number, step_type, user_content in steps:
+        content.append({"type": "text", "text": f"=== Step Number {step_number} (step type: {step_type or 'General'}) ==="})
+        content.extend(user_content)
+
+    return [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": content},
+    ]
@@ -123,6 +123,13 @@ if __name__ == "__main__":
     print(f"Selected model: {selector.selected_model}")
 
 
+def is_reasoning_model(model: str | None) -> bool:
+    """Reasoning models (gpt-5*, o1/o3/o4*) reject temperature and top_p; the gpt-5 chat models accept them."""
+
+    name = str(model or "")
+    return name.startswith(("gpt-5", "o1", "o3", "o4")) and "chat" not in name
+
+
 def build_chat_request_kwargs(
     *,
     messages: list,
@@ -131,18 +138,30 @@ def build_chat_request_kwargs(
     temperature: float | None = None,
     top_p: float | None = None,
     timeout: int | None = None,
+    response_format: dict | None = None,
+    reasoning_effort: str | None = None,
+    reasoning: bool | None = None,
 ) -> dict:
+    """Chat completion kwargs; `reasoning` overrides is_reasoning_model(model) for deployment names."""
+
+    if reasoning is None:
+        reasoning = is_reasoning_model(model)
 
     request_kwargs: dict = {
         "messages": messages,
         "model": model,
         "timeout": timeout,
-        "top_p": top_p,
         "max_completion_tokens": max_tokens,
     }
 
-
-    if model not in {"gpt-5", "gpt-5.2"}:
+    if not reasoning:
+        request_kwargs["top_p"] = top_p
         request_kwargs["temperature"] = 0 if temperature is None else temperature
 
+    if response_format is not None:
+        request_kwargs["response_format"] = response_format
+
+    if reasoning_effort and reasoning:
+        request_kwargs["reasoning_effort"] = reasoning_effort
+
     return request_kwargs
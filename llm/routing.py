@@ -0,0 +1,149 @@
+import json
+from dataclasses import dataclass
+from pathlib import Path
+
+from enums.issue_enum import SceneEnum, ScenarioEnum
+from utils.file_utils import resource_path
+from utils.metrics import metrics
+
+
+@dataclass(frozen=True)
+class Route:
+    model: str | None = None
+    reasoning_effort: str | None = None
+    max_tokens: int | None = None
+    # None: decided from the model name (llm.models.is_reasoning_model); set it for deployment names.
+    reasoning: bool | None = None
+    label: str = "default"
+
+
+ROUTE_KEYS = ("model", "reasoning_effort", "max_tokens", "reasoning")
+
+
+_LOW = {"reasoning_effort": "low", "max_tokens": 2000}
+_MEDIUM = {"reasoning_effort": "medium", "max_tokens": 4000}
+_HIGH = {"reasoning_effort": "high", "max_tokens": 8000}
+
+# Routes are keyed by call kind, then by step type enum *name*; "*" is the
+# fallback inside a kind. Trivial readiness/description checks get a cheap
+# route, branching and layout-heavy checks keep the expensive one.
+DEFAULT_ROUTES: dict[str, dict[str, dict]] = {
+    "judge": {
+        SceneEnum.WAITING.name: _LOW,
+        SceneEnum.DESCRIPTIVE.name: _LOW,
+        SceneEnum.NAVIGATION.name: _LOW,
+        SceneEnum.SCROLL.name: _MEDIUM,
+        SceneEnum.INPUT.name: _MEDIUM,
+        SceneEnum.UI_INTERACTION.name: _MEDIUM,
+        SceneEnum.STATE_VERIFICATION.name: _MEDIUM,
+        SceneEnum.CONDITIONAL.name: _HIGH,
+        ScenarioEnum.NAVIGATION_URL_REDIRECTION.name: _LOW,
+        ScenarioEnum.ENVIRONMENT_PRECONDITION_SETUP.name: _LOW,
+        ScenarioEnum.TAB_WINDOW_MANAGEMENT.name: _LOW,
+        ScenarioEnum.UI_VISIBILITY_LAYOUT_RENDERING_VERIFICATION.name: _HIGH,
+        ScenarioEnum.ADVERTISING_VERIFICATION_REPORTING.name: _HIGH,
+        ScenarioEnum.SEARCH_FUNCTIONALITY_SERP_MODULE_VALIDATION.name: _HIGH,
+        "*": _MEDIUM,
+    },
+    "judge_multi": {
+        # One reason per step in the window, so a larger output cap than a single judgement.
+        "*": {"reasoning_effort": "medium", "max_tokens": 8000},
+    },
+    "judge_cheap": {
+        "*": _LOW,
+    },
+    "plan": {
+        "*": {"reasoning_effort": "low", "max_tokens": 8000},
+    },
+    "identify": {
+        "*": {"reasoning_effort": "low", "max_tokens": 1000},
+    },
+    "optimize": {
+        "*": {"reasoning_effort": "high", "max_tokens": 12000},
+    },
+    "optimize_edit": {
+        # Clause edits instead of the whole rule, so far less room for visible output.
+        "*": {"reasoning_effort": "high", "max_tokens": 8000},
+    },
+}
+
+
+# Shadow judgements (e.g. --history_shadow) run on the judge's routes but are counted separately.
+DEFAULT_ROUTES["judge_shadow"] = DEFAULT_ROUTES["judge"]
+# Per-step fallbacks of an unparseable multi-step reply, counted on the multi-step side.
+DEFAULT_ROUTES["judge_multi_fallback"] = DEFAULT_ROUTES["judge"]
+
+
+def step_type_key(step_type: str | None) -> str:
+    """Map a step type given as enum value or enum name to the enum name."""
+
+    key = str(step_type or "").strip()
+    if not key:
+        return "*"
+    for enum_cls in (SceneEnum, ScenarioEnum):
+        for member in enum_cls:
+            if key in (member.name, member.value):
+                return member.name
+    return key
+
+
+class RoutingTable:
+
+    def __init__(self, routes: dict[str, dict[str, dict]]):
+        self.routes = routes
+
+    @classmethod
+    def load(cls, path: str | None) -> "RoutingTable":
+        """Start from DEFAULT_ROUTES and overlay the JSON file at `path`, if any."""
+
+        routes = {kind: dict(entries) for kind, entries in DEFAULT_ROUTES.items()}
+        if path:
+            overrides = json.loads(Path(resource_path(path)).read_text(encoding="utf-8"))
+            for kind, entries in (overrides or {}).items():
+                merged = routes.setdefault(kind, {})
+                for step_type, route in (entries or {}).items():
+                    unknown = sorted(set(route or {}) - set(ROUTE_KEYS))
+                    if unknown:
+                        # Sampling parameters stay global: reasoning models reject them.
+                        raise ValueError(f"Unknown route setting for {kind}/{step_type}: {', '.join(unknown)}")
+                    key = "*" if step_type == "*" else step_type_key(step_type)
+                    merged[key] = route or {}
+        return cls(routes)
+
+    def resolve(self, kind: str, step_type: str | None = None) -> Route:
+        entries = self.routes.get(kind)
+        if not entries:
+            return Route(label=f"{kind}/default")
+        key = step_type_key(step_type)
+        route = entries.get(key)
+        if route is None:
+            key = "*"
+            route = entries.get("*")
+        if route is None:
+            return Route(label=f"{kind}/default")
+        max_tokens = route.get("max_tokens")
+        return Route(
+            model=route.get("model"),
+            reasoning_effort=route.get("reasoning_effort"),
+            max_tokens=int(max_tokens) if max_tokens else None,
+            reasoning=route.get("reasoning"),
+            label=f"{kind}/{key}",
+        )
+
+
+def record_route_latency(route: Route, elapsed: float) -> None:
+    metrics.observe(f"route.{route.label}", elapsed)
+
+
+def route_report() -> list[str]:
+    timings = metrics.snapshot()["timings"]
+    lines = []
+    for name in sorted(timings):
+        if not name.startswith("route."):
+            continue
+        t = timings[name]
+        lines.append(f"{name[len('route.'):]}: n={t['count']} mean={t['mean']:.2f}s p95={t['p95']:.2f}s")
+    return lines
+
+
+metrics.add_report_section("Route latency", route_report)
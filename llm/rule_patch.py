@@ -0,0 +1,211 @@
+from dataclasses import dataclass
+from difflib import SequenceMatcher
+
+from llm.structured_output import RULE_EDIT_OPS
+from llm.tools.rule_store import get_rule_store, rule_version
+from utils.metrics import metrics
+
+RULE_EDIT_MODES = ("patch", "full")
+
+
+def rule_edit_mode_of(args) -> str:
+    """The --rule_edit_mode of `args`, "patch" when unset."""
+
+    return str(getattr(args, "rule_edit_mode", "patch") or "patch")
+
+
+class RuleEditError(ValueError):
+    """A set of edits that cannot be applied to the rule it was proposed for."""
+
+
+@dataclass(frozen=True)
+class RuleEdit:
+    op: str
+    # 1-based clause number; for "add" the clause to insert after, 0 inserts before the first clause.
+    clause: int
+    text: str = ""
+
+
+def clauses(rule: str) -> list[str]:
+    """Clauses of a step type rule: its non-blank lines, in order."""
+
+    return [line.rstrip() for line in str(rule or "").splitlines() if line.strip()]
+
+
+def number_clauses(rule: str) -> str:
+    """The rule as shown to the optimizer, one "[n] clause" per line."""
+
+    return "\n".join(f"[{number}] {clause}" for number, clause in enumerate(clauses(rule), start=1))
+
+
+def parse_edits(payload: dict | None) -> list[RuleEdit]:
+    """RuleEdits from a {"rule_edits": [{"op", "clause", "text"}, ...]} reply."""
+
+    raw = (payload or {}).get("rule_edits")
+    if not isinstance(raw, list):
+        raise RuleEditError("reply has no rule_edits list")
+    edits = []
+    for item in raw:
+        if not isinstance(item, dict) or item.get("op") not in RULE_EDIT_OPS:
+            raise RuleEditError(f"malformed edit: {item!r}")
+        try:
+            clause = int(item.get("clause"))
+        except (TypeError, ValueError):
+            raise RuleEditError(f"edit without a clause number: {item!r}") from None
+        edits.append(RuleEdit(item["op"], clause, str(item.get("text") or "").strip()))
+    return edits
+
+
+def apply_edits(rule: str, edits: list[RuleEdit]) -> str:
+    """Apply `edits`, all numbered against `rule` as given, keeping blank lines and untouched clauses verbatim.
+
+    Raises RuleEditError when an edit targets a clause that does not exist,
+    two edits replace or delete the same clause, an added or replacing
+    clause is empty, or nothing of the rule would be left.
+    """
+
+    lines = str(rule or "").splitlines()
+    count = sum(1 for line in lines if line.strip())
+    changed: dict[int, RuleEdit] = {}
+    added: dict[int, list[str]] = {}
+    for edit in edits:
+        if edit.op == "add":
+            if not 0 <= edit.clause <= count:
+                raise RuleEditError(f"add after unknown clause {edit.clause} (rule has {count})")
+            if not edit.text:
+                raise RuleEditError(f"empty clause added after {edit.clause}")
+            added.setdefault(edit.clause, []).append(edit.text)
+            continue
+        if not 1 <= edit.clause <= count:
+            raise RuleEditError(f"{edit.op} of unknown clause {edit.clause} (rule has {count})")
+        if edit.clause in changed:
+            raise RuleEditError(f"clause {edit.clause} is edited twice")
+        if edit.op == "replace" and not edit.text:
+            raise RuleEditError(f"clause {edit.clause} replaced with nothing")
+        changed[edit.clause] = edit
+
+    out = list(added.get(0, ()))
+    number = 0
+    for line in lines:
+        if not line.strip():
+            out.append(line)
+            continue
+        number += 1
+        edit = changed.get(number)
+        if edit is None:
+            out.append(line)
+        elif edit.op == "replace":
+            out.append(edit.text)
+        out.extend(added.get(number, ()))
+
+    result = "\n".join(out)
+    if not clauses(result):
+        raise RuleEditError("edits would leave the rule empty")
+    return result + "\n" if str(rule or "").endswith("\n") else result
+
+
+def diff_edits(before: str, after: str) -> list[RuleEdit]:
+    """Clause edits that turn `before` into `after` (up to blank lines)."""
+
+    old, new = clauses(before), clauses(after)
+    edits = []
+    for tag, i1, i2, j1, j2 in SequenceMatcher(None, old, new, autojunk=False).get_opcodes():
+        if tag == "equal":
+            continue
+        paired = min(i2 - i1, j2 - j1)
+        edits.extend(RuleEdit("replace", i1 + k + 1, new[j1 + k]) for k in range(paired))
+        edits.extend(RuleEdit("delete", i + 1) for i in range(i1 + paired, i2))
+        edits.extend(RuleEdit("add", i1 + paired, new[j]) for j in range(j1 + paired, j2))
+    return edits
+
+
+def rebase(before: str, after: str, onto: str) -> str | None:
+    """Replay the change `before` -> `after` on `onto`, a rule another writer changed meanwhile.
+
+    Each edit is moved to the clause of `onto` with the same text. Returns
+    None when an edit targets or follows a clause the other writer changed
+    or removed, so the two changes cannot be combined without a judgement call.
+    """
+
+    old, current = clauses(before), clauses(onto)
+    position = {0: 0}
+    for block in SequenceMatcher(None, old, current, autojunk=False).get_matching_blocks():
+        for k in range(block.size):
+            position[block.a + k + 1] = block.b + k + 1
+    moved = []
+    for edit in diff_edits(before, after):
+        if edit.clause not in position:
+            return None
+        moved.append(RuleEdit(edit.op, position[edit.clause], edit.text))
+    try:
+        return apply_edits(onto, moved)
+    except RuleEditError:
+        return None
+
+
+def write_rule_change(path: str, before: str, after: str, note: str = "", attempts: int = 3) -> str | None:
+    """Store the change `before` -> `after` of the rule at `path`; the new version, or None.
+
+    When another writer changed the rule since `before` was read, the
+    change is rebased onto their version and swapped in again, so
+    concurrent optimizer rows that touch different clauses both land.
+    """
+
+    store = get_rule_store()
+    expected = rule_version(before)
+    for _ in range(attempts):
+        version = store.compare_and_swap(path, expected, after, note)
+        if version is not None:
+            return version
+        current, expected = store.read(path)
+        rebased = rebase(before, after, current)
+        if rebased is None:
+            metrics.incr("rule_edit.rebase_failed")
+            return None
+        metrics.incr("rule_edit.rebased")
+        before, after = current, rebased
+    return None
+
+
+def record_edit_round(rule: str, edits: list[RuleEdit] | None) -> None:
+    """Count one patch-mode optimization round; `edits` is None when the reply was rejected."""
+
+    metrics.incr("rule_edit.rounds")
+    metrics.incr("rule_edit.rule_chars", len(rule))
+    if edits is None:
+        metrics.incr("rule_edit.invalid")
+        return
+    metrics.incr("rule_edit.edits", len(edits))
+    for edit in edits:
+        metrics.incr(f"rule_edit.{edit.op}")
+
+
+def rule_edit_report() -> list[str]:
+    snap = metrics.snapshot()
+    counters, timings = snap["counters"], snap["timings"]
+    lines = []
+    for kind, label in (("optimize", "full rule"), ("optimize_edit", "clause edits")):
+        calls = counters.get(f"calls.{kind}", 0)
+        if not calls:
+            continue
+        completion = counters.get(f"tokens.{kind}.completion", 0)
+        latency = timings.get(f"latency.{kind}")
+        detail = f", latency p50 {latency['p50']:.2f}s p95 {latency['p95']:.2f}s" if latency else ""
+        lines.append(f"{label} ({kind}): {int(calls)} rounds, {completion / calls:.0f} output tokens per round{detail}")
+    rounds = counters.get("rule_edit.rounds", 0)
+    if rounds:
+        applied = rounds - counters.get("rule_edit.invalid", 0)
+        ops = ", ".join(f"{op}={int(counters.get(f'rule_edit.{op}', 0))}" for op in RULE_EDIT_OPS)
+        lines.append(
+            f"edit rounds applied {int(applied)}/{int(rounds)} ({ops}), "
+            f"avg rule size {counters.get('rule_edit.rule_chars', 0) / rounds:.0f} chars not regenerated"
+        )
+    if counters.get("rule_edit.rebased") or counters.get("rule_edit.rebase_failed"):
+        lines.append(
+            f"concurrent rule updates rebased {int(counters.get('rule_edit.rebased', 0))}, "
+            f"left as conflicts {int(counters.get('rule_edit.rebase_failed', 0))}"
+        )
+    return lines
+
+
+metrics.add_report_section("Rule edits", rule_edit_report)
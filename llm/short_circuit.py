@@ -0,0 +1,228 @@
+import asyncio
+import json
+import re
+from dataclasses import dataclass
+from pathlib import Path
+
+from llm.routing import step_type_key
+from llm.tools.case_store import normalize_step_desc
+from llm.tools.image_store import get_image_store
+from utils.file_utils import resource_path
+from utils.metrics import metrics
+
+VERDICT_ACTIONS = ("Correct", "Incorrect", "Spam")
+ACTIONS = (*VERDICT_ACTIONS, "annotate", "off")
+
+# Keyed by step type enum *name*, "*" is the fallback; same overlay rules as the routing table.
+# Only a missing actual step is decided locally by default, the other rules add a note to the prompt.
+DEFAULT_ACTIONS: dict[str, dict[str, str]] = {
+    "*": {
+        "empty_actual": "Incorrect",
+        "identical_image": "annotate",
+        "copied_text": "annotate",
+    },
+}
+
+_STEP_DESC_RE = re.compile(r"^Standard Text:(.*?)\nActual Text:(.*?)\nActual Image:", re.DOTALL)
+
+
+def split_step_desc(step_desc: str | None) -> tuple[str, str]:
+    """(standard text, actual text) of a plan step's "Standard Text: ...\\nActual Text: ...\\nActual Image:" description."""
+
+    match = _STEP_DESC_RE.match(str(step_desc or ""))
+    if not match:
+        return "", str(step_desc or "").strip()
+    return match.group(1).strip(), match.group(2).strip()
+
+
+@dataclass(frozen=True)
+class RuleDecision:
+    rule: str
+    action: str
+    reason: str
+
+    @property
+    def verdict(self) -> dict | None:
+        if self.action not in VERDICT_ACTIONS:
+            return None
+        return {"final_result": self.action, "reason": self.reason}
+
+    @property
+    def note(self) -> dict:
+        return {"type": "text", "text": f"Pre-check ({self.rule}): {self.reason}"}
+
+
+# name -> check(step, engine) returning a reason when the rule fires.
+RULES: dict = {}
+
+
+def rule(name: str):
+    def register(check):
+        RULES[name] = check
+        return check
+    return register
+
+
+@rule("empty_actual")
+def _empty_actual(step: dict, engine: "ShortCircuitRules") -> str | None:
+    _, actual_text = split_step_desc(step.get("actual_text"))
+    if actual_text or step.get("actual_image_url"):
+        return None
+    return "The actual step is missing: no actual text and no actual screenshot were provided."
+
+
+@rule("identical_image")
+def _identical_image(step: dict, engine: "ShortCircuitRules") -> str | None:
+    earlier = engine.earlier_identical_image(step)
+    if earlier is None:
+        return None
+    return f"The actual screenshot is byte-identical to the actual screenshot of step {earlier}."
+
+
+@rule("copied_text")
+def _copied_text(step: dict, engine: "ShortCircuitRules") -> str | None:
+    standard_text, actual_text = split_step_desc(step.get("actual_text"))
+    if not actual_text or normalize_step_desc(actual_text).casefold() != normalize_step_desc(standard_text).casefold():
+        return None
+    return "The actual text is a verbatim copy of the standard text; judge the step from the screenshot."
+
+
+class ShortCircuitRules:
+    """Deterministic checks run before a step is sent to the judge, one instance per row.
+
+    Each rule either decides the step locally (Correct / Incorrect / Spam),
+    adds a note to the judge prompt ("annotate") or is switched off, per step
+    type. Rules run in RULES order; the first verdict wins and every note
+    from the rules before it is kept. Steps must be evaluated in plan order,
+    because identical_image compares against the screenshots already seen.
+    Async callers await `prepare_async` first, so screenshots are downloaded
+    and hashed in worker threads instead of on the event loop.
+    """
+
+    def __init__(self, actions: dict[str, dict[str, str]]):
+        self.actions = actions
+        self._decisions: dict = {}
+        self._image_owner: dict[str, int] = {}
+        self._digests: dict = {}
+
+    @classmethod
+    def load(cls, path: str | None) -> "ShortCircuitRules":
+        """Start from DEFAULT_ACTIONS and overlay the JSON file at `path`, if any."""
+
+        actions = {key: dict(entries) for key, entries in DEFAULT_ACTIONS.items()}
+        if path:
+            overrides = json.loads(Path(resource_path(path)).read_text(encoding="utf-8"))
+            for step_type, entries in (overrides or {}).items():
+                key = "*" if step_type == "*" else step_type_key(step_type)
+                for name, action in (entries or {}).items():
+                    if name not in RULES or action not in ACTIONS:
+                        raise ValueError(f"Unknown short-circuit rule or action: {name}={action}")
+                    actions.setdefault(key, {})[name] = action
+        return cls(actions)
+
+    def action_for(self, step_type: str | None, name: str) -> str:
+        key = step_type_key(step_type)
+        for entries in (self.actions.get(key), self.actions.get("*")):
+            if entries and name in entries:
+                return entries[name]
+        return "off"
+
+    def earlier_identical_image(self, step: dict) -> int | None:
+        """Step number of the first earlier step with a byte-identical actual screenshot."""
+
+        owner = self._image_owner.get(self._image_digest(step))
+        return owner if owner is not None and owner != step.get("step_number", 999) else None
+
+    async def prepare_async(self, steps: list[dict]) -> None:
+        """Fetch and hash the actual screenshots of `steps` off the event loop, concurrently."""
+
+        pending = [step for step in steps if step.get("step_number", 999) not in self._digests]
+        digests = await asyncio.gather(*[asyncio.to_thread(self._fetch_digest, step) for step in pending])
+        for step, digest in zip(pending, digests):
+            self._digests.setdefault(step.get("step_number", 999), digest)
+
+    def _image_digest(self, step: dict) -> str | None:
+        step_number = step.get("step_number", 999)
+        if step_number not in self._digests:
+            self._digests[step_number] = self._fetch_digest(step)
+        return self._digests[step_number]
+
+    @staticmethod
+    def _fetch_digest(step: dict) -> str | None:
+        image_url = step.get("actual_image_url")
+        if not image_url:
+            return None
+        try:
+            return get_image_store().digest(image_url)
+        except Exception:
+            return None
+
+    def evaluate(self, step: dict) -> list[RuleDecision]:
+        """Decisions for `step`: notes, optionally ending with one verdict. Memoized per step number."""
+
+        step_number = step.get("step_number", 999)
+        if step_number in self._decisions:
+            return self._decisions[step_number]
+
+        digest = self._image_digest(step)
+        if digest is not None:
+            self._image_owner.setdefault(digest, step_number)
+
+        step_type = step.get("step_type", "")
+        decisions: list[RuleDecision] = []
+        for name, check in RULES.items():
+            action = self.action_for(step_type, name)
+            if action == "off":
+                continue
+            reason = check(step, self)
+            if reason is None:
+                continue
+            decisions.append(RuleDecision(name, action, reason))
+            metrics.incr(f"short_circuit.{name}.{action}")
+            if action in VERDICT_ACTIONS:
+                break
+
+        metrics.incr("short_circuit.steps")
+        if decisions and decisions[-1].verdict is not None:
+            metrics.incr("short_circuit.decided")
+            print(f"[short-circuit] step {step_number}: {decisions[-1].action} by {decisions[-1].rule}")
+        self._decisions[step_number] = decisions
+        return decisions
+
+    def verdict(self, step: dict) -> dict | None:
+        decisions = self.evaluate(step)
+        return decisions[-1].verdict if decisions else None
+
+    def notes(self, step: dict) -> list[dict]:
+        return [decision.note for decision in self.evaluate(step) if decision.verdict is None]
+
+
+def short_circuit_rules(args) -> ShortCircuitRules | None:
+    """A fresh per-row rule engine, or None when --short_circuit is off."""
+
+    if not getattr(args, "short_circuit", False) and not getattr(args, "short_circuit_rules", None):
+        return None
+    return ShortCircuitRules.load(getattr(args, "short_circuit_rules", None))
+
+
+def short_circuit_report() -> list[str]:
+    counters = metrics.snapshot()["counters"]
+    steps = counters.get("short_circuit.steps", 0)
+    if not steps:
+        return []
+    decided = counters.get("short_circuit.decided", 0)
+    lines = [f"steps checked {int(steps)}, decided without the judge {int(decided)} ({decided / steps:.1%})"]
+    for name in RULES:
+        hits = {
+            key[len(f"short_circuit.{name}."):]: int(value)
+            for key, value in sorted(counters.items())
+            if key.startswith(f"short_circuit.{name}.")
+        }
+        if hits:
+            total = sum(hits.values())
+            detail = ", ".join(f"{action}={count}" for action, count in hits.items())
+            lines.append(f"{name}: {total} hits ({total / steps:.1%} of steps): {detail}")
+    return lines
+
+
+metrics.add_report_section("Short-circuit rules", short_circuit_report)
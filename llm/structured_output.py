@@ -0,0 +1,212 @@
+import json
+
+from enums.issue_enum import ScenarioEnum
+from utils.metrics import metrics
+
+
+FINAL_RESULT_VALUES = ["Correct", "Incorrect", "Spam", "NeedDiscussion"]
+
+RULE_EDIT_OPS = ["add", "replace", "delete"]
+
+
+FINAL_SUMMARY_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "final_summary": {
+            "type": "object",
+            "properties": {
+                "final_result": {"type": "string", "enum": FINAL_RESULT_VALUES},
+                "reason": {"type": "string"},
+            },
+            "required": ["final_result", "reason"],
+            "additionalProperties": False,
+        }
+    },
+    "required": ["final_summary"],
+    "additionalProperties": False,
+}
+
+# Cheap-model pass of the judge cascade: same verdict plus a self-reported confidence.
+FINAL_SUMMARY_CONFIDENCE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "final_summary": {
+            "type": "object",
+            "properties": {
+                "final_result": {"type": "string", "enum": FINAL_RESULT_VALUES},
+                "reason": {"type": "string"},
+                "confidence": {"type": "number"},
+            },
+            "required": ["final_result", "reason", "confidence"],
+            "additionalProperties": False,
+        }
+    },
+    "required": ["final_summary"],
+    "additionalProperties": False,
+}
+
+# Multi-step judge window: one final_summary entry per judged step.
+FINAL_SUMMARY_BATCH_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "final_summary": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "step_number": {"type": "integer"},
+                    "final_result": {"type": "string", "enum": FINAL_RESULT_VALUES},
+                    "reason": {"type": "string"},
+                },
+                "required": ["step_number", "final_result", "reason"],
+                "additionalProperties": False,
+            },
+        }
+    },
+    "required": ["final_summary"],
+    "additionalProperties": False,
+}
+
+# Strict JSON-schema mode only accepts an object at the top level, so the
+# planner step list is wrapped in {"steps": [...]}.
+PLAN_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "steps": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "step_number": {"type": "integer"},
+                    "step_type": {"type": "string", "enum": [s.value for s in ScenarioEnum]},
+                    "text": {"type": "string"},
+                },
+                "required": ["step_number", "step_type", "text"],
+                "additionalProperties": False,
+            },
+        }
+    },
+    "required": ["steps"],
+    "additionalProperties": False,
+}
+
+STEP_TYPE_RULE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "step_type_rule": {"type": "string"},
+    },
+    "required": ["step_type_rule"],
+    "additionalProperties": False,
+}
+
+# Patch-mode optimization: clause edits against the numbered rule instead of the whole rule.
+RULE_EDITS_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "rule_edits": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "op": {"type": "string", "enum": RULE_EDIT_OPS},
+                    "clause": {"type": "integer"},
+                    "text": {"type": "string"},
+                },
+                "required": ["op", "clause", "text"],
+                "additionalProperties": False,
+            },
+        }
+    },
+    "required": ["rule_edits"],
+    "additionalProperties": False,
+}
+
+RESULT_NUMBER_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "result_number": {"type": "integer"},
+    },
+    "required": ["result_number"],
+    "additionalProperties": False,
+}
+
+SCHEMAS = {
+    "final_summary": FINAL_SUMMARY_SCHEMA,
+    "final_summary_confidence": FINAL_SUMMARY_CONFIDENCE_SCHEMA,
+    "final_summary_batch": FINAL_SUMMARY_BATCH_SCHEMA,
+    "plan": PLAN_SCHEMA,
+    "step_type_rule": STEP_TYPE_RULE_SCHEMA,
+    "rule_edits": RULE_EDITS_SCHEMA,
+    "result_number": RESULT_NUMBER_SCHEMA,
+}
+
+
+def response_format_for(name: str) -> dict:
+    """Build the `response_format` payload for one of the known schemas."""
+
+    schema = SCHEMAS.get(name)
+    if schema is None:
+        raise KeyError(f"Unknown structured-output schema: {name}")
+    return {
+        "type": "json_schema",
+        "json_schema": {
+            "name": name,
+            "strict": True,
+            "schema": schema,
+        },
+    }
+
+
+def parse_structured(text: str | None) -> dict | None:
+    """Parse a schema-constrained response: a single `json.loads`, no repair."""
+
+    if not text:
+        return None
+    try:
+        parsed = json.loads(text)
+    except (TypeError, ValueError):
+        return None
+    return parsed if isinstance(parsed, dict) else None
+
+
+def matches_schema(text: str | None, name: str) -> bool:
+    """Whether `text` parses as a reply for schema `name` (a JSON object with its required keys)."""
+
+    parsed = parse_structured(text)
+    return parsed is not None and all(key in parsed for key in SCHEMAS[name].get("required", []))
+
+
+def record_parse(kind: str, structured: bool, ok: bool) -> None:
+    """Count parse outcomes per payload kind and mode so failure rates can be compared."""
+
+    mode = "structured" if structured else "legacy"
+    metrics.incr(f"parse.{kind}.{mode}.total")
+    if not ok:
+        metrics.incr(f"parse.{kind}.{mode}.fail")
+
+
+def parse_failure_report() -> list[str]:
+    lines = []
+    for kind in SCHEMAS:
+        for mode in ("legacy", "structured"):
+            total = metrics.counter(f"parse.{kind}.{mode}.total")
+            if not total:
+                continue
+            fail = metrics.counter(f"parse.{kind}.{mode}.fail")
+            lines.append(f"{kind} [{mode}]: {int(fail)}/{int(total)} failed ({fail / total:.1%})")
+    return lines
+
+
+def parse_model_json(text: str | None, kind: str, structured: bool, fallback) -> dict | None:
+    """Parse a model reply for the payload `kind` and record the outcome.
+
+    Structured replies go through `parse_structured`; legacy free-form replies
+    go through `fallback` (the repairing parser of the calling worker).
+    """
+
+    parsed = parse_structured(text) if structured else fallback(text)
+    record_parse(kind, structured, isinstance(parsed, dict) and kind in parsed)
+    return parsed
+
+
+metrics.add_report_section("Parse failures", parse_failure_report)
@@ -0,0 +1,198 @@
+import threading
+
+import numpy as np
+
+from llm.tools.case_store import CaseStore, get_case_store, normalize_step_desc
+from utils.metrics import metrics
+
+SHINGLE_SIZE = 5
+NUM_PERM = 128
+BANDS = 16
+
+
+def _permutations(num_perm: int, seed: int = 1) -> tuple[np.ndarray, np.ndarray]:
+    rng = np.random.default_rng(seed)
+    # x -> a * x + b (mod 2**32) with odd `a` is a permutation of the 32-bit shingle hashes.
+    a = rng.integers(0, 2**31, size=num_perm, dtype=np.uint32) * np.uint32(2) + np.uint32(1)
+    b = rng.integers(0, 2**32, size=num_perm, dtype=np.uint32)
+    return a, b
+
+
+_SHINGLE_POWERS = np.array([pow(1_000_003, SHINGLE_SIZE - 1 - i, 2**64) for i in range(SHINGLE_SIZE)], dtype=np.uint64)
+
+
+def shingle_hashes(text: str) -> np.ndarray:
+    """Distinct 32-bit hashes of the character 5-grams of the normalized, lower-cased text."""
+
+    normalized = normalize_step_desc(text).lower()
+    codes = np.frombuffer(normalized.encode("utf-32-le"), dtype=np.uint32).astype(np.uint64)
+    if codes.size == 0:
+        return codes.astype(np.uint32)
+    if codes.size < SHINGLE_SIZE:
+        codes = np.concatenate([codes, np.zeros(SHINGLE_SIZE - codes.size, dtype=np.uint64)])
+    n = codes.size - SHINGLE_SIZE + 1
+    # Polynomial hash of every window, wrapping in 64 bits; the high half is well mixed.
+    with np.errstate(over="ignore"):
+        hashes = codes[:n] * _SHINGLE_POWERS[0]
+        for i in range(1, SHINGLE_SIZE):
+            hashes += codes[i:i + n] * _SHINGLE_POWERS[i]
+    return np.unique((hashes >> np.uint64(32)).astype(np.uint32))
+
+
+class MinHashCaseIndex:
+    """Near-duplicate retrieval of example cases by step_raw_desc.
+
+    Each case gets a MinHash signature over character 5-gram shingles, kept
+    as one row of a NumPy matrix. Signatures are split into bands for
+    locality-sensitive hashing, so a lookup only scores the cases that
+    share at least one band with the query. Those candidates are scored
+    with a vectorized estimated Jaccard similarity. Whitespace, punctuation
+    and small wording changes keep most shingles, so such cases still match
+    where the exact index misses.
+    The index follows the CaseStore incrementally as cases are appended.
+    """
+
+    def __init__(self, store: CaseStore, num_perm: int = NUM_PERM, bands: int = BANDS):
+        if num_perm % bands:
+            raise ValueError("num_perm must be a multiple of bands")
+        self.store = store
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows_per_band = num_perm // bands
+        self._a, self._b = _permutations(num_perm)
+        self._lock = threading.Lock()
+        self._generation = -1
+        self._cases: list[dict] = []
+        self._signatures = np.empty((0, num_perm), dtype=np.uint32)
+        self._buckets: list[dict[bytes, list[int]]] = [{} for _ in range(bands)]
+
+    def signature(self, text: str) -> np.ndarray | None:
+        shingles = shingle_hashes(text)
+        if shingles.size == 0:
+            return None
+        with np.errstate(over="ignore"):
+            hashed = shingles[:, None] * self._a[None, :] + self._b[None, :]
+        return hashed.min(axis=0)
+
+    def signatures(self, texts: list[str], batch: int = 128) -> np.ndarray:
+        """Signatures of many texts, one row each; rows of texts without shingles are all-max and match nothing."""
+
+        out = np.full((len(texts), self.num_perm), np.iinfo(np.uint32).max, dtype=np.uint32)
+        for start in range(0, len(texts), batch):
+            shingles = [shingle_hashes(text) for text in texts[start:start + batch]]
+            filled = [i for i, s in enumerate(shingles) if s.size]
+            if not filled:
+                continue
+            lengths = np.array([shingles[i].size for i in filled])
+            offsets = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+            # Permutations along the rows, so each text's shingles are a contiguous run to reduce.
+            with np.errstate(over="ignore"):
+                hashed = self._a[:, None] * np.concatenate([shingles[i] for i in filled])[None, :] + self._b[:, None]
+            out[start + np.array(filled)] = np.minimum.reduceat(hashed, offsets, axis=1).T
+        return out
+
+    def _band_keys(self, signature: np.ndarray) -> list[bytes]:
+        return [band.tobytes() for band in signature.reshape(self.bands, self.rows_per_band)]
+
+    def _sync(self) -> None:
+        generation, new_cases = self.store.cases_since(self._generation, len(self._cases))
+        if generation != self._generation:
+            self._cases = []
+            self._signatures = np.empty((0, self.num_perm), dtype=np.uint32)
+            self._buckets = [{} for _ in range(self.bands)]
+            self._generation = generation
+        if not new_cases:
+            return
+
+        signatures = self.signatures([case.get("step_raw_desc") for case in new_cases])
+        empty = np.iinfo(np.uint32).max
+        for case, signature in zip(new_cases, signatures):
+            index = len(self._cases)
+            self._cases.append(case)
+            if signature[0] == empty and (signature == empty).all():
+                continue
+            for band, key in enumerate(self._band_keys(signature)):
+                self._buckets[band].setdefault(key, []).append(index)
+        self._signatures = np.vstack([self._signatures, signatures])
+
+    def __len__(self) -> int:
+        with self._lock:
+            self._sync()
+            return len(self._cases)
+
+    def query(self, text: str, k: int = 3, min_similarity: float = 0.5) -> list[tuple[float, dict]]:
+        """Up to `k` (estimated Jaccard similarity, case) pairs, best first."""
+
+        signature = self.signature(text)
+        if signature is None or k <= 0:
+            return []
+        with self._lock:
+            self._sync()
+            candidates: set[int] = set()
+            for band, key in enumerate(self._band_keys(signature)):
+                candidates.update(self._buckets[band].get(key, ()))
+            if not candidates:
+                return []
+            rows = np.fromiter(candidates, dtype=np.int64, count=len(candidates))
+            scores = np.count_nonzero(self._signatures[rows] == signature, axis=1) / self.num_perm
+            if rows.size > k:
+                top = np.argpartition(-scores, k - 1)[:k]
+                rows, scores = rows[top], scores[top]
+            order = np.argsort(-scores, kind="stable")
+            return [
+                (float(scores[i]), self._cases[int(rows[i])])
+                for i in order
+                if scores[i] >= min_similarity
+            ]
+
+
+_indexes: dict[int, MinHashCaseIndex] = {}
+_indexes_lock = threading.Lock()
+
+
+def get_case_index(store: CaseStore | None = None) -> MinHashCaseIndex:
+    """Process-wide near-match index over `store` (the default case store when None)."""
+
+    store = store or get_case_store()
+    with _indexes_lock:
+        index = _indexes.get(id(store))
+        if index is None:
+            index = MinHashCaseIndex(store)
+            _indexes[id(store)] = index
+        return index
+
+
+def near_match_enabled(args) -> bool:
+    return bool(getattr(args, "case_near_match", False))
+
+
+def similar_success_reasons(step_raw_desc: str, args=None) -> list[tuple[float, str]]:
+    """(similarity, step_success_reason) of the closest stored cases, skipping cases without a reason.
+
+    `args` supplies --case_near_k and --case_near_min_similarity.
+    """
+
+    matches = get_case_index().query(
+        step_raw_desc,
+        k=int(getattr(args, "case_near_k", 2) or 0),
+        min_similarity=float(getattr(args, "case_near_min_similarity", 0.6) or 0.0),
+    )
+    reasons = [
+        (similarity, str(case.get("step_success_reason")))
+        for similarity, case in matches
+        if case.get("step_success_reason")
+    ]
+    metrics.incr("case_index.queries")
+    metrics.incr("case_index.matched", int(bool(reasons)))
+    return reasons
+
+
+def case_index_report() -> list[str]:
+    queries = metrics.counter("case_index.queries")
+    if not queries:
+        return []
+    matched = metrics.counter("case_index.matched")
+    return [f"near-match lookups {int(queries)}: matched {int(matched)} ({matched / queries:.1%})"]
+
+
+metrics.add_report_section("Example case near matches", case_index_report)
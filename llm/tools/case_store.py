@@ -0,0 +1,195 @@
+import json
+import os
+import threading
+import unicodedata
+from pathlib import Path
+
+from utils.file_utils import exclusive_lock, resource_path
+from utils.metrics import metrics
+
+CASES_PATH = "llm/semanticmemory/cases.json"
+
+
+def normalize_step_desc(text: str | None) -> str:
+    """Index key of a step_raw_desc: NFKC-normalized with whitespace runs collapsed."""
+
+    return " ".join(unicodedata.normalize("NFKC", str(text or "")).split())
+
+
+def _log_path_for(cases_path: Path) -> Path:
+    return cases_path.with_name(f"{cases_path.stem}.log.jsonl")
+
+
+class CaseStore:
+    """Example cases indexed by normalized step_raw_desc.
+
+    The curated cases.json is the read-only base; cases learned at runtime are
+    appended to a sibling `<name>.log.jsonl`, one JSON object per line, with a
+    single O_APPEND write under an exclusive file lock (flock, or
+    msvcrt.locking on Windows). Lookups are served from an in-memory hash
+    index shared by every row of the process. The log is tailed from the last
+    read offset when it grows, so appends from other processes become visible
+    without re-reading the whole store, and the index is rebuilt from scratch
+    only when cases.json itself changes.
+    """
+
+    def __init__(self, cases_path: str | Path):
+        self.cases_path = Path(cases_path)
+        self.log_path = _log_path_for(self.cases_path)
+        self._lock = threading.RLock()
+        self._cases: list[dict] = []
+        self._by_desc: dict[str, dict] = {}
+        self._keys: set[tuple[str, str]] = set()
+        self._base_stamp: tuple[int, int] | None = None
+        self._log_offset = 0
+        # Bumped when the store is rebuilt from scratch, so derived indexes know to start over.
+        self.generation = 0
+
+    # -- reading ------------------------------------------------------------
+
+    def cases(self) -> list[dict]:
+        with self._lock:
+            self._refresh()
+            return list(self._cases)
+
+    def cases_since(self, generation: int, start: int) -> tuple[int, list[dict]]:
+        """(generation, cases from position `start`), or all cases when the store was rebuilt since."""
+
+        with self._lock:
+            self._refresh()
+            if generation != self.generation:
+                start = 0
+            return self.generation, self._cases[start:]
+
+    def find(self, step_raw_desc: str | None) -> dict | None:
+        """The first stored case whose normalized step_raw_desc matches, if any."""
+
+        key = normalize_step_desc(step_raw_desc)
+        if not key:
+            return None
+        with self._lock:
+            self._refresh()
+            case = self._by_desc.get(key)
+        metrics.incr("case_store.hit" if case is not None else "case_store.miss")
+        return case
+
+    def success_reason(self, step_raw_desc: str | None) -> str | None:
+        case = self.find(step_raw_desc)
+        if case is None:
+            return None
+        value = case.get("step_success_reason")
+        return None if value is None else str(value)
+
+    # -- writing ------------------------------------------------------------
+
+    def append_if_new(self, case: dict) -> bool:
+        """Append `case` unless one with the same step type and step_raw_desc exists."""
+
+        self.log_path.parent.mkdir(parents=True, exist_ok=True)
+        line = (json.dumps(case, ensure_ascii=False) + "\n").encode("utf-8")
+        with self._lock:
+            fd = os.open(self.log_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                with exclusive_lock(fd):
+                    # Catch up with appends made by other processes before checking.
+                    self._refresh()
+                    if self._case_key(case) in self._keys:
+                        return False
+                    os.write(fd, line)
+            finally:
+                os.close(fd)
+            self._refresh()
+        metrics.incr("case_store.appended")
+        return True
+
+    # -- internals ----------------------------------------------------------
+
+    @staticmethod
+    def _case_key(case: dict) -> tuple[str, str]:
+        return (str(case.get("step_type") or "").strip(), normalize_step_desc(case.get("step_raw_desc")))
+
+    @staticmethod
+    def _stamp(path: Path) -> tuple[int, int] | None:
+        try:
+            stat = path.stat()
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def _add(self, case: dict) -> None:
+        if not isinstance(case, dict):
+            return
+        self._cases.append(case)
+        self._keys.add(self._case_key(case))
+        desc = normalize_step_desc(case.get("step_raw_desc"))
+        if desc:
+            self._by_desc.setdefault(desc, case)
+
+    def _refresh(self) -> None:
+        base_stamp = self._stamp(self.cases_path)
+        if base_stamp != self._base_stamp:
+            self._cases, self._by_desc, self._keys = [], {}, set()
+            self._log_offset = 0
+            self.generation += 1
+            try:
+                raw = self.cases_path.read_text(encoding="utf-8").strip()
+                base = json.loads(raw) if raw else []
+            except (OSError, ValueError):
+                base = []
+            for case in base if isinstance(base, list) else []:
+                self._add(case)
+            self._base_stamp = base_stamp
+            metrics.incr("case_store.loads")
+
+        log_stamp = self._stamp(self.log_path)
+        if log_stamp is None:
+            return
+        if log_stamp[1] < self._log_offset:
+            # The log was truncated or replaced; rebuild everything.
+            self._base_stamp = None
+            self._refresh()
+            return
+        if log_stamp[1] == self._log_offset:
+            return
+        with open(self.log_path, "rb") as f:
+            f.seek(self._log_offset)
+            chunk = f.read()
+        # A line still being written by another process is picked up next time.
+        complete = chunk[: chunk.rfind(b"\n") + 1]
+        self._log_offset += len(complete)
+        for raw in complete.splitlines():
+            try:
+                self._add(json.loads(raw))
+            except ValueError:
+                continue
+
+
+_stores: dict[str, CaseStore] = {}
+_stores_lock = threading.Lock()
+
+
+def get_case_store(path: str = CASES_PATH) -> CaseStore:
+    """Process-wide CaseStore for `path` (resolved with resource_path)."""
+
+    resolved = resource_path(path)
+    with _stores_lock:
+        store = _stores.get(resolved)
+        if store is None:
+            store = CaseStore(resolved)
+            _stores[resolved] = store
+        return store
+
+
+def case_store_report() -> list[str]:
+    hits = metrics.counter("case_store.hit")
+    misses = metrics.counter("case_store.miss")
+    total = hits + misses
+    if not total:
+        return []
+    return [
+        f"lookups {int(total)}: matched {int(hits)} ({hits / total:.1%}), "
+        f"appended {int(metrics.counter('case_store.appended'))}, full loads {int(metrics.counter('case_store.loads'))}"
+    ]
+
+
+metrics.add_report_section("Example cases", case_store_report)
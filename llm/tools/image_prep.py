@@ -0,0 +1,163 @@
+import base64
+import io
+import math
+
+from PIL import Image
+
+from enums.issue_enum import SceneEnum, ScenarioEnum
+from llm.routing import step_type_key
+from llm.tools.image_store import get_image_store
+from utils.metrics import metrics
+
+# Steps that only need the page to be recognisable get a low-detail image;
+# layout, ads and SERP checks need to read small text. Everything else is
+# left to the model ("auto").
+DETAIL_BY_STEP_TYPE: dict[str, str] = {
+    SceneEnum.NAVIGATION.name: "low",
+    SceneEnum.WAITING.name: "low",
+    SceneEnum.DESCRIPTIVE.name: "low",
+    ScenarioEnum.NAVIGATION_URL_REDIRECTION.name: "low",
+    ScenarioEnum.ENVIRONMENT_PRECONDITION_SETUP.name: "low",
+    ScenarioEnum.TAB_WINDOW_MANAGEMENT.name: "low",
+    ScenarioEnum.UI_VISIBILITY_LAYOUT_RENDERING_VERIFICATION.name: "high",
+    ScenarioEnum.ADVERTISING_VERIFICATION_REPORTING.name: "high",
+    ScenarioEnum.SEARCH_FUNCTIONALITY_SERP_MODULE_VALIDATION.name: "high",
+    ScenarioEnum.LOCALIZATION_INTERNATIONALIZATION.name: "high",
+}
+
+_FORMATS = {
+    "webp": ("WEBP", "image/webp"),
+    "jpeg": ("JPEG", "image/jpeg"),
+    "png": ("PNG", "image/png"),
+}
+
+
+def _settings(args):
+    return (
+        bool(getattr(args, "image_prep", False)),
+        int(getattr(args, "image_max_edge", 1568) or 0),
+        str(getattr(args, "image_format", "webp") or "webp").lower(),
+        int(getattr(args, "image_quality", 85) or 85),
+        str(getattr(args, "image_detail", "policy") or "policy").lower(),
+    )
+
+
+def image_prep_enabled(args) -> bool:
+    return _settings(args)[0]
+
+
+def detail_for(step_type: str | None, mode: str = "policy") -> str:
+    if mode != "policy":
+        return mode
+    if not step_type:
+        return "auto"
+    return DETAIL_BY_STEP_TYPE.get(step_type_key(step_type), "auto")
+
+
+def estimate_image_tokens(width: int, height: int, detail: str) -> int:
+    """Vision input tokens for a width x height image (85 base + 170 per 512px tile after scaling)."""
+
+    if detail == "low" or not width or not height:
+        return 85
+    scale = min(1.0, 2048 / max(width, height))
+    width, height = width * scale, height * scale
+    scale = min(1.0, 768 / min(width, height))
+    width, height = width * scale, height * scale
+    return 85 + 170 * math.ceil(width / 512) * math.ceil(height / 512)
+
+
+def transcode_image(data: bytes, max_edge: int, fmt: str, quality: int) -> tuple[bytes, str, tuple[int, int], tuple[int, int]]:
+    """Downsize to `max_edge` and re-encode; returns (bytes, mime, original size, new size)."""
+
+    pil_format, mime = _FORMATS.get(fmt, _FORMATS["webp"])
+    with Image.open(io.BytesIO(data)) as img:
+        original_size = img.size
+        img = img.convert("RGB") if pil_format == "JPEG" or img.mode not in ("RGB", "RGBA") else img
+        if max_edge and max(img.size) > max_edge:
+            img.thumbnail((max_edge, max_edge), Image.LANCZOS)
+        out = io.BytesIO()
+        img.save(out, format=pil_format, **({} if pil_format == "PNG" else {"quality": quality}))
+        encoded = out.getvalue()
+        if pil_format != "PNG":
+            # Flat UI screenshots often compress better losslessly; keep the smaller one.
+            png = io.BytesIO()
+            img.save(png, format="PNG")
+            if png.tell() < len(encoded):
+                encoded, mime = png.getvalue(), "image/png"
+        return encoded, mime, original_size, img.size
+
+
+def prepare_image_data_url(image_url: str, args=None) -> tuple[str, dict] | None:
+    """Transcoded data URL plus size info for `image_url`, sized and encoded per `args`; None when it cannot be read or decoded."""
+
+    _, max_edge, fmt, quality, _ = _settings(args)
+
+    def build(record) -> tuple[str, dict]:
+        raw = record.data
+        encoded, mime, original_size, size = transcode_image(raw, max_edge, fmt, quality)
+        if len(encoded) >= len(raw):
+            # Nothing gained; keep the original encoding (the model scales it down itself).
+            encoded, mime, size = raw, record.mime, original_size
+        data_url = f"data:{mime};base64,{base64.b64encode(encoded).decode('ascii')}"
+        return data_url, {
+            "bytes_in": len(raw),
+            "bytes_out": len(encoded),
+            "original_size": original_size,
+            "size": size,
+        }
+
+    try:
+        return get_image_store().prepared(image_url, f"{fmt}-{max_edge}-{quality}", build)
+    except Exception as e:
+        print(f"Warning: image preparation failed, sending original: {e}")
+        metrics.incr("image_prep.failed")
+        return None
+
+
+def prepare_image_part(image_url: str, step_type: str | None = None, args=None) -> dict:
+    """OpenAI image_url content part, downsized/re-encoded with a per-step-type detail when `args` has --image_prep on."""
+
+    enabled, _, _, _, detail_mode = _settings(args)
+    if not enabled:
+        return {"type": "image_url", "image_url": {"url": image_url}}
+
+    detail = detail_for(step_type, detail_mode)
+    prepared = prepare_image_data_url(image_url, args)
+    if prepared is None:
+        return {"type": "image_url", "image_url": {"url": image_url, "detail": detail}}
+
+    data_url, info = prepared
+    metrics.incr("image_prep.images")
+    metrics.incr("image_prep.bytes_in", info["bytes_in"])
+    metrics.incr("image_prep.bytes_out", info["bytes_out"])
+    # Baseline is what used to be sent: the original image at the default detail.
+    metrics.incr("image_prep.tokens_in", estimate_image_tokens(*info["original_size"], "auto"))
+    metrics.incr("image_prep.tokens_out", estimate_image_tokens(*info["size"], detail))
+    metrics.incr(f"image_prep.detail.{detail}")
+    return {"type": "image_url", "image_url": {"url": data_url, "detail": detail}}
+
+
+def image_prep_report() -> list[str]:
+    counters = metrics.snapshot()["counters"]
+    images = counters.get("image_prep.images", 0)
+    if not images:
+        return []
+    bytes_in = counters.get("image_prep.bytes_in", 0)
+    bytes_out = counters.get("image_prep.bytes_out", 0)
+    tokens_in = counters.get("image_prep.tokens_in", 0)
+    tokens_out = counters.get("image_prep.tokens_out", 0)
+    details = ", ".join(
+        f"{name[len('image_prep.detail.'):]}={int(value)}"
+        for name, value in sorted(counters.items())
+        if name.startswith("image_prep.detail.")
+    )
+    return [
+        f"images={int(images)} failed={int(counters.get('image_prep.failed', 0))} detail: {details}",
+        f"bytes {int(bytes_in)} -> {int(bytes_out)} ({1 - bytes_out / bytes_in:.1%} saved, "
+        f"{(bytes_in - bytes_out) / images / 1024:.1f} KiB per image)" if bytes_in else "bytes n/a",
+        f"estimated vision tokens {int(tokens_in)} -> {int(tokens_out)} ({1 - tokens_out / tokens_in:.1%} saved, "
+        f"{(tokens_in - tokens_out) / images:.0f} per image)" if tokens_in else "tokens n/a",
+    ]
+
+
+metrics.add_report_section("Image preparation", image_prep_report)
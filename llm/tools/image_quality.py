@@ -3,6 +3,9 @@ import io
 import os
 import re
 import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from typing import Any, Iterable
 from urllib.parse import urlparse
@@ -36,26 +39,60 @@ def _looks_like_base64(s: str) -> bool:
     return re.fullmatch(r"[A-Za-z0-9+/=\s]+", v) is not None
 
 
-def load_image_any(image_input: Any) -> Image.Image:
+_session = None
+_session_lock = threading.Lock()
 
-    if image_input is None:
-        raise ValueError("image_input is None")
+_RETRY_STATUSES = {429, 500, 502, 503, 504}
 
-    if isinstance(image_input, Image.Image):
-        return image_input
 
-    if isinstance(image_input, np.ndarray):
-        arr = image_input
-        if arr.ndim == 3 and arr.shape[2] == 3:
-            # Assume BGR (opencv) and convert to RGB.
-            arr = cv2.cvtColor(arr, cv2.COLOR_BGR2RGB)
-        return Image.fromarray(arr)
+def _http_session():
+    """Process-wide pooled requests session, so image downloads reuse connections."""
+
+    global _session
+    with _session_lock:
+        if _session is None:
+            import requests
+            from requests.adapters import HTTPAdapter
+
+            _session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=16, pool_maxsize=32)
+            _session.mount("http://", adapter)
+            _session.mount("https://", adapter)
+        return _session
+
+
+def fetch_url_bytes(url: str, timeout: float = 30, retries: int = 2) -> bytes:
+    """GET `url` through the pooled session, retrying connection errors and 429/5xx with backoff."""
+
+    import requests
+
+    attempt = 0
+    while True:
+        try:
+            resp = _http_session().get(url, timeout=timeout)
+            if resp.status_code in _RETRY_STATUSES and attempt < retries:
+                raise requests.HTTPError(f"HTTP {resp.status_code}", response=resp)
+            resp.raise_for_status()
+            return resp.content
+        except (requests.ConnectionError, requests.Timeout, requests.HTTPError) as e:
+            status = getattr(getattr(e, "response", None), "status_code", None)
+            if attempt >= retries or (status is not None and status not in _RETRY_STATUSES):
+                raise
+            attempt += 1
+            time.sleep(0.5 * 2 ** (attempt - 1))
+
+
+def load_image_bytes(image_input: Any, timeout: float = 30, retries: int = 2) -> bytes:
+    """Raw encoded bytes of an image given as bytes, path, URL, data URL or base64 string."""
+
+    if image_input is None:
+        raise ValueError("image_input is None")
 
     if isinstance(image_input, (bytes, bytearray)):
-        return Image.open(io.BytesIO(bytes(image_input)))
+        return bytes(image_input)
 
     if isinstance(image_input, Path):
-        return Image.open(str(image_input))
+        return image_input.read_bytes()
 
     if isinstance(image_input, str):
         s = image_input.strip()
@@ -63,11 +100,7 @@ def load_image_any(image_input: Any) -> Image.Image:
             raise ValueError("empty image string")
 
         if s.startswith("http://") or s.startswith("https://"):
-            import requests
-
-            resp = requests.get(s, timeout=30)
-            resp.raise_for_status()
-            return Image.open(io.BytesIO(resp.content))
+            return fetch_url_bytes(s, timeout=timeout, retries=retries)
 
         if s.startswith("file:"):
             parsed = urlparse(s)
@@ -75,23 +108,39 @@ def load_image_any(image_input: Any) -> Image.Image:
             local_path = url2pathname(parsed.path)
             if re.match(r"^/[A-Za-z]:", parsed.path):
                 local_path = local_path.lstrip("\\/")
-            return Image.open(local_path)
+            return Path(local_path).read_bytes()
 
         m = _DATA_URL_RE.match(s)
         if m:
             b64 = (m.group("b64") or "").strip()
-            raw = base64.b64decode(b64, validate=False)
-            return Image.open(io.BytesIO(raw))
+            return base64.b64decode(b64, validate=False)
 
         if _looks_like_base64(s):
-            raw = base64.b64decode(s, validate=False)
-            return Image.open(io.BytesIO(raw))
+            return base64.b64decode(s, validate=False)
 
-        return Image.open(s)
+        return Path(s).read_bytes()
 
     raise TypeError(f"Unsupported image_input type: {type(image_input)}")
 
 
+def load_image_any(image_input: Any) -> Image.Image:
+
+    if image_input is None:
+        raise ValueError("image_input is None")
+
+    if isinstance(image_input, Image.Image):
+        return image_input
+
+    if isinstance(image_input, np.ndarray):
+        arr = image_input
+        if arr.ndim == 3 and arr.shape[2] == 3:
+            # Assume BGR (opencv) and convert to RGB.
+            arr = cv2.cvtColor(arr, cv2.COLOR_BGR2RGB)
+        return Image.fromarray(arr)
+
+    return Image.open(io.BytesIO(load_image_bytes(image_input)))
+
+
 def phash_image(image_input: Any):
     img = load_image_any(image_input)
     return imagehash.phash(img)
@@ -140,16 +189,29 @@ def remove_duplicates(input_folder, output_folder):
     return hashes, duplicates
 
 
-def find_duplicates_in_items(items: Iterable[Any]):
+def find_duplicates_in_items(items: Iterable[Any], hash_fn=None, max_workers: int = 1):
 
+    hash_fn = hash_fn or phash_image
+    items = list(items)
     first_by_hash: dict[str, int] = {}
     duplicates: list[tuple[int, int]] = []
 
-    for idx, item in enumerate(items):
+    def _hash(item):
         try:
-            h = str(phash_image(item))
+            return str(hash_fn(item)), None
         except Exception as e:
-            raise ValueError(f"Failed to hash item[{idx}]: {e}") from e
+            return None, e
+
+    if max_workers > 1 and len(items) > 1:
+        # Fetching dominates; hash concurrently, then compare in the original order.
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(items))) as pool:
+            hashed = list(pool.map(_hash, items))
+    else:
+        hashed = map(_hash, items)
+
+    for idx, (h, error) in enumerate(hashed):
+        if error is not None:
+            raise ValueError(f"Failed to hash item[{idx}]: {error}") from error
 
         if h in first_by_hash:
             duplicates.append((idx, first_by_hash[h]))
@@ -0,0 +1,291 @@
+import base64
+import hashlib
+import io
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+
+import imagehash
+from PIL import Image
+
+from llm.tools.image_quality import load_image_bytes
+from utils.metrics import metrics
+
+
+@dataclass
+class ImageRecord:
+    digest: str
+    data: bytes
+    mime: str
+    width: int
+    height: int
+    phash: str | None = None
+    prepared: dict[str, tuple[str, dict]] = field(default_factory=dict)
+
+
+def _ref_key(image_url: str) -> str:
+    ref = str(image_url).strip()
+    if not ref.startswith(("http://", "https://", "data:")):
+        # Local files can change in place; include size and mtime in the reference.
+        try:
+            stat = Path(ref[len("file:"):] if ref.startswith("file:") else ref).stat()
+            ref = f"{ref}|{stat.st_size}|{stat.st_mtime_ns}"
+        except OSError:
+            pass
+    return hashlib.sha256(ref.encode("utf-8")).hexdigest()
+
+
+def _write_atomic(path: Path, data: bytes) -> None:
+    tmp = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    tmp.write_bytes(data)
+    os.replace(tmp, path)
+
+
+class ImageStore:
+    """Content-addressed image store shared by the hasher, the planner and the judges.
+
+    Images are addressed by the sha256 of their bytes; a reference index maps
+    each URL / path / data URL to that digest, so every image is fetched once
+    per process (and once per cache folder across runs). Each record keeps
+    the bytes, decoded metadata, the perceptual hash and prepared data URLs
+    per preparation variant. Records live in a memory LRU in front of an
+    optional on-disk copy under `cache_dir`.
+    """
+
+    def __init__(self, cache_dir: str | None, max_items: int = 256, fetch_timeout: float = 30, fetch_retries: int = 2):
+        self.cache_dir = Path(cache_dir) if cache_dir else None
+        self.fetch_timeout = fetch_timeout
+        self.fetch_retries = fetch_retries
+        if self.cache_dir is not None:
+            for sub in ("blobs", "meta", "refs", "prepared"):
+                (self.cache_dir / sub).mkdir(parents=True, exist_ok=True)
+        self.max_items = max(1, int(max_items))
+        self._lock = threading.Lock()
+        self._records: OrderedDict[str, ImageRecord] = OrderedDict()
+        self._refs: dict[str, str] = {}
+        self._loading: dict[str, threading.Lock] = {}
+
+    # -- lookup -------------------------------------------------------------
+
+    def get(self, image_url: str) -> ImageRecord:
+        """Record for `image_url`, fetching and decoding it only on the first request."""
+
+        ref = _ref_key(image_url)
+        record = self._lookup(ref)
+        if record is not None:
+            metrics.incr("image_store.hit")
+            return record
+
+        with self._lock:
+            loading = self._loading.setdefault(ref, threading.Lock())
+        with loading:
+            # Another thread may have loaded it while we waited.
+            record = self._lookup(ref)
+            if record is not None:
+                metrics.incr("image_store.hit")
+                return record
+            metrics.incr("image_store.miss")
+            record = self._load(image_url)
+            self._remember(ref, record)
+        with self._lock:
+            self._loading.pop(ref, None)
+        return record
+
+    def prefetch(self, image_urls, max_workers: int = 8, with_phash: bool = False) -> None:
+        """Load many images concurrently; failures are left for the caller's own lookup to report."""
+
+        urls = list(dict.fromkeys(u for u in image_urls if u))
+        if not urls:
+            return
+
+        def _load(url):
+            try:
+                self.phash(url) if with_phash else self.get(url)
+            except Exception:
+                pass
+
+        if max_workers <= 1 or len(urls) == 1:
+            for url in urls:
+                _load(url)
+            return
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(urls))) as pool:
+            list(pool.map(_load, urls))
+
+    def digest(self, image_url: str) -> str:
+        return self.get(image_url).digest
+
+    def bytes(self, image_url: str) -> bytes:
+        return self.get(image_url).data
+
+    def phash(self, image_url: str) -> str:
+        record = self.get(image_url)
+        if record.phash is None:
+            with Image.open(io.BytesIO(record.data)) as img:
+                record.phash = str(imagehash.phash(img))
+            self._save_meta(record)
+        return record.phash
+
+    def data_url(self, image_url: str) -> str:
+        """The original bytes as a base64 data URL."""
+
+        return self.prepared(image_url, "original", lambda record: (
+            f"data:{record.mime};base64,{base64.b64encode(record.data).decode('ascii')}",
+            {"bytes_in": len(record.data), "bytes_out": len(record.data),
+             "original_size": (record.width, record.height), "size": (record.width, record.height)},
+        ))[0]
+
+    def prepared(self, image_url: str, variant: str, build) -> tuple[str, dict]:
+        """Prepared (data URL, info) for `variant`, built once with `build(record)`."""
+
+        record = self.get(image_url)
+        cached = record.prepared.get(variant)
+        if cached is None and self.cache_dir is not None:
+            cached = self._read_prepared(record.digest, variant)
+        if cached is None:
+            cached = build(record)
+            if self.cache_dir is not None and variant != "original":
+                self._write_prepared(record.digest, variant, cached)
+        record.prepared[variant] = cached
+        return cached
+
+    # -- internals ----------------------------------------------------------
+
+    def _lookup(self, ref: str) -> ImageRecord | None:
+        with self._lock:
+            digest = self._refs.get(ref)
+            if digest is not None and digest in self._records:
+                self._records.move_to_end(digest)
+                return self._records[digest]
+        if self.cache_dir is None:
+            return None
+
+        if digest is None:
+            try:
+                digest = (self.cache_dir / "refs" / ref).read_text(encoding="utf-8").strip()
+            except OSError:
+                return None
+        try:
+            data = (self.cache_dir / "blobs" / digest).read_bytes()
+            meta = json.loads((self.cache_dir / "meta" / f"{digest}.json").read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return None
+        record = ImageRecord(
+            digest=digest,
+            data=data,
+            mime=meta.get("mime") or "image/png",
+            width=int(meta.get("width") or 0),
+            height=int(meta.get("height") or 0),
+            phash=meta.get("phash"),
+        )
+        self._remember(ref, record, persist=False)
+        return record
+
+    def _load(self, image_url: str) -> ImageRecord:
+        started = time.perf_counter()
+        data = load_image_bytes(image_url, timeout=self.fetch_timeout, retries=self.fetch_retries)
+        metrics.observe("image_store.fetch", time.perf_counter() - started)
+        digest = hashlib.sha256(data).hexdigest()
+        with self._lock:
+            known = self._records.get(digest)
+        if known is not None:
+            return known
+        with Image.open(io.BytesIO(data)) as img:
+            width, height = img.size
+            mime = Image.MIME.get(img.format or "", "image/png")
+        return ImageRecord(digest=digest, data=data, mime=mime, width=width, height=height)
+
+    def _remember(self, ref: str, record: ImageRecord, persist: bool = True) -> None:
+        with self._lock:
+            self._refs[ref] = record.digest
+            self._records[record.digest] = record
+            self._records.move_to_end(record.digest)
+            while len(self._records) > self.max_items:
+                self._records.popitem(last=False)
+                metrics.incr("image_store.evicted")
+        if persist and self.cache_dir is not None:
+            blob = self.cache_dir / "blobs" / record.digest
+            if not blob.exists():
+                _write_atomic(blob, record.data)
+            self._save_meta(record)
+            _write_atomic(self.cache_dir / "refs" / ref, record.digest.encode("utf-8"))
+
+    def _save_meta(self, record: ImageRecord) -> None:
+        if self.cache_dir is None:
+            return
+        meta = {"mime": record.mime, "width": record.width, "height": record.height, "phash": record.phash}
+        _write_atomic(self.cache_dir / "meta" / f"{record.digest}.json", json.dumps(meta).encode("utf-8"))
+
+    def _prepared_path(self, digest: str, variant: str) -> Path:
+        return self.cache_dir / "prepared" / f"{digest}-{hashlib.sha256(variant.encode('utf-8')).hexdigest()[:12]}.json"
+
+    def _read_prepared(self, digest: str, variant: str) -> tuple[str, dict] | None:
+        try:
+            entry = json.loads(self._prepared_path(digest, variant).read_text(encoding="utf-8"))
+            info = entry["info"]
+            info["original_size"] = tuple(info["original_size"])
+            info["size"] = tuple(info["size"])
+            return entry["data_url"], info
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+
+    def _write_prepared(self, digest: str, variant: str, prepared: tuple[str, dict]) -> None:
+        data_url, info = prepared
+        payload = json.dumps({"variant": variant, "data_url": data_url, "info": info}).encode("utf-8")
+        _write_atomic(self._prepared_path(digest, variant), payload)
+
+
+_store: ImageStore | None = None
+_store_settings: tuple | None = None
+_store_lock = threading.Lock()
+
+
+def configure_image_store(args) -> ImageStore:
+    """Set up the process-wide ImageStore from --image_store_dir / --image_store_items / --image_fetch_*.
+
+    The store is built once per distinct configuration, so callers that
+    configure it with the same args keep sharing the cached images.
+    """
+
+    global _store, _store_settings
+    settings = (
+        getattr(args, "image_store_dir", None) or None,
+        int(getattr(args, "image_store_items", 256) or 256),
+        float(getattr(args, "image_fetch_timeout", 30) or 30),
+        int(getattr(args, "image_fetch_retries", 2) or 0),
+    )
+    with _store_lock:
+        if _store is None or settings != _store_settings:
+            cache_dir, max_items, fetch_timeout, fetch_retries = settings
+            _store = ImageStore(cache_dir, max_items, fetch_timeout=fetch_timeout, fetch_retries=fetch_retries)
+            _store_settings = settings
+        return _store
+
+
+def get_image_store() -> ImageStore:
+    """The process-wide ImageStore; an in-memory store with default limits until it is configured."""
+
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = ImageStore(None)
+        return _store
+
+
+def image_store_report() -> list[str]:
+    hits = metrics.counter("image_store.hit")
+    misses = metrics.counter("image_store.miss")
+    total = hits + misses
+    if not total:
+        return []
+    return [
+        f"lookups {int(total)}: fetched {int(misses)}, reused {int(hits)} ({hits / total:.1%}), "
+        f"evicted from memory {int(metrics.counter('image_store.evicted'))}"
+    ]
+
+
+metrics.add_report_section("Image store", image_store_report)
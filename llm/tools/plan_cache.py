@@ -0,0 +1,120 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from pathlib import Path
+
+from llm.tools.image_store import get_image_store
+from utils.metrics import metrics
+
+
+def image_content_digest(image_url: str | None) -> str | None:
+    """sha256 of the image bytes; falls back to hashing the reference when it cannot be read."""
+
+    if not image_url:
+        return None
+    try:
+        return get_image_store().digest(image_url)
+    except Exception:
+        return "ref:" + hashlib.sha256(str(image_url).encode("utf-8")).hexdigest()
+
+
+class PlanCache:
+    """Persistent planner-output cache.
+
+    A plan only depends on the standard side of a test case, so entries are
+    keyed by the planner prompt version, the model and, per step, the
+    standard text plus the content digest of the standard image. Entries are
+    one JSON file per key, written atomically so concurrent rows can share
+    the folder.
+    """
+
+    def __init__(self, cache_dir: str):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._memory: dict[str, list[dict]] = {}
+
+    @staticmethod
+    def key(steps_json: list[dict], prompt_version: str, model: str | None, max_workers: int = 8) -> str:
+        # The key needs every standard image's digest; fetch them concurrently rather than one by one.
+        get_image_store().prefetch([step.get("standard_image_url") for step in steps_json], max_workers=max_workers)
+        steps = [
+            {
+                "standard_text": str(step.get("standard_text") or ""),
+                "standard_image": image_content_digest(step.get("standard_image_url")),
+            }
+            for step in steps_json
+        ]
+        payload = json.dumps(
+            {"prompt_version": prompt_version, "model": model or "", "steps": steps},
+            ensure_ascii=False,
+            sort_keys=True,
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _path(self, key: str) -> Path:
+        return self.cache_dir / f"{key}.json"
+
+    def get(self, key: str) -> list[dict] | None:
+        with self._lock:
+            plan = self._memory.get(key)
+        if plan is None:
+            try:
+                entry = json.loads(self._path(key).read_text(encoding="utf-8"))
+                plan = entry.get("plan") if isinstance(entry, dict) else None
+            except (OSError, ValueError):
+                plan = None
+            if isinstance(plan, list):
+                with self._lock:
+                    self._memory[key] = plan
+
+        if isinstance(plan, list):
+            metrics.incr("plan_cache.hit")
+            return [dict(step) for step in plan]
+        metrics.incr("plan_cache.miss")
+        return None
+
+    def put(self, key: str, plan: list[dict], standard_texts: list[str], prompt_version: str) -> None:
+        entry = {
+            "prompt_version": prompt_version,
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "standard_texts": standard_texts,
+            "plan": plan,
+        }
+        path = self._path(key)
+        tmp = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        tmp.write_text(json.dumps(entry, ensure_ascii=False, indent=2), encoding="utf-8")
+        os.replace(tmp, path)
+        with self._lock:
+            self._memory[key] = plan
+
+
+_caches: dict[str, PlanCache] = {}
+_caches_lock = threading.Lock()
+
+
+def get_plan_cache(cache_dir: str | None) -> PlanCache | None:
+    """Process-wide PlanCache per folder; None when caching is disabled."""
+
+    if not cache_dir:
+        return None
+    with _caches_lock:
+        cache = _caches.get(cache_dir)
+        if cache is None:
+            cache = PlanCache(cache_dir)
+            _caches[cache_dir] = cache
+        return cache
+
+
+def plan_cache_report() -> list[str]:
+    hits = metrics.counter("plan_cache.hit")
+    misses = metrics.counter("plan_cache.miss")
+    total = hits + misses
+    if not total:
+        return []
+    return [f"hits {int(hits)}/{int(total)} ({hits / total:.1%})"]
+
+
+metrics.add_report_section("Plan cache", plan_cache_report)
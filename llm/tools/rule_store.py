@@ -0,0 +1,172 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+from utils.file_utils import exclusive_lock, prompt_registry, resource_path
+from utils.metrics import metrics
+
+HISTORY_DIR = ".history"
+
+
+def rule_version(text: str) -> str:
+    """Version ID of a rule text: the first 16 hex digits of its sha256."""
+
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()[:16]
+
+
+class RuleStore:
+    """Versioned step type rule files with compare-and-swap updates.
+
+    A rule stays a plain text file, so prompts keep loading it through the
+    prompt registry. Its version ID is derived from the content. Writers
+    read a (text, version) pair and later call `compare_and_swap` with that
+    version. The update is applied only if the file still has that version,
+    and is written to a temp file and moved into place with os.replace, so
+    readers never see a half-written rule. Updates are serialized by an
+    exclusive lock on `.history/<rule>.lock` next to the rule (flock, or
+    msvcrt.locking on Windows). Every write
+    and every rejected (conflicting) update is appended to
+    `.history/<rule>.jsonl` with its full text, so any recorded version can
+    be restored with `rollback`.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+
+    # -- paths --------------------------------------------------------------
+
+    @staticmethod
+    def _paths(path: str) -> tuple[Path, Path, Path]:
+        target = Path(resource_path(path))
+        history_dir = target.parent / HISTORY_DIR
+        return target, history_dir / f"{target.name}.jsonl", history_dir / f"{target.name}.lock"
+
+    @contextmanager
+    def _locked(self, path: str):
+        _, _, lock_path = self._paths(path)
+        lock_path.parent.mkdir(parents=True, exist_ok=True)
+        with self._lock:
+            fd = os.open(lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                with exclusive_lock(fd):
+                    yield
+            finally:
+                os.close(fd)
+
+    # -- reading ------------------------------------------------------------
+
+    def read(self, path: str) -> tuple[str, str]:
+        """(text, version) of the rule at `path`; a missing rule reads as empty."""
+
+        target, _, _ = self._paths(path)
+        try:
+            text = target.read_text(encoding="utf-8")
+        except FileNotFoundError:
+            text = ""
+        return text, rule_version(text)
+
+    def history(self, path: str) -> list[dict]:
+        """Recorded entries for `path`, oldest first: version, parent, status, note, time, text."""
+
+        _, history_path, _ = self._paths(path)
+        try:
+            raw = history_path.read_bytes()
+        except FileNotFoundError:
+            return []
+        entries = []
+        for line in raw.splitlines():
+            try:
+                entries.append(json.loads(line))
+            except ValueError:
+                continue
+        return entries
+
+    # -- writing ------------------------------------------------------------
+
+    def compare_and_swap(self, path: str, expected_version: str, text: str, note: str = "") -> str | None:
+        """Replace the rule with `text` if it is still at `expected_version`.
+
+        Returns the new version, or None when another writer changed the rule
+        first; the rejected text is kept in the history as a "conflict" entry.
+        """
+
+        with self._locked(path):
+            current_text, current_version = self.read(path)
+            new_version = rule_version(text)
+            if current_version != expected_version:
+                self._record(path, new_version, expected_version, "conflict", note, text)
+                metrics.incr("rule_store.conflict")
+                print(f"[rule store] {path}: update based on {expected_version} rejected, rule is now {current_version}")
+                return None
+            if new_version == current_version:
+                return current_version
+            if not self.history(path):
+                # Keep the version we started from, so the first edit can be rolled back too.
+                self._record(path, current_version, None, "base", "", current_text)
+            self._write(path, text)
+            self._record(path, new_version, current_version, "written", note, text)
+        prompt_registry.invalidate(path)
+        metrics.incr("rule_store.written")
+        return new_version
+
+    def rollback(self, path: str, version: str, note: str = "") -> str | None:
+        """Restore any version recorded in the history of `path` (written, base or conflict)."""
+
+        entry = next((e for e in reversed(self.history(path)) if e.get("version") == version), None)
+        if entry is None:
+            raise KeyError(f"Unknown version {version} for rule {path}")
+        _, current_version = self.read(path)
+        restored = self.compare_and_swap(path, current_version, entry.get("text", ""), note or f"rollback to {version}")
+        if restored is not None:
+            metrics.incr("rule_store.rollback")
+        return restored
+
+    # -- internals ----------------------------------------------------------
+
+    def _write(self, path: str, text: str) -> None:
+        target, _, _ = self._paths(path)
+        tmp = target.with_name(f".{target.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, target)
+
+    def _record(self, path: str, version: str, parent: str | None, status: str, note: str, text: str) -> None:
+        _, history_path, _ = self._paths(path)
+        entry = {"version": version, "parent": parent, "status": status, "note": note, "time": time.time(), "text": text}
+        fd = os.open(history_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, (json.dumps(entry, ensure_ascii=False) + "\n").encode("utf-8"))
+        finally:
+            os.close(fd)
+
+
+_store: RuleStore | None = None
+_store_lock = threading.Lock()
+
+
+def get_rule_store() -> RuleStore:
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = RuleStore()
+        return _store
+
+
+def rule_store_report() -> list[str]:
+    written = metrics.counter("rule_store.written")
+    conflicts = metrics.counter("rule_store.conflict")
+    if not written and not conflicts:
+        return []
+    return [
+        f"rule updates written {int(written)}, rejected as conflicts {int(conflicts)}, "
+        f"rollbacks {int(metrics.counter('rule_store.rollback'))}"
+    ]
+
+
+metrics.add_report_section("Rule store", rule_store_report)
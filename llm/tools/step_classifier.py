@@ -0,0 +1,223 @@
+import json
+import math
+import re
+import threading
+from collections import Counter
+from pathlib import Path
+
+from enums.issue_enum import ScenarioEnum
+from llm.tools.case_store import get_case_store
+from utils.metrics import metrics
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def _features(text: str) -> Counter:
+    tokens = _TOKEN_RE.findall(str(text or "").lower())
+    features = Counter(tokens)
+    features.update(f"{a} {b}" for a, b in zip(tokens, tokens[1:]))
+    return features
+
+
+def _normalize(vector: dict[str, float]) -> dict[str, float]:
+    norm = math.sqrt(sum(v * v for v in vector.values()))
+    if not norm:
+        return {}
+    return {k: v / norm for k, v in vector.items()}
+
+
+def planner_step_type(label) -> str | None:
+    """`label` as a planner step type (a ScenarioEnum value); None for labels outside that taxonomy.
+
+    cases.json also carries SceneEnum names such as "CONDITIONAL", which the
+    planner never emits, so they must not become classifier labels.
+    """
+
+    label = str(label or "").strip()
+    for scenario in ScenarioEnum:
+        if label in (scenario.value, scenario.name):
+            return scenario.value
+    return None
+
+
+_ENGLISH_WORDS = frozenset(
+    "a an and are as at be by click for from go if in is it of on open or select the then to verify with you your".split()
+)
+
+
+def looks_english(text: str) -> bool:
+    """Whether `text` can stand in for the planner's English step description.
+
+    All letters must be ASCII, and a text of four or more words must
+    contain a common English word. That rules out German or Portuguese
+    written without accents.
+    """
+
+    letters = [ch for ch in str(text or "") if ch.isalpha()]
+    if not letters or not all(ch.isascii() for ch in letters):
+        return False
+    words = _TOKEN_RE.findall(str(text).lower())
+    return len(words) < 4 or any(word in _ENGLISH_WORDS for word in words)
+
+
+def standard_text_of(step_raw_desc: str) -> str:
+    """The standard-text part of a cases.json step_raw_desc ("Standard Text: ...\\nActual Text: ...")."""
+
+    text = str(step_raw_desc or "")
+    if text.startswith("Standard Text:"):
+        text = text[len("Standard Text:"):]
+    return text.split("\nActual Text:", 1)[0].strip()
+
+
+class StepTypeClassifier:
+    """TF-IDF nearest-centroid classifier over standard step texts.
+
+    Features are lower-cased word unigrams and bigrams with sublinear tf and
+    smoothed idf. Confidence is the cosine margin between the best and the
+    second-best centroid, so a text that is close to two step types is low
+    confidence even when both similarities are high.
+    """
+
+    def __init__(self):
+        self.idf: dict[str, float] = {}
+        self.centroids: dict[str, dict[str, float]] = {}
+        self.example_count = 0
+        self.label_counts: Counter = Counter()
+
+    def _vector(self, text: str) -> dict[str, float]:
+        features = _features(text)
+        return _normalize({
+            term: (1.0 + math.log(count)) * self.idf[term]
+            for term, count in features.items()
+            if term in self.idf
+        })
+
+    def fit(self, examples: list[tuple[str, str]]) -> "StepTypeClassifier":
+        examples = [(text, label) for text, label in examples if str(text or "").strip() and label]
+        self.example_count = len(examples)
+        self.label_counts = Counter(label for _, label in examples)
+        document_frequency: Counter = Counter()
+        for text, _ in examples:
+            document_frequency.update(set(_features(text)))
+        n = len(examples)
+        self.idf = {term: math.log((1 + n) / (1 + df)) + 1.0 for term, df in document_frequency.items()}
+
+        sums: dict[str, Counter] = {}
+        for text, label in examples:
+            sums.setdefault(label, Counter()).update(self._vector(text))
+        self.centroids = {label: _normalize(dict(total)) for label, total in sums.items()}
+        return self
+
+    def predict(self, text: str) -> tuple[str | None, float]:
+        """Return (step_type, confidence); (None, 0.0) when nothing is known about the text."""
+
+        vector = self._vector(text)
+        if not vector or not self.centroids:
+            return None, 0.0
+        scores = sorted(
+            ((sum(weight * centroid.get(term, 0.0) for term, weight in vector.items()), label)
+             for label, centroid in self.centroids.items()),
+            reverse=True,
+        )
+        best_score, best_label = scores[0]
+        if best_score <= 0:
+            return None, 0.0
+        second_score = scores[1][0] if len(scores) > 1 else 0.0
+        return best_label, best_score - second_score
+
+    def missing_step_types(self) -> list[str]:
+        """Planner step types with no training example; the classifier can never predict them."""
+
+        return [scenario.value for scenario in ScenarioEnum if scenario.value not in self.centroids]
+
+    def unready_reason(self, min_examples: int) -> str | None:
+        """Why the classifier must not replace the planner LLM yet, or None when it may.
+
+        A classifier that has never seen a step type still assigns those
+        steps, confidently, to the nearest type it knows, so the confidence
+        margin alone cannot protect the bypass.
+        """
+
+        if self.example_count < min_examples:
+            return f"{self.example_count} training examples, {min_examples} required"
+        missing = self.missing_step_types()
+        if missing:
+            return f"no training examples for {', '.join(missing)}"
+        return None
+
+
+def training_examples(plan_cache_dir: str | None = None) -> list[tuple[str, str]]:
+    """Labelled (standard text, step type) pairs from the example cases and stored planner outputs."""
+
+    examples: list[tuple[str, str]] = []
+    for case in get_case_store().cases():
+        label = planner_step_type(case.get("step_type"))
+        if label:
+            examples.append((standard_text_of(case.get("step_raw_desc", "")), label))
+
+    if plan_cache_dir and Path(plan_cache_dir).is_dir():
+        for path in Path(plan_cache_dir).glob("*.json"):
+            try:
+                entry = json.loads(path.read_text(encoding="utf-8"))
+            except (OSError, ValueError):
+                continue
+            texts = entry.get("standard_texts") or []
+            for text, step in zip(texts, entry.get("plan") or []):
+                label = planner_step_type(step.get("step_type")) if isinstance(step, dict) else None
+                if label:
+                    examples.append((text, label))
+    return examples
+
+
+_classifiers: dict[str, StepTypeClassifier] = {}
+_classifiers_lock = threading.Lock()
+
+
+def get_step_classifier(plan_cache_dir: str | None) -> StepTypeClassifier:
+    """Process-wide classifier, trained once on first use."""
+
+    key = plan_cache_dir or ""
+    with _classifiers_lock:
+        classifier = _classifiers.get(key)
+        if classifier is None:
+            classifier = StepTypeClassifier().fit(training_examples(plan_cache_dir))
+            print(f"[step classifier] trained on {classifier.example_count} examples, {len(classifier.centroids)} step types")
+            if classifier.missing_step_types():
+                print(f"[step classifier] no examples for: {', '.join(classifier.missing_step_types())}")
+            _classifiers[key] = classifier
+        return classifier
+
+
+def record_agreement(predictions: list[tuple[str | None, float]], plan: list, min_confidence: float) -> None:
+    """Compare classifier predictions with the step types the planner LLM chose."""
+
+    for (label, confidence), step in zip(predictions, plan):
+        if not isinstance(step, dict) or label is None:
+            continue
+        agree = label == step.get("step_type")
+        metrics.incr("step_classifier.compared")
+        metrics.incr("step_classifier.agree", int(agree))
+        if confidence >= min_confidence:
+            metrics.incr("step_classifier.confident_compared")
+            metrics.incr("step_classifier.confident_agree", int(agree))
+
+
+def step_classifier_report() -> list[str]:
+    counters = metrics.snapshot()["counters"]
+    cases = counters.get("step_classifier.cases", 0)
+    if not cases:
+        return []
+    bypassed = counters.get("step_classifier.bypassed", 0)
+    lines = [f"planner bypassed for {int(bypassed)}/{int(cases)} cases ({bypassed / cases:.1%})"]
+    not_ready = counters.get("step_classifier.not_ready", 0)
+    if not_ready:
+        lines.append(f"shadow only, classifier not ready: {int(not_ready)} cases")
+    for prefix, label in (("", "all steps"), ("confident_", "confident steps")):
+        compared = counters.get(f"step_classifier.{prefix}compared", 0)
+        agree = counters.get(f"step_classifier.{prefix}agree", 0)
+        if compared:
+            lines.append(f"agreement with planner LLM ({label}): {int(agree)}/{int(compared)} ({agree / compared:.1%})")
+    return lines
+
+
+metrics.add_report_section("Step classifier", step_classifier_report)
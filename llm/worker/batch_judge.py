@@ -0,0 +1,237 @@
+import json
+import time
+from pathlib import Path
+
+from llm.agents.planer_agent import Planner
+from llm.client_manager import ClientManager, record_usage, usage_of
+from llm.models import build_chat_request_kwargs
+from llm.short_circuit import short_circuit_rules
+from llm.structured_output import response_format_for
+from llm.worker.image_to_steps_check import (
+    all_correct_report,
+    build_step_judge_messages,
+    failed_step_report,
+    interpret_judge_reply,
+)
+from utils.parameters import parse_parameters
+
+
+BATCH_TERMINAL_STATUSES = {"completed", "failed", "expired", "cancelled"}
+
+
+class BatchSubmitter:
+    """Submit chat-completion requests through the OpenAI Batch API and collect replies.
+
+    Works against any endpoint speaking the Batch protocol (OpenAI, Azure global
+    batch deployments, or a local stand-in such as scripts/fake_batch_server.py
+    reached through OPENAI_BASE_URL).
+    """
+
+    def __init__(self, client_manager: ClientManager, args):
+        self.client = client_manager.client
+        self.structured_output = client_manager.structured_output
+        self.args = args
+        self.model = args.batch_model or args.model
+        # Azure batch files address the deployment-relative route.
+        self.endpoint = "/chat/completions" if args.mode == "azure" else "/v1/chat/completions"
+        self.batch_dir = Path(args.batch_dir)
+        self.batch_dir.mkdir(parents=True, exist_ok=True)
+
+    def request_line(self, custom_id: str, messages: list, schema: str | None) -> dict:
+        response_format = response_format_for(schema) if schema and self.structured_output else None
+
+        body = build_chat_request_kwargs(
+            messages=messages,
+            model=self.model,
+            max_tokens=self.args.max_tokens,
+            temperature=self.args.temperature,
+            top_p=self.args.top_p,
+            response_format=response_format,
+        )
+        # timeout is a client option, not part of the request body.
+        body.pop("timeout", None)
+        return {"custom_id": custom_id, "method": "POST", "url": self.endpoint, "body": body}
+
+    def run(self, name: str, lines: list[dict]) -> tuple[dict[str, str], dict[str, str]]:
+        """Submit one batch, wait for it, and return ({custom_id: reply content}, {custom_id: failure}).
+
+        Every request lands in exactly one of the two. A failed, expired or
+        cancelled batch, a missing output line and a non-200 status are
+        failures, never an empty reply.
+        """
+
+        if not lines:
+            return {}, {}
+
+        input_path = self.batch_dir / f"{name}-input.jsonl"
+        payload = "\n".join(json.dumps(line, ensure_ascii=False) for line in lines) + "\n"
+        input_path.write_text(payload, encoding="utf-8")
+
+        batch_file = self.client.files.create(file=(input_path.name, payload.encode("utf-8")), purpose="batch")
+        batch = self.client.batches.create(
+            input_file_id=batch_file.id,
+            endpoint=self.endpoint,
+            completion_window=self.args.batch_completion_window,
+        )
+        print(f"[batch] {name}: submitted {len(lines)} requests as {batch.id}")
+
+        started = time.perf_counter()
+        while batch.status not in BATCH_TERMINAL_STATUSES:
+            time.sleep(self.args.batch_poll_interval)
+            batch = self.client.batches.retrieve(batch.id)
+            counts = getattr(batch, "request_counts", None)
+            if counts is not None:
+                print(f"[batch] {name}: {batch.status} {counts.completed}/{counts.total}")
+
+        print(f"[batch] {name}: {batch.status} after {time.perf_counter() - started:.0f}s")
+
+        replies: dict[str, str] = {}
+        failures: dict[str, str] = {}
+        output_text = self.client.files.content(batch.output_file_id).text if batch.output_file_id else ""
+        if output_text:
+            (self.batch_dir / f"{name}-output.jsonl").write_text(output_text, encoding="utf-8")
+
+        kind = name.split("-", 1)[0]
+        for raw in output_text.splitlines():
+            raw = raw.strip()
+            if not raw:
+                continue
+            try:
+                result = json.loads(raw)
+            except ValueError:
+                continue
+            custom_id = result.get("custom_id")
+            response = result.get("response") or {}
+            body = response.get("body") or {}
+            if response.get("status_code") != 200 or not body:
+                failures[custom_id] = f"status {response.get('status_code')}: {result.get('error') or 'no response body'}"
+                continue
+            record_usage(kind, usage_of(body), None)
+            choices = body.get("choices") or []
+            content = (choices[0].get("message") or {}).get("content") if choices else None
+            replies[custom_id] = (content or "").strip()
+
+        for line in lines:
+            custom_id = line["custom_id"]
+            if custom_id not in replies and custom_id not in failures:
+                failures[custom_id] = f"batch {batch.status} without output for the request"
+        if failures:
+            print(f"[batch] {name}: {len(failures)}/{len(lines)} requests failed")
+        return replies, failures
+
+
+def batch_error_report(reason: str, step_number=-1) -> dict:
+    """Report for a row the batch could not judge; transport failures never count as Correct."""
+
+    return {
+        "final_summary": {
+            "step_number": step_number,
+            "final_result": "Error",
+            "reason": reason,
+        }
+    }
+
+
+def run_batch_judgement(rows: list[dict]) -> dict:
+    """Judge many rows through the Batch API.
+
+    `rows` holds {"row_id", "steps_json"} entries. Planning runs as one batch;
+    step judgements then run in waves, one step per still-open row per wave,
+    because each judge prompt carries the history of earlier Correct steps.
+    Returns {row_id: report} with the same report shape as check mode.
+    """
+
+    args = parse_parameters()
+    planner = Planner()
+    submitter = BatchSubmitter(planner.llm_client.client, args)
+    run_id = time.strftime("%Y%m%d-%H%M%S")
+
+    reports: dict = {}
+    states: dict = {}
+    plan_lines = []
+    for row in rows:
+        row_id = row["row_id"]
+        messages, user_content_structured, group_duplicates = planner.prepare(row["steps_json"])
+        cache_key, cached = planner.cached_plan(row["steps_json"])
+        states[row_id] = {
+            "steps_json": row["steps_json"],
+            "user_content": user_content_structured,
+            "group_duplicates": group_duplicates,
+            "cache_key": cache_key,
+        }
+        if cached is None:
+            cached = planner.classify_plan(row["steps_json"])
+        if cached is not None:
+            states[row_id]["plans"] = planner.merge_plan_with_user_content(cached, user_content_structured)
+            continue
+        plan_lines.append(submitter.request_line(f"plan-{row_id}", messages, "plan"))
+
+    plan_replies, plan_failures = submitter.run(f"plan-{run_id}", plan_lines)
+
+    for row_id, state in states.items():
+        plans = state.get("plans")
+        if plans is None and f"plan-{row_id}" in plan_failures:
+            reports[row_id] = batch_error_report(f"Plan request failed: {plan_failures[f'plan-{row_id}']}")
+            plans = []
+        elif plans is None:
+            plans = planner.finish_plan(
+                plan_replies[f"plan-{row_id}"],
+                state["user_content"],
+                state["steps_json"],
+                state["cache_key"],
+            )
+            if not plans:
+                reports[row_id] = batch_error_report("Planner returned an empty plan; cannot judge the row.")
+        state["plans"] = plans
+        state["index"] = 0
+        state["history"] = []
+        state["rules"] = short_circuit_rules(args)
+        print(f"[batch] row {row_id}: plans length: {len(plans)}")
+
+    wave = 0
+    while True:
+        open_rows = [rid for rid, st in states.items() if rid not in reports and st["index"] < len(st["plans"])]
+        for rid, st in states.items():
+            if rid not in reports and st["index"] >= len(st["plans"]):
+                reports[rid] = all_correct_report()
+        if not open_rows:
+            break
+
+        wave += 1
+        lines = []
+        local_verdicts = {}
+        for rid in open_rows:
+            st = states[rid]
+            step = st["plans"][st["index"]]
+            notes = None
+            if st["rules"] is not None:
+                local_verdicts[rid] = st["rules"].verdict(step)
+                if local_verdicts[rid] is not None:
+                    continue
+                notes = st["rules"].notes(step)
+            messages = build_step_judge_messages(step, st["history"], st["group_duplicates"], notes, args=args)
+            lines.append(submitter.request_line(f"judge-{rid}-{st['index']}", messages, "final_summary"))
+
+        replies, failures = submitter.run(f"judge-{run_id}-wave{wave}", lines)
+
+        for rid in open_rows:
+            st = states[rid]
+            step = st["plans"][st["index"]]
+            step_number = step.get("step_number", 999)
+            custom_id = f"judge-{rid}-{st['index']}"
+            st["index"] += 1
+            if local_verdicts.get(rid) is None and custom_id in failures:
+                reports[rid] = batch_error_report(f"Judge request failed: {failures[custom_id]}", step_number)
+                continue
+            verdict = local_verdicts.get(rid) or interpret_judge_reply(replies.get(custom_id), submitter.structured_output)
+            if verdict is None:
+                # Same as the interactive loop: an unusable reply skips the step
+                # without adding it to the history.
+                print(f"Warning: row {rid} step {step_number} returned empty content.")
+                continue
+            if verdict["final_result"] == "Correct":
+                st["history"].append({"step_number": step_number, "final_result": "Correct", "reason": ""})
+                continue
+            reports[rid] = failed_step_report(step_number, verdict)
+
+    return reports
@@ -1,12 +1,24 @@
 import json
 import re
 import asyncio
-from pathlib import Path
 from llm.client_manager import ClientManager
-from enums.issue_enum import IssueEnum, SceneEnum
-from utils.file_utils import load_prompt, get_prompt_file, resource_path
+from utils.file_utils import load_prompt, get_prompt_file
 from utils.parameters import parse_parameters
 from llm.agents.planer_agent import Planner
+from llm.structured_output import parse_model_json
+from llm.judge import (
+    HISTORY_ENCODINGS,
+    build_judge_messages,
+    build_multi_step_judge_messages,
+    format_history,
+    history_encoding_of,
+)
+from llm.cascade import cascade_judge
+from llm.short_circuit import ShortCircuitRules, short_circuit_rules
+from llm.tools.case_index import near_match_enabled, similar_success_reasons
+from llm.tools.case_store import get_case_store
+from llm.tools.image_prep import prepare_image_part
+from utils.metrics import metrics
 # from llm.tools import SemanticMemory
 
 # semantic_memory = SemanticMemory(name="SemanticMemory")
@@ -30,46 +42,6 @@ Output actions for EACH Section in the following JSON format:
 }}
 """
 
-COMPARISON_SYSTEM_PROMPT="""
-## ROLE
-You are a top-notch functional testing expert: extremely proficient in functional testing.
-
-## INPUT VARIABLES
-
-step_type_rule:{step_type_rule}
-history_step_results: {history_steps}
-
-## GOAL
-The plot and step descriptions, as well as historical steps, are used to determine the current step's test result.
-
-## Output JSON Format
-Output actions for EACH Section in the following JSON format:
-{{
-    "final_summary": {{
-        "final_result": "Correct" | "Incorrect" | "Spam" | "NeedDiscussion",
-        "reason": "Explanation for the final result."
-    }}
-}}
-"""
-
-
-def _get_step_success_reason_by_raw_desc(test_cases: object, raw_text: str) -> str | None:
-
-    raw_key = (raw_text or "").strip()
-    if not raw_key:
-        return None
-    if not isinstance(test_cases, list):
-        return None
-
-    for case in test_cases:
-        if not isinstance(case, dict):
-            continue
-        if str(case.get("step_raw_desc", "")).strip() == raw_key:
-            value = case.get("step_success_reason")
-            return None if value is None else str(value)
-    return None
-
-
 
 def _strip_code_fences(text: str) -> str:
 
@@ -160,151 +132,604 @@ def _normalize_final_result(value: str | None) -> str:
     return "NeedDiscussion"
 
 
-async def check_steps_with_image_matching_async(steps_json, issue_type, judge_comment):
-
-    planner = Planner()
-    plans, group_duplicates = planner.plan(steps_json)
-    total_step = len(plans)
-    print(f'plans length: {len(plans)} ')
-    args = parse_parameters()
-    args.async_client = True
-    client = ClientManager(args=args)
+def load_step_type_rule(step_type: str) -> str:
+    step_type_rule_path = get_prompt_file(step_type)
+    return load_prompt(step_type_rule_path) if step_type_rule_path else ""
 
-    print("Duplicate image step numbers:", group_duplicates)
 
+def _old_duplicates_for_step(group_duplicates, step_number) -> list[int]:
+    old_duplicates: list[int] = []
     try:
+        if isinstance(group_duplicates, list) and group_duplicates:
+            if isinstance(group_duplicates[0], list):
+                for g in group_duplicates:
+                    if step_number in g:
+
+                        old_duplicates = [i for i in g if i <= step_number]
+                        break
+            else:
+                if step_number in group_duplicates:
+                    old_duplicates = [i for i in group_duplicates if i <= step_number]
+    except Exception:
+        old_duplicates = []
+    return old_duplicates
 
-        await asyncio.sleep(3)
 
-        parsed = None
-        content = None
-        history_steps: list[dict] = []
+def build_step_user_content(step: dict, group_duplicates, notes: list[dict] | None = None, args=None) -> list[dict]:
+    """Per-step user content for the judge: descriptions, duplicates, example case, rule notes and screenshot.
+
+    `args` supplies the near-match and image preparation settings.
+    """
 
-        for step in plans:
+    step_number = step.get("step_number", 999)
 
-            step_type = step.get("step_type", "")
-            print(f"Processing step type: {step_type}")
-            step_type_rule_path = get_prompt_file(step_type)
-            step_type_rule = load_prompt(step_type_rule_path) if step_type_rule_path else ""
+    ai_optimize_supple_text = step.get("text", "")
+    raw_text = step.get("actual_text", "")
+    image_url = step.get("actual_image_url") or step.get("standard_image_url")
 
-            system_prompt_step = COMPARISON_SYSTEM_PROMPT.format(
-                step_type_rule=step_type_rule,
-                history_steps=json.dumps(history_steps, ensure_ascii=False),
+    matched_step_success_reason = get_case_store().success_reason(raw_text)
+    # aa = semantic_memory.query_steps(standard_text)
+
+    # print(f"RAG return: {aa}")
+
+    old_duplicates = _old_duplicates_for_step(group_duplicates, step_number)
+
+    user_content_structured = [
+        {"type": "text", "text": f"Step standard description: {ai_optimize_supple_text}"},
+        {"type": "text", "text": f"Duplicate image step numbers:{old_duplicates}, please consider this information when making judgments."},
+        {"type": "text", "text": f"Step actual description: {raw_text}"},
+    ]
+
+    if matched_step_success_reason:
+        print(f"matched_step_success_reason: {matched_step_success_reason}")
+        user_content_structured.append(
+            {
+                "type": "text",
+                "text": (
+                    "Matched example-case step_success_reason (same step_raw_desc): "
+                    f"{matched_step_success_reason}"
+                ),
+            }
+        )
+    elif near_match_enabled(args):
+        for similarity, reason in similar_success_reasons(raw_text, args):
+            user_content_structured.append(
+                {
+                    "type": "text",
+                    "text": (
+                        f"Similar example-case step_success_reason (similarity {similarity:.2f}): "
+                        f"{reason}"
+                    ),
+                }
             )
-            step_number = step.get("step_number", 999)
-            user_content_structured = []
 
-            ai_optimize_supple_text = step.get("text", "")
-            raw_text = step.get("actual_text", "")
-            image_url = step.get("actual_image_url") or step.get("standard_image_url")
+    user_content_structured.extend(notes or [])
+
+    if isinstance(image_url, str):
+        image_url = image_url.strip()
+    else:
+        image_url = None
+
+    if image_url and (
+        image_url.startswith("http://")
+        or image_url.startswith("https://")
+        or image_url.startswith("data:")
+    ):
+        user_content_structured.append(prepare_image_part(image_url, step.get("step_type"), args))
+
+    return user_content_structured
+
+
+def build_step_judge_messages(
+    step: dict,
+    history_steps: list[dict],
+    group_duplicates,
+    notes: list[dict] | None = None,
+    history_encoding: str | None = None,
+    args=None,
+) -> list[dict]:
+    """Judge messages for one step; the history encoding defaults to the --history_encoding of `args`."""
+
+    step_type_rule = load_step_type_rule(step.get("step_type", ""))
+    user_content_structured = build_step_user_content(step, group_duplicates, notes, args)
+    return build_judge_messages(step_type_rule, history_steps, user_content_structured, history_encoding or history_encoding_of(args))
+
+
+def interpret_judge_reply(content: str | None, structured: bool) -> dict | None:
+    """Turn a judge reply into {"final_result", "reason"}; None when the reply is unusable."""
+
+    if not content:
+        return None
+    parsed = parse_model_json(content, "final_summary", structured, _try_parse_json_object)
+    if not parsed or not isinstance(parsed.get("final_summary"), dict):
+        return None
+    return _verdict_from_summary(parsed.get("final_summary", {}))
+
+
+def _verdict_from_summary(final: dict) -> dict:
+    verdict = {
+        "final_result": _normalize_final_result(final.get("final_result")),
+        "reason": str(final.get("reason", "")).strip() or "No reason provided",
+    }
+    if "confidence" in final:
+        verdict["confidence"] = final.get("confidence")
+    return verdict
+
+
+def interpret_multi_step_reply(content: str | None, structured: bool, step_numbers: list) -> dict | None:
+    """Map a multi-step judge reply to {step_number: verdict}; None when the reply is unusable."""
+
+    if not content:
+        return None
+    parsed = parse_model_json(content, "final_summary_batch", structured, _try_parse_json_object)
+    summaries = parsed.get("final_summary") if parsed else None
+    if not isinstance(summaries, list):
+        return None
+    verdicts = {}
+    for position, final in enumerate(summaries):
+        if not isinstance(final, dict):
+            continue
+        step_number = final.get("step_number")
+        if step_number not in step_numbers and position < len(step_numbers):
+            step_number = step_numbers[position]
+        if step_number in step_numbers and step_number not in verdicts:
+            verdicts[step_number] = _verdict_from_summary(final)
+    return verdicts
+
+
+async def judge_step_async(
+    client: ClientManager,
+    step: dict,
+    history_steps: list[dict],
+    group_duplicates,
+    rules: ShortCircuitRules | None = None,
+    kind: str = "judge",
+) -> dict | None:
+    """Judge one planned step; returns the verdict dict or None for an unusable reply.
+
+    `kind` is the call kind the judgement is sent, routed and counted as;
+    the multi-step fallback uses its own so its cost stays on the multi-step side.
+    """
+
+    notes = None
+    if rules is not None:
+        await rules.prepare_async([step])
+        verdict = rules.verdict(step)
+        if verdict is not None:
+            return verdict
+        notes = rules.notes(step)
+
+    encoding = history_encoding_of(client.args)
+    messages = build_step_judge_messages(step, history_steps, group_duplicates, notes, encoding, client.args)
+    record_history_size(history_steps, encoding)
+    if kind == "judge":
+        metrics.incr("judge_per_step.calls")
+    step_type = step.get("step_type", "")
+
+    if getattr(client.args, "cascade_model", None):
+        judging = cascade_judge(
+            client,
+            messages,
+            step_type,
+            lambda content: interpret_judge_reply(content, client.structured_output),
+            kind,
+        )
+    else:
+        judging = _judge_messages_async(client, messages, step_type, kind)
+
+    if not getattr(client.args, "history_shadow", False) or not history_steps:
+        return await judging
+
+    # Same step with the other history encoding, to measure verdict agreement.
+    other = "json" if encoding == "ranges" else "ranges"
+    shadow_messages = build_step_judge_messages(step, history_steps, group_duplicates, notes, other, client.args)
+    verdict, shadow = await asyncio.gather(judging, _judge_messages_async(client, shadow_messages, step_type, "judge_shadow"))
+    if verdict is not None and shadow is not None:
+        metrics.incr("history_shadow.compared")
+        metrics.incr("history_shadow.agree", int(verdict["final_result"] == shadow["final_result"]))
+    return verdict
+
+
+async def _judge_messages_async(client: ClientManager, messages: list[dict], step_type: str, kind: str) -> dict | None:
+    content = await client.chat_completion_async(
+        messages=messages,
+        schema="final_summary",
+        kind=kind,
+        step_type=step_type,
+    )
+    return interpret_judge_reply(content, client.structured_output)
+
+
+def record_history_size(history_steps: list[dict], sent: str) -> None:
+    """Size of the history part in every encoding; `sent` is the encoding actually sent."""
+
+    if not history_steps:
+        return
+    metrics.incr("history.prompts")
+    metrics.incr(f"history.sent.{sent}")
+    for encoding in HISTORY_ENCODINGS:
+        metrics.incr(f"history.chars.{encoding}", len(format_history(history_steps, encoding)))
+
+
+def history_report() -> list[str]:
+    counters = metrics.snapshot()["counters"]
+    prompts = counters.get("history.prompts", 0)
+    if not prompts:
+        return []
+    sizes = ", ".join(
+        f"{encoding}{' (sent)' if counters.get(f'history.sent.{encoding}') else ''} "
+        f"{counters.get(f'history.chars.{encoding}', 0) / prompts:.0f} chars "
+        f"(~{counters.get(f'history.chars.{encoding}', 0) / prompts / 4:.0f} tokens)"
+        for encoding in HISTORY_ENCODINGS
+    )
+    lines = [f"{int(prompts)} prompts with history, mean history size: {sizes}"]
+    compared = counters.get("history_shadow.compared", 0)
+    if compared:
+        agree = counters.get("history_shadow.agree", 0)
+        lines.append(f"verdict agreement between encodings: {int(agree)}/{int(compared)} ({agree / compared:.1%})")
+    return lines
+
+
+metrics.add_report_section("History encoding", history_report)
+
+
+def failed_step_report(step_number, verdict: dict) -> dict:
+    return {
+        "final_summary": {
+            "step_number": step_number,
+            "final_result": verdict["final_result"],
+            "reason": verdict["reason"],
+        }
+    }
+
+
+def all_correct_report() -> dict:
+    return {
+        "final_summary": {
+            "final_result": "Correct",
+            "reason": "",
+        }
+    }
 
-            test_cases_path = Path(resource_path("llm/semanticmemory/cases.json"))
-            test_cases: list[dict] = []
-            try:
-                if test_cases_path.exists():
-                    raw_cases = (test_cases_path.read_text(encoding="utf-8") or "").strip()
-                    test_cases = json.loads(raw_cases) if raw_cases else []
-            except Exception:
-                test_cases = []
 
-            matched_step_success_reason = _get_step_success_reason_by_raw_desc(test_cases, raw_text)
-            # aa = semantic_memory.query_steps(standard_text)
+async def _streamed_plan_steps(planner: Planner, steps_json, prepared):
+    """Yield plan steps while the planner is still streaming; the planner task is cancelled on early exit."""
 
-            # print(f"RAG return: {aa}")
+    queue: asyncio.Queue = asyncio.Queue()
+
+    async def produce():
+        try:
+            return await planner.plan_stream_async(steps_json, prepared, queue.put_nowait)
+        finally:
+            queue.put_nowait(None)
 
-            old_duplicates: list[int] = []
+    planning = asyncio.create_task(produce())
+    try:
+        while (step := await queue.get()) is not None:
+            yield step
+        await planning
+    finally:
+        if not planning.done():
+            planning.cancel()
             try:
-                if isinstance(group_duplicates, list) and group_duplicates:
-                    if isinstance(group_duplicates[0], list):
-                        for g in group_duplicates:
-                            if step_number in g:
-
-                                old_duplicates = [i for i in g if i <= step_number]
-                                break
-                    else:
-                        if step_number in group_duplicates:
-                            old_duplicates = [i for i in group_duplicates if i <= step_number]
-            except Exception:
-                old_duplicates = []
-
-            user_content_structured = [
-                {"type": "text", "text": f"Step standard description: {ai_optimize_supple_text}"},
-                {"type": "text", "text": f"Duplicate image step numbers:{old_duplicates}, please consider this information when making judgments."},
-                {"type": "text", "text": f"Step actual description: {raw_text}"},
-            ]
-
-            if matched_step_success_reason:
-                print(f"matched_step_success_reason: {matched_step_success_reason}")
-                user_content_structured.append(
-                    {
-                        "type": "text",
-                        "text": (
-                            "Matched example-case step_success_reason (same step_raw_desc): "
-                            f"{matched_step_success_reason}"
-                        ),
-                    }
-                )
-
-            if isinstance(image_url, str):
-                image_url = image_url.strip()
+                await planning
+            except BaseException:
+                pass
+
+
+def _correct_history_entry(step: dict) -> dict:
+    return {
+        "step_number": step.get("step_number", 999),
+        "final_result": "Correct",
+        "reason": "",
+    }
+
+
+async def _judge_steps_speculative(
+    client: ClientManager,
+    plans: list[dict],
+    group_duplicates,
+    window: int = 0,
+    rules: ShortCircuitRules | None = None,
+) -> dict:
+    """Judge all steps concurrently, assuming every earlier step is Correct, then walk them in order.
+
+    History only ever holds Correct entries and the walk stops at the first
+    non-Correct verdict, so a speculative judgement is valid exactly when the
+    history it was built with equals the history the sequential loop would
+    have at that step. An unusable reply leaves a step out of the history;
+    every later judgement is then relaunched on the real history. The result
+    is the same as the sequential loop; only latency and spent calls differ.
+    `window` bounds how many steps are in flight ahead of the walk (0 = all).
+    """
+
+    total_step = len(plans)
+    tasks: dict[int, tuple[asyncio.Task, list[dict]]] = {}
+
+    def launch(start: int, base_history: list[dict]) -> None:
+        history = list(base_history)
+        end = total_step if window <= 0 else min(total_step, start + window)
+        for index in range(start, end):
+            if index not in tasks:
+                if rules is not None:
+                    # Rules must see the steps in plan order, not in task start order.
+                    rules.evaluate(plans[index])
+                snapshot = list(history)
+                task = asyncio.create_task(judge_step_async(client, plans[index], snapshot, group_duplicates, rules))
+                tasks[index] = (task, snapshot)
+                metrics.incr("speculative.launched")
+            history.append(_correct_history_entry(plans[index]))
+
+    def cancel_from(start: int) -> None:
+        for index in [i for i in tasks if i >= start]:
+            task, _ = tasks.pop(index)
+            if task.done() and not task.cancelled():
+                metrics.incr("speculative.wasted")
             else:
-                image_url = None
-
-            if image_url and (
-                image_url.startswith("http://")
-                or image_url.startswith("https://")
-                or image_url.startswith("data:")
-            ):
-                user_content_structured.append(
-                    {"type": "image_url", "image_url": {"url": image_url}}
-                )
-
-            content = await client.chat_completion_async(
-                messages=[
-                    {"role": "system", "content": system_prompt_step},
-                    {
-                        "role": "user",
-                        "content":user_content_structured
-                    }
-                ]
-            )
+                task.cancel()
+                metrics.incr("speculative.cancelled")
+
+    metrics.incr("judge_per_step.rows")
+    if rules is not None:
+        await rules.prepare_async(plans)
+    history_steps: list[dict] = []
+    try:
+        for index, step in enumerate(plans):
+            metrics.incr("judge_per_step.steps")
+            print(f"Processing step type: {step.get('step_type', '')}")
+            step_number = step.get("step_number", 999)
 
-            if content:
-                parsed = _try_parse_json_object(content)
-                if parsed and isinstance(parsed.get("final_summary"), dict):
-                    final = parsed.get("final_summary", {})
-                    final_result = _normalize_final_result(final.get("final_result"))
-                    if final_result == "Correct":
-                        print(f"Step {step.get('step_number', '?')}/{total_step} judged as Correct.")
-                        history_steps.append({
-                            "step_number": step_number,
-                            "final_result": "Correct",
-                            "reason": "",
-                        })
-                        continue
-                    else:
-                        final_reason = str(final.get("reason", "")).strip() or "No reason provided"
-
-                        return {
-                            "final_summary": {
-                                "step_number": step_number,
-                                "final_result": final_result,
-                                "reason": final_reason
-                            }
-                        }
+            if index in tasks and tasks[index][1] != history_steps:
+                # The speculation assumed a different history; relaunch from here.
+                metrics.incr("speculative.relaunched")
+                cancel_from(index)
+            launch(index, history_steps)
+
+            task, _ = tasks.pop(index)
+            verdict = await task
+            if verdict is not None:
+                if verdict["final_result"] == "Correct":
+                    print(f"Step {step.get('step_number', '?')}/{total_step} judged as Correct.")
+                    history_steps.append(_correct_history_entry(step))
+                    continue
+                return failed_step_report(step_number, verdict)
 
             print("Warning: model returned empty content, retrying in 3 seconds...")
             await asyncio.sleep(3)
 
-        return {
-            "final_summary": {
-                "final_result": "Correct",
-                "reason": "",
-            }
-        }
+        return all_correct_report()
+    finally:
+        cancel_from(0)
+
+
+async def judge_window_async(
+    client: ClientManager,
+    steps: list[dict],
+    history_steps: list[dict],
+    group_duplicates,
+    rules: ShortCircuitRules | None = None,
+) -> dict | None:
+    """Judge consecutive steps in one call; returns {step_number: verdict} or None for an unusable reply.
+
+    Steps the short-circuit rules decide are answered locally and left out of the call.
+    """
+
+    decided: dict = {}
+    step_type_rules: dict[str, str] = {}
+    window = []
+    if rules is not None:
+        await rules.prepare_async(steps)
+    for step in steps:
+        step_number = step.get("step_number", 999)
+        notes = None
+        if rules is not None:
+            verdict = rules.verdict(step)
+            if verdict is not None:
+                decided[step_number] = verdict
+                continue
+            notes = rules.notes(step)
+        step_type = step.get("step_type", "")
+        if step_type not in step_type_rules:
+            step_type_rules[step_type] = load_step_type_rule(step_type)
+        window.append((step_number, step_type, build_step_user_content(step, group_duplicates, notes, client.args)))
+
+    if not window:
+        return decided
+
+    encoding = history_encoding_of(client.args)
+    record_history_size(history_steps, encoding)
+    step_types = {step_type for _, step_type, _ in window}
+    content = await client.chat_completion_async(
+        messages=build_multi_step_judge_messages(step_type_rules, history_steps, window, encoding),
+        schema="final_summary_batch",
+        kind="judge_multi",
+        step_type=step_types.pop() if len(step_types) == 1 else None,
+    )
+    metrics.incr("judge_multi.windows")
+    verdicts = interpret_multi_step_reply(content, client.structured_output, [number for number, _, _ in window])
+    if verdicts is None:
+        return None
+    return {**verdicts, **decided}
+
+
+async def _judge_steps_windowed(
+    client: ClientManager,
+    plans: list[dict],
+    group_duplicates,
+    window: int,
+    rules: ShortCircuitRules | None = None,
+) -> dict:
+    """Judge `window` consecutive steps per call, walking the verdicts like the sequential loop.
+
+    Steps in a window are judged as if the earlier ones in it were Correct,
+    so the walk stops at the first non-Correct verdict. A step without a
+    verdict is skipped as the sequential loop would skip an unusable reply,
+    and the steps after it are re-sent in the next window on the real
+    history. A reply that cannot be parsed at all falls back to judging the
+    window's first step on its own.
+    """
+
+    total_step = len(plans)
+    metrics.incr("judge_multi.rows")
+    history_steps: list[dict] = []
+    index = 0
+    while index < total_step:
+        steps = plans[index : index + window]
+        verdicts = await judge_window_async(client, steps, history_steps, group_duplicates, rules)
+        if verdicts is None:
+            metrics.incr("judge_multi.fallbacks")
+            steps = steps[:1]
+            verdicts = {steps[0].get("step_number", 999): await judge_step_async(
+                client, steps[0], history_steps, group_duplicates, rules, kind="judge_multi_fallback"
+            )}
+
+        for step in steps:
+            print(f"Processing step type: {step.get('step_type', '')}")
+            step_number = step.get("step_number", 999)
+            index += 1
+            metrics.incr("judge_multi.steps")
+
+            verdict = verdicts.get(step_number)
+            if verdict is not None:
+                if verdict["final_result"] == "Correct":
+                    print(f"Step {step.get('step_number', '?')}/{total_step} judged as Correct.")
+                    history_steps.append(_correct_history_entry(step))
+                    continue
+                return failed_step_report(step_number, verdict)
+
+            print("Warning: model returned empty content, retrying in 3 seconds...")
+            await asyncio.sleep(3)
+            # Later verdicts in this window assumed this step was Correct.
+            break
+
+    return all_correct_report()
+
+
+def judge_multi_report() -> list[str]:
+    counters = metrics.snapshot()["counters"]
+    lines = []
+    fallbacks = counters.get("judge_multi.fallbacks", 0)
+    multi_calls = counters.get("calls.judge_multi", 0) + counters.get("calls.judge_multi_fallback", 0)
+    multi_prompt = counters.get("tokens.judge_multi.prompt", 0) + counters.get("tokens.judge_multi_fallback.prompt", 0)
+    modes = (
+        ("multi-step", "judge_multi", multi_calls, multi_prompt),
+        ("per-step", "judge_per_step", counters.get("judge_per_step.calls", 0), counters.get("tokens.judge.prompt", 0)),
+    )
+    for label, prefix, calls, prompt in modes:
+        rows = counters.get(f"{prefix}.rows", 0)
+        steps = counters.get(f"{prefix}.steps", 0)
+        if not rows or not steps:
+            continue
+        lines.append(
+            f"{label}: {int(rows)} rows, {int(steps)} steps judged in {int(calls)} calls "
+            f"({calls / rows:.1f} calls per row), input tokens {int(prompt)} ({prompt / steps:.0f} per judged step)"
+        )
+    if counters.get("judge_multi.rows", 0):
+        lines.append(f"multi-step windows {int(counters.get('judge_multi.windows', 0))}, per-step fallbacks {int(fallbacks)}")
+    return lines
+
+
+metrics.add_report_section("Multi-step judgement", judge_multi_report)
+
+
+def speculative_report() -> list[str]:
+    counters = metrics.snapshot()["counters"]
+    launched = counters.get("speculative.launched", 0)
+    if not launched:
+        return []
+    wasted = counters.get("speculative.wasted", 0)
+    cancelled = counters.get("speculative.cancelled", 0)
+    return [
+        f"judgements launched {int(launched)}, relaunched after a history change {int(counters.get('speculative.relaunched', 0))}",
+        f"finished but unused {int(wasted)} ({wasted / launched:.1%}), cancelled in flight {int(cancelled)}",
+    ]
+
+
+metrics.add_report_section("Speculative judgement", speculative_report)
+
+
+async def _listed_plan_steps(plans: list[dict]):
+    for step in plans:
+        yield step
+
+
+async def _chained_steps(first_step, rest):
+    if first_step is None:
+        return
+    yield first_step
+    async for step in rest:
+        yield step
+
+
+async def check_steps_with_image_matching_async(steps_json, issue_type, judge_comment):
+
+    planner = Planner()
+    args = parse_parameters()
+    streamed = None
+
+    if args.stream_plan:
+        # Judging starts as soon as the first plan entry has streamed in; duplicate
+        # detection runs alongside the planner call and is awaited before the first judgement.
+        prepared = await asyncio.to_thread(planner.prepare_messages, steps_json)
+        duplicates = asyncio.create_task(asyncio.to_thread(planner.duplicate_groups, prepared[2]))
+        total_step = len(steps_json)
+        streamed = plan_steps = _streamed_plan_steps(planner, steps_json, prepared)
+    else:
+        plans, group_duplicates = await planner.plan_async(steps_json)
+        total_step = len(plans)
+        print(f'plans length: {len(plans)} ')
+        plan_steps = _listed_plan_steps(plans)
+
+    args.async_client = True
+    client = ClientManager(args=args)
+    rules = short_circuit_rules(args)
+
+    try:
+
+        if args.stream_plan:
+            first_step = await anext(plan_steps, None)
+            group_duplicates = await duplicates
+            plan_steps = _chained_steps(first_step, plan_steps)
+
+        print("Duplicate image step numbers:", group_duplicates)
+
+        if not args.stream_plan:
+            await asyncio.sleep(3)
+
+        if args.judge_window > 1 and not args.stream_plan:
+            return await _judge_steps_windowed(client, plans, group_duplicates, args.judge_window, rules)
+
+        if args.speculative_judge and not args.stream_plan:
+            return await _judge_steps_speculative(client, plans, group_duplicates, args.speculative_window, rules)
+
+        metrics.incr("judge_per_step.rows")
+        history_steps: list[dict] = []
+
+        async for step in plan_steps:
+
+            metrics.incr("judge_per_step.steps")
+            print(f"Processing step type: {step.get('step_type', '')}")
+            step_number = step.get("step_number", 999)
+
+            verdict = await judge_step_async(client, step, history_steps, group_duplicates, rules)
+            if verdict is not None:
+                if verdict["final_result"] == "Correct":
+                    print(f"Step {step.get('step_number', '?')}/{total_step} judged as Correct.")
+                    history_steps.append(_correct_history_entry(step))
+                    continue
+                return failed_step_report(step_number, verdict)
+
+            print("Warning: model returned empty content, retrying in 3 seconds...")
+            await asyncio.sleep(3)
+
+        return all_correct_report()
 
     finally:
 
+        await plan_steps.aclose()
+        if streamed is not None:
+            await streamed.aclose()
+            duplicates.cancel()
         try:
             await client.aclose()
         except Exception:
@@ -1,12 +1,25 @@
 import json
 import re
 import asyncio
-from pathlib import Path
 from llm.client_manager import ClientManager
-from enums.issue_enum import IssueEnum, SceneEnum, ScenarioEnum
-from utils.file_utils import load_prompt, resource_path, get_prompt_file
+from utils.file_utils import load_prompt, get_prompt_file
 from utils.parameters import parse_parameters
 from llm.agents.planer_agent import Planner
+from llm.structured_output import parse_model_json
+from llm.judge import build_judge_messages, history_encoding_of
+from llm.tools.case_store import get_case_store
+from llm.tools.rule_store import get_rule_store
+from llm.rule_patch import (
+    RuleEditError,
+    apply_edits,
+    number_clauses,
+    parse_edits,
+    record_edit_round,
+    rule_edit_mode_of,
+    write_rule_change,
+)
+from llm.tools.image_prep import prepare_image_part
+from utils.metrics import metrics
 # from llm.tools import SemanticMemory
 
 # semantic_memory = SemanticMemory(name="SemanticMemory")
@@ -14,24 +27,6 @@ from llm.agents.planer_agent import Planner
 example_case = "llm/semanticmemory/cases.json"
 
 
-def _load_example_cases(path: str) -> list[dict]:
-    try:
-        p = Path(resource_path(path))
-        if not p.exists():
-            return []
-        raw = p.read_text(encoding="utf-8").strip()
-        if not raw:
-            return []
-        parsed = json.loads(raw)
-        return parsed if isinstance(parsed, list) else []
-    except Exception:
-        return []
-
-
-def _example_case_key(step_type: str | None, step_raw_desc: str | None) -> tuple[str, str]:
-    return (str(step_type or "").strip(), str(step_raw_desc or "").strip())
-
-
 def _append_example_case_if_new(
     path: str,
     *,
@@ -40,12 +35,7 @@ def _append_example_case_if_new(
     step_ai_desc: str,
     step_success_reason: str,
 ) -> bool:
-    cases = _load_example_cases(path)
-    new_key = _example_case_key(step_type, step_raw_desc)
-    if any(_example_case_key(c.get("step_type"), c.get("step_raw_desc")) == new_key for c in cases if isinstance(c, dict)):
-        return False
-
-    cases.append(
+    return get_case_store(path).append_if_new(
         {
             "step_type": step_type,
             "step_raw_desc": step_raw_desc,
@@ -54,11 +44,6 @@ def _append_example_case_if_new(
         }
     )
 
-    p = Path(resource_path(path))
-    p.parent.mkdir(parents=True, exist_ok=True)
-    p.write_text(json.dumps(cases, ensure_ascii=False, indent=2), encoding="utf-8")
-    return True
-
 IDENTIFY_JUDGE_SYSTEM_PROMPT = """
 ## ROLE
 You are a top-tier prompt engineer expert.
@@ -78,17 +63,12 @@ Output actions for EACH Section in the following JSON format:
 }}
 """
 
-COMPARISON_SYSTEM_PROMPT="""
+OPTIMIZA_SYSTEM_PROMPT="""
 ## ROLE
 You are a top-notch functional testing expert: extremely proficient in functional testing.
 
 ## INPUT VARIABLES
-
-step_type_rule:{step_type_rule}
-history_step_results: {history_steps}
-
-## GOAL
-The plot and step descriptions, as well as historical steps, are used to determine the current step's test result.
+step_type_rule: {step_type_rule}
 
 ## Output JSON Format
 Output actions for EACH Section in the following JSON format:
@@ -100,41 +80,55 @@ Output actions for EACH Section in the following JSON format:
 }}
 """
 
-OPTIMIZA_SYSTEM_PROMPT="""
+OPTIMIZATION_SYSTEM_PROMPT = """
 ## ROLE
-You are a top-notch functional testing expert: extremely proficient in functional testing.
+You are a top-tier functional testing expert, proficient in functional testing and prompt development.
+
+## GOAL
+Optimize the prompt based on results to ensure consistency between AI and human results.
 
 ## INPUT VARIABLES
-step_type_rule: {step_type_rule}
+Correct_Result: {human_judge_result}
+Correct_Reason: {human_judge_reason}
+AI_Judgment_Result: {ai_judge_result}
+AI_Judgment_Reason: {ai_judge_reason}
+History_Rule: {history_rule}
 
 ## Output JSON Format
 Output actions for EACH Section in the following JSON format:
 {{
-    "final_summary": {{
-        "final_result": "Correct" | "Incorrect" | "Spam" | "NeedDiscussion",
-        "reason": "Explanation for the final result."
-    }}
+    "step_type_rule":"<the full updated sype rule>"
 }}
 """
 
-OPTIMIZATION_SYSTEM_PROMPT = """
+OPTIMIZATION_EDIT_SYSTEM_PROMPT = """
 ## ROLE
 You are a top-tier functional testing expert, proficient in functional testing and prompt development.
 
 ## GOAL
 Optimize the prompt based on results to ensure consistency between AI and human results.
+Change as little of the rule as possible: return only the clauses to add, replace or delete.
 
 ## INPUT VARIABLES
 Correct_Result: {human_judge_result}
 Correct_Reason: {human_judge_reason}
 AI_Judgment_Result: {ai_judge_result}
 AI_Judgment_Reason: {ai_judge_reason}
-History_Rule: {history_rule}
+History_Rule (one clause per line, numbered "[n]"):
+{history_rule}
+
+## EDIT OPERATIONS
+- add: insert "text" as a new clause after clause number "clause" (0 inserts it before the first clause).
+- replace: replace clause number "clause" with "text".
+- delete: remove clause number "clause"; "text" is "".
+Clause numbers always refer to History_Rule exactly as given above. Do not put the "[n]" prefix into "text".
 
 ## Output JSON Format
 Output actions for EACH Section in the following JSON format:
 {{
-    "step_type_rule":"<the full updated sype rule>"
+    "rule_edits": [
+        {{"op": "add" | "replace" | "delete", "clause": <clause number>, "text": "<clause text>"}}
+    ]
 }}
 """
 
@@ -246,11 +240,13 @@ async def optimization_steps_with_image_matching_async(step_type_rule, user_cont
             messages=[
                 {"role": "system", "content": optimized_prompt},
                 {"role": "user", "content":user_content_structured}
-            ]
+            ],
+            schema="final_summary",
+            kind="judge",
         )
 
         if content:
-            parsed = _try_parse_json_object(content)
+            parsed = parse_model_json(content, "final_summary", client.structured_output, _try_parse_json_object)
             if parsed and isinstance(parsed.get("final_summary"), dict):
                 final = parsed.get("final_summary", {})
                 final_result = _normalize_final_result(final.get("final_result"))
@@ -273,7 +269,7 @@ async def optimization_steps_with_image_matching_async(step_type_rule, user_cont
 async def check_steps_with_image_matching_async(steps_json, issue_type, judge_comment):
 
     planner = Planner()
-    plans, group_duplicates = planner.plan(steps_json)
+    plans, group_duplicates = await planner.plan_async(steps_json)
     total_step = len(plans)
     print(f'plans length: {len(plans)} ')
     args = parse_parameters()
@@ -295,10 +291,6 @@ async def check_steps_with_image_matching_async(steps_json, issue_type, judge_co
             step_type_rule_path = get_prompt_file(step_type)
             step_type_rule = load_prompt(step_type_rule_path) if step_type_rule_path else ""
 
-            system_prompt_step = COMPARISON_SYSTEM_PROMPT.format(
-                step_type_rule=step_type_rule,
-                history_steps=json.dumps(history_steps, ensure_ascii=False),
-            )
             step_number = step.get("step_number", 999)
             user_content_structured = []
 
@@ -323,22 +315,17 @@ async def check_steps_with_image_matching_async(steps_json, issue_type, judge_co
                 or image_url.startswith("https://")
                 or image_url.startswith("data:")
             ):
-                user_content_structured.append(
-                    {"type": "image_url", "image_url": {"url": image_url}}
-                )
+                user_content_structured.append(prepare_image_part(image_url, step.get("step_type"), client.args))
 
             content = await client.chat_completion_async(
-                messages=[
-                    {"role": "system", "content": system_prompt_step},
-                    {
-                        "role": "user",
-                        "content":user_content_structured
-                    }
-                ]
+                messages=build_judge_messages(step_type_rule, history_steps, user_content_structured, history_encoding_of(client.args)),
+                schema="final_summary",
+                kind="judge",
+                step_type=step_type,
             )
 
             if content:
-                parsed = _try_parse_json_object(content)
+                parsed = parse_model_json(content, "final_summary", client.structured_output, _try_parse_json_object)
                 if parsed and isinstance(parsed.get("final_summary"), dict):
                     final = parsed.get("final_summary", {})
                     final_result = _normalize_final_result(final.get("final_result"))
@@ -381,10 +368,67 @@ async def check_steps_with_image_matching_async(steps_json, issue_type, judge_co
 
 
 
+async def propose_rule_async(
+    client: ClientManager,
+    step_type_rule: str,
+    desired_result: str,
+    desired_reason: str,
+    ai_result: str,
+    ai_reason: str,
+    user_content_structured: list[dict],
+    step_type: str,
+    variant: str | None = None,
+) -> str | None:
+    """The optimizer's rewrite of `step_type_rule`, or None when it proposed no usable change.
+
+    With --rule_edit_mode patch (the default) the model sees the numbered
+    clauses and answers with add / replace / delete edits, which are
+    validated and applied here; "full" asks for the whole rule instead.
+    """
+
+    patch = rule_edit_mode_of(client.args) == "patch"
+    optimization_prompt = (OPTIMIZATION_EDIT_SYSTEM_PROMPT if patch else OPTIMIZATION_SYSTEM_PROMPT).format(
+        human_judge_result=desired_result,
+        human_judge_reason=desired_reason,
+        ai_judge_result=ai_result,
+        ai_judge_reason=ai_reason,
+        history_rule=number_clauses(step_type_rule) if patch else step_type_rule,
+    )
+    user_content = list(user_content_structured)
+    if variant:
+        user_content.append({"type": "text", "text": variant})
+    schema = "rule_edits" if patch else "step_type_rule"
+    content_opt = await client.chat_completion_async(
+        messages=[
+            {"role": "system", "content": optimization_prompt},
+            {"role": "user", "content": user_content},
+        ],
+        schema=schema,
+        kind="optimize_edit" if patch else "optimize",
+        step_type=step_type,
+    )
+    parsed_opt = parse_model_json(content_opt, schema, client.structured_output, _try_parse_json_object) or {}
+    if not patch:
+        new_rule = parsed_opt.get("step_type_rule")
+        if not isinstance(new_rule, str) or not new_rule.strip():
+            return None
+        return new_rule
+
+    try:
+        edits = parse_edits(parsed_opt)
+        new_rule = apply_edits(step_type_rule, edits)
+    except RuleEditError as e:
+        print(f"[rule edits] rejected: {e}")
+        record_edit_round(step_type_rule, None)
+        return None
+    record_edit_round(step_type_rule, edits)
+    return new_rule if edits else None
+
+
 async def optimize_prompt_async(steps_json, issue_type, judge_comment, human_judge, expected_result: str):
 
     planner = Planner()
-    plans, group_duplicates = planner.plan(steps_json)
+    plans, group_duplicates = await planner.plan_async(steps_json)
     total_step = len(plans)
     print(f"plans length: {total_step} ")
 
@@ -413,18 +457,14 @@ async def optimize_prompt_async(steps_json, issue_type, judge_comment, human_jud
         u = url.strip()
         return bool(u) and (u.startswith("http://") or u.startswith("https://") or u.startswith("data:"))
 
-    async def _judge_step(step_type_rule: str, history_steps: list[dict], user_content_structured: list[dict]) -> tuple[str, str]:
-        system_prompt_step = COMPARISON_SYSTEM_PROMPT.format(
-            step_type_rule=step_type_rule or "",
-            history_steps=json.dumps(history_steps, ensure_ascii=False),
-        )
+    async def _judge_step(step_type_rule: str, history_steps: list[dict], user_content_structured: list[dict], step_type: str = "") -> tuple[str, str]:
         content_compare = await client.chat_completion_async(
-            messages=[
-                {"role": "system", "content": system_prompt_step},
-                {"role": "user", "content": user_content_structured},
-            ]
+            messages=build_judge_messages(step_type_rule, history_steps, user_content_structured, history_encoding_of(client.args)),
+            schema="final_summary",
+            kind="judge",
+            step_type=step_type,
         )
-        parsed_compare = _try_parse_json_object(content_compare)
+        parsed_compare = parse_model_json(content_compare, "final_summary", client.structured_output, _try_parse_json_object)
         final_compare = (parsed_compare or {}).get("final_summary") if isinstance(parsed_compare, dict) else None
         if isinstance(final_compare, dict):
             ai_result = _normalize_final_result(final_compare.get("final_result"))
@@ -432,6 +472,94 @@ async def optimize_prompt_async(steps_json, issue_type, judge_comment, human_jud
             return ai_result, ai_reason
         return "NeedDiscussion", "Model compare output invalid."
 
+    async def _search_rule(
+        step_type_rule: str,
+        ai_result: str,
+        ai_reason: str,
+        desired_result: str,
+        desired_reason: str,
+        history_steps: list[dict],
+        user_content_structured: list[dict],
+        step_type: str,
+        width: int,
+        max_rounds: int,
+    ) -> tuple[str, str, str]:
+        """Propose `width` rules in parallel and judge them concurrently, round after round, until one reproduces the desired result.
+
+        A candidate that reproduces the desired result wins at once (the
+        shortest one when several do). A round without such a candidate keeps
+        the current rule and proposes again; when no round produces one, the
+        current rule is returned unchanged and counted as "no winner". The
+        search stops early when the candidates converge: all of them are the
+        same rule, or none differs from the current rule.
+        Returns (rule, ai result, ai reason) for the rule that was kept.
+        """
+
+        for round_index in range(max_rounds):
+            metrics.incr("optimize_search.rounds")
+            variants = [
+                None if i == 0 else
+                f"This is candidate {i + 1} of {width}: resolve the disagreement with a different rule change than the most obvious one."
+                for i in range(width)
+            ]
+            proposals = await asyncio.gather(*[
+                propose_rule_async(
+                    client, step_type_rule, desired_result, desired_reason, ai_result, ai_reason,
+                    user_content_structured, step_type, variant,
+                )
+                for variant in variants
+            ])
+            candidates = list(dict.fromkeys(rule for rule in proposals if rule))
+            metrics.incr("optimize_search.candidates", len(candidates))
+            if not candidates:
+                break
+            if all(rule.strip() == step_type_rule.strip() for rule in candidates):
+                metrics.incr("optimize_search.converged")
+                break
+
+            verdicts = await asyncio.gather(*[
+                _judge_step(rule, history_steps, user_content_structured, step_type) for rule in candidates
+            ])
+            matching = [
+                (len(rule), index)
+                for index, (rule, (result, _)) in enumerate(zip(candidates, verdicts))
+                if result == desired_result
+            ]
+            print(f"[optimize search] round {round_index + 1}: {len(candidates)} candidates, {len(matching)} reproduce {desired_result}")
+            if matching:
+                best = min(matching)[1]
+                metrics.incr("optimize_search.solved")
+                return candidates[best], *verdicts[best]
+            if len(candidates) == 1:
+                # Every parallel proposal came back as the same rule; another round would repeat it.
+                metrics.incr("optimize_search.converged")
+                break
+
+        metrics.incr("optimize_search.no_winner")
+        return step_type_rule, ai_result, ai_reason
+
+    def _save_example_case(step_type: str, raw_text: str, ai_optimize_supple_text: str, ai_judge_reason: str) -> None:
+        # semantic_memory.store_step(
+        #     step_type=step_type,
+        #     step_ai_desc=actual_text,
+        #     step_raw_desc=standard_text,
+        #     step_success_reason=ai_judge_reason,
+        # )
+        try:
+            saved = _append_example_case_if_new(
+                example_case,
+                step_type=step_type,
+                step_raw_desc=raw_text,
+                step_ai_desc=ai_optimize_supple_text,
+                step_success_reason=ai_judge_reason,
+            )
+            if saved:
+                print("Saved new example_case to the case store")
+            else:
+                print("example_case already exists; skip saving")
+        except Exception:
+            pass
+
     try:
         await asyncio.sleep(1)
 
@@ -446,9 +574,11 @@ async def optimize_prompt_async(steps_json, issue_type, judge_comment, human_jud
                     result_reason=expected_result,
                 )
                 content = await client.chat_completion_async(
-                    messages=[{"role": "system", "content": identify_judge_system_prompt}]
+                    messages=[{"role": "system", "content": identify_judge_system_prompt}],
+                    schema="result_number",
+                    kind="identify",
                 )
-                optimization_of_prompts = _try_parse_json_object(content) or {}
+                optimization_of_prompts = parse_model_json(content, "result_number", client.structured_output, _try_parse_json_object) or {}
                 try:
                     result_number = int(optimization_of_prompts.get("result_number") or total_step)
                 except Exception:
@@ -461,7 +591,10 @@ async def optimize_prompt_async(steps_json, issue_type, judge_comment, human_jud
         human_problem_result = _normalize_final_result(str(human_judge or ""))
         human_problem_reason = str(expected_result or "").strip()
 
+        rule_store = get_rule_store()
         prompt_cache: dict[str, str] = {}
+        # Text each rule had when this row first read it; the row's change is swapped in against it.
+        base_rules: dict[str, str] = {}
         touched_paths: set[str] = set()
 
         history_steps: list[dict] = []
@@ -488,7 +621,8 @@ async def optimize_prompt_async(steps_json, issue_type, judge_comment, human_jud
 
             step_type_rule = prompt_cache.get(prompt_path)
             if step_type_rule is None:
-                step_type_rule = load_prompt(prompt_path) or ""
+                step_type_rule, _ = rule_store.read(prompt_path)
+                base_rules[prompt_path] = step_type_rule
                 prompt_cache[prompt_path] = step_type_rule
 
 
@@ -501,7 +635,7 @@ async def optimize_prompt_async(steps_json, issue_type, judge_comment, human_jud
                 {"type": "text", "text": f"Step actual description: {raw_text}"},
             ]
             if _is_valid_image_url(image_url):
-                user_content_structured.append({"type": "image_url", "image_url": {"url": image_url.strip()}})
+                user_content_structured.append(prepare_image_part(image_url.strip(), step.get("step_type"), client.args))
 
             if step_number < result_number:
                 desired_result = "Correct"
@@ -514,11 +648,13 @@ async def optimize_prompt_async(steps_json, issue_type, judge_comment, human_jud
             max_rounds = 6
             ai_judge_result = "NeedDiscussion"
             ai_judge_reason = ""
+            search_width = int(getattr(args, "optimize_candidates", 0) or 0)
             for _ in range(max_rounds):
                 ai_judge_result, ai_judge_reason = await _judge_step(
                     step_type_rule,
                     history_steps,
                     user_content_structured,
+                    step_type,
                 )
                 if ai_judge_result == desired_result and ai_judge_result == "Correct":
 
@@ -527,50 +663,44 @@ async def optimize_prompt_async(steps_json, issue_type, judge_comment, human_jud
                     print(f"ai judge reason: {ai_judge_reason}")
                     print("============================================================")
 
-                    # semantic_memory.store_step(
-                    #     step_type=step_type,
-                    #     step_ai_desc=actual_text,
-                    #     step_raw_desc=standard_text,
-                    #     step_success_reason=ai_judge_reason,
-                    # )
-                    try:
-                        saved = _append_example_case_if_new(
-                            example_case,
-                            step_type=step_type,
-                            step_raw_desc=raw_text,
-                            step_ai_desc=ai_optimize_supple_text,
-                            step_success_reason=ai_judge_reason,
-                        )
-                        if saved:
-                            print("Saved new example_case to cases.json")
-                        else:
-                            print("example_case already exists; skip saving")
-                    except Exception:
-                        pass
-
-
+                    _save_example_case(step_type, raw_text, ai_optimize_supple_text, ai_judge_reason)
                     break
                 elif ai_judge_result == desired_result and step_number == int(result_number) and ai_judge_result != "Correct":
                     break
 
-                optimization_prompt = OPTIMIZATION_SYSTEM_PROMPT.format(
-                    human_judge_result=desired_result,
-                    human_judge_reason=desired_reason,
-                    ai_judge_result=ai_judge_result,
-                    ai_judge_reason=ai_judge_reason,
-                    history_rule=step_type_rule,
-                )
+                if search_width > 1:
+                    searched_rule, ai_judge_result, ai_judge_reason = await _search_rule(
+                        step_type_rule,
+                        ai_judge_result,
+                        ai_judge_reason,
+                        desired_result,
+                        desired_reason,
+                        history_steps,
+                        user_content_structured,
+                        step_type,
+                        search_width,
+                        int(getattr(args, "optimize_search_rounds", 3) or 1),
+                    )
+                    if searched_rule != step_type_rule:
+                        step_type_rule = searched_rule
+                        prompt_cache[prompt_path] = step_type_rule
+                        touched_paths.add(prompt_path)
+                    if ai_judge_result == desired_result and ai_judge_result == "Correct":
+                        print(f"Step {step_number}/{total_step} optimized as Correct by candidate search.")
+                        _save_example_case(step_type, raw_text, ai_optimize_supple_text, ai_judge_reason)
+                    break
 
-                content_opt = await client.chat_completion_async(
-                    messages=[
-                        {"role": "system", "content": optimization_prompt},
-                        {"role": "user", "content": user_content_structured},
-                    ]
+                new_rule = await propose_rule_async(
+                    client,
+                    step_type_rule,
+                    desired_result,
+                    desired_reason,
+                    ai_judge_result,
+                    ai_judge_reason,
+                    user_content_structured,
+                    step_type,
                 )
-
-                parsed_opt = _try_parse_json_object(content_opt) or {}
-                new_rule = parsed_opt.get("step_type_rule")
-                if not isinstance(new_rule, str) or not new_rule.strip():
+                if new_rule is None:
                     break
 
                 step_type_rule = new_rule
@@ -586,8 +716,12 @@ async def optimize_prompt_async(steps_json, issue_type, judge_comment, human_jud
                     break
 
         for path in touched_paths:
-            with open(path, "w", encoding="utf-8") as f:
-                f.write(prompt_cache.get(path, ""))
+            write_rule_change(
+                path,
+                base_rules[path],
+                prompt_cache.get(path, ""),
+                note=f"optimize: step {result_number}, {human_problem_result}",
+            )
 
         return await check_steps_with_image_matching_async(steps_json, issue_type, judge_comment)
 
@@ -598,6 +732,22 @@ async def optimize_prompt_async(steps_json, issue_type, judge_comment, human_jud
             pass
 
 
+def optimize_search_report() -> list[str]:
+    counters = metrics.snapshot()["counters"]
+    rounds = counters.get("optimize_search.rounds", 0)
+    if not rounds:
+        return []
+    return [
+        f"search rounds {int(rounds)}, distinct candidates {int(counters.get('optimize_search.candidates', 0))} "
+        f"({counters.get('optimize_search.candidates', 0) / rounds:.1f} per round)",
+        f"solved {int(counters.get('optimize_search.solved', 0))}, stopped on convergence {int(counters.get('optimize_search.converged', 0))}, "
+        f"no winner (rule kept) {int(counters.get('optimize_search.no_winner', 0))}",
+    ]
+
+
+metrics.add_report_section("Optimization search", optimize_search_report)
+
+
 async def compare_operations_async(standard_steps, actual_steps, issue_type, judge_comment, human_judge_result, expected_result):
 
     steps_json = build_steps_json(standard_steps, actual_steps)
@@ -0,0 +1,269 @@
+import asyncio
+import hashlib
+import re
+from dataclasses import dataclass
+
+from llm.agents.planer_agent import Planner
+from llm.client_manager import ClientManager
+from llm.judge import build_judge_messages, history_encoding_of
+from llm.structured_output import parse_model_json
+from llm.worker.image_to_steps_check import (
+    _correct_history_entry,
+    build_step_user_content,
+    interpret_judge_reply,
+)
+from llm.worker.image_to_steps_optimize import (
+    IDENTIFY_JUDGE_SYSTEM_PROMPT,
+    _normalize_final_result,
+    _try_parse_json_object,
+    propose_rule_async,
+)
+from llm.tools.rule_store import get_rule_store
+from utils.file_utils import get_prompt_file
+from utils.metrics import metrics
+from utils.parameters import parse_parameters
+
+_STEP_NUMBER_PATTERNS = (
+    re.compile(r"step\s*number\s*:?\s*(\d+)", re.IGNORECASE),
+    re.compile(r"step\s*(\d+)", re.IGNORECASE),
+    re.compile(r"第\s*(\d+)\s*步"),
+    re.compile(r"步骤\s*(\d+)"),
+)
+
+
+@dataclass
+class LabelledStep:
+    """One planned step with the verdict the human reviewer expects for it."""
+
+    row_id: int
+    step: dict
+    history: list[dict]
+    group_duplicates: list
+    desired_result: str
+    desired_reason: str
+    user_content: list[dict] | None = None
+
+
+def labelled_step_number(reason) -> int | None:
+    """Smallest step number mentioned in a reviewer's analysis ("step 3", "第3步", "步骤3")."""
+
+    numbers = [int(m) for pattern in _STEP_NUMBER_PATTERNS for m in pattern.findall(str(reason or ""))]
+    return min(numbers) if numbers else None
+
+
+def in_holdout(example: LabelledStep, fraction: float) -> bool:
+    """Stable split by row: every step of a row lands on the same side, in every run.
+
+    Steps of one row share their history and screenshots, so splitting per
+    step would let the held-out part score rules on rows seen in training.
+    """
+
+    digest = hashlib.sha256(str(example.row_id).encode("utf-8")).digest()
+    return int.from_bytes(digest[:4], "big") / 2**32 < fraction
+
+
+def in_acceptance(example: LabelledStep) -> bool:
+    """Which half of the held-out rows decides acceptance; the other half picks the best candidate."""
+
+    digest = hashlib.sha256(str(example.row_id).encode("utf-8")).digest()
+    return bool(digest[4] & 1)
+
+
+class OfflineRuleOptimizer:
+    """Dataset-level step type rule optimization.
+
+    Every labelled row is planned once and expanded into per-step examples:
+    steps before the reviewer's failing step must be judged Correct, the
+    failing step must get the reviewer's verdict. Examples are grouped by
+    step type rule and split by row into a training part and two held-out
+    halves. The optimizer proposes candidate rules from misjudged training
+    examples, all candidates are scored on the selection half concurrently,
+    and the best one is then scored on the acceptance half against the
+    current rule. Picking the best of N on the same examples that decide
+    acceptance would favour lucky candidates. A rule file is rewritten only
+    when the chosen candidate beats the current rule on the acceptance half,
+    as a compare-and-swap against the version that was scored.
+    """
+
+    def __init__(self, client: ClientManager, args):
+        self.client = client
+        self.args = args
+        self.planner = Planner()
+        self._sem = asyncio.Semaphore(max(1, int(getattr(args, "concurrency", 10) or 1)))
+
+    async def _call(self, **kwargs) -> str | None:
+        async with self._sem:
+            return await self.client.chat_completion_async(**kwargs)
+
+    # -- dataset ------------------------------------------------------------
+
+    async def _failing_step(self, human_judge, reason, total_step: int) -> int:
+        number = labelled_step_number(reason)
+        if number is not None:
+            return number
+        content = await self._call(
+            messages=[{"role": "system", "content": IDENTIFY_JUDGE_SYSTEM_PROMPT.format(human_judge=human_judge, result_reason=reason)}],
+            schema="result_number",
+            kind="identify",
+        )
+        parsed = parse_model_json(content, "result_number", self.client.structured_output, _try_parse_json_object) or {}
+        try:
+            return int(parsed.get("result_number") or total_step)
+        except (TypeError, ValueError):
+            return total_step
+
+    async def examples_for_row(self, row: dict) -> list[LabelledStep]:
+        # Planning is the most expensive call per row; it counts against --concurrency like the others.
+        async with self._sem:
+            plans, group_duplicates = await self.planner.plan_async(row["steps_json"])
+        if not plans:
+            metrics.incr("rule_opt.rows_unplanned")
+            return []
+        human_result = _normalize_final_result(str(row.get("human_judge") or ""))
+        reason = str(row.get("expected_result") or "").strip()
+        failing = len(plans) + 1 if human_result == "Correct" else await self._failing_step(row.get("human_judge"), reason, len(plans))
+
+        examples = []
+        history: list[dict] = []
+        for step in plans:
+            step_number = int(step.get("step_number", 999))
+            if step_number > failing:
+                break
+            correct = step_number < failing
+            examples.append(LabelledStep(
+                row_id=row["row_id"],
+                step=step,
+                history=list(history),
+                group_duplicates=group_duplicates,
+                desired_result="Correct" if correct else human_result,
+                desired_reason="" if correct else reason,
+            ))
+            history.append(_correct_history_entry(step))
+        return examples
+
+    # -- scoring ------------------------------------------------------------
+
+    async def judge(self, rule: str, example: LabelledStep) -> dict | None:
+        if example.user_content is None:
+            example.user_content = build_step_user_content(example.step, example.group_duplicates, args=self.args)
+        content = await self._call(
+            messages=build_judge_messages(rule, example.history, example.user_content, history_encoding_of(self.args)),
+            schema="final_summary",
+            kind="judge",
+            step_type=example.step.get("step_type", ""),
+        )
+        return interpret_judge_reply(content, self.client.structured_output)
+
+    async def score(self, rule: str, examples: list[LabelledStep]) -> tuple[float, list[tuple[LabelledStep, dict | None]]]:
+        verdicts = await asyncio.gather(*[self.judge(rule, example) for example in examples])
+        hits = sum(1 for example, verdict in zip(examples, verdicts) if verdict and verdict["final_result"] == example.desired_result)
+        return (hits / len(examples) if examples else 0.0), list(zip(examples, verdicts))
+
+    async def propose(self, rule: str, example: LabelledStep, verdict: dict | None) -> str | None:
+        async with self._sem:
+            return await propose_rule_async(
+                self.client,
+                rule,
+                example.desired_result,
+                example.desired_reason,
+                (verdict or {}).get("final_result", "NeedDiscussion"),
+                (verdict or {}).get("reason", "Model output invalid."),
+                example.user_content,
+                example.step.get("step_type", ""),
+            )
+
+    # -- per rule -----------------------------------------------------------
+
+    async def optimize_rule(self, rule_path: str, examples: list[LabelledStep]) -> dict:
+        fraction = float(getattr(self.args, "rule_opt_holdout", 0.3) or 0.3)
+        holdout = [e for e in examples if in_holdout(e, fraction)]
+        train = [e for e in examples if not in_holdout(e, fraction)]
+        select = [e for e in holdout if not in_acceptance(e)]
+        accept = [e for e in holdout if in_acceptance(e)]
+        result = {"rule": rule_path, "examples": len(examples), "holdout": len(holdout), "written": False}
+        if not train or not select or not accept:
+            result["skipped"] = "too few examples for a holdout split"
+            return result
+
+        current, version = get_rule_store().read(rule_path)
+        (baseline, _), (_, train_verdicts) = await asyncio.gather(self.score(current, accept), self.score(current, train))
+        result["baseline"] = baseline
+
+        misjudged = [(e, v) for e, v in train_verdicts if not v or v["final_result"] != e.desired_result]
+        limit = max(1, int(getattr(self.args, "rule_opt_candidates", 4) or 1))
+        proposals = await asyncio.gather(*[self.propose(current, e, v) for e, v in misjudged[:limit]])
+        candidates = list(dict.fromkeys(p for p in proposals if p and p.strip() != current.strip()))
+        result["candidates"] = len(candidates)
+        if not candidates:
+            return result
+
+        scores = await asyncio.gather(*[self.score(candidate, select) for candidate in candidates])
+        selection_score, best = max((score, index) for index, (score, _) in enumerate(scores))
+        best_score, _ = await self.score(candidates[best], accept)
+        result["selection"] = selection_score
+        result["best"] = best_score
+        metrics.incr("rule_opt.candidates", len(candidates))
+        if best_score > baseline:
+            note = f"offline: acceptance accuracy {baseline:.1%} -> {best_score:.1%}"
+            result["written"] = get_rule_store().compare_and_swap(rule_path, version, candidates[best], note) is not None
+            metrics.incr("rule_opt.rules_written", int(result["written"]))
+        print(
+            f"[rule optimizer] {rule_path}: held out {len(select)} + {len(accept)} of {len(examples)} examples, "
+            f"best of {len(candidates)} candidates {selection_score:.1%} on selection; "
+            f"acceptance accuracy {baseline:.1%} -> {best_score:.1%} "
+            f"({'written' if result['written'] else 'kept current rule'})"
+        )
+        return result
+
+    async def run(self, rows: list[dict]) -> list[dict]:
+        per_row = await asyncio.gather(*[self.examples_for_row(row) for row in rows])
+        groups: dict[str, list[LabelledStep]] = {}
+        for example in (e for examples in per_row for e in examples):
+            rule_path = get_prompt_file(str(example.step.get("step_type", "")).strip())
+            if not rule_path:
+                metrics.incr("rule_opt.unknown_step_type")
+                continue
+            groups.setdefault(rule_path, []).append(example)
+        metrics.incr("rule_opt.rows", len(rows))
+        metrics.incr("rule_opt.examples", sum(len(examples) for examples in groups.values()))
+        unplanned = sum(1 for examples in per_row if not examples)
+        print(
+            f"[rule optimizer] {len(rows)} rows -> {sum(len(e) for e in per_row)} labelled steps over {len(groups)} rules"
+            + (f"; {unplanned} rows could not be planned and are left out" if unplanned else "")
+        )
+
+        return list(await asyncio.gather(*[
+            self.optimize_rule(rule_path, examples)
+            for rule_path, examples in groups.items()
+        ]))
+
+
+async def optimize_rules_offline(rows: list[dict]) -> list[dict]:
+    """Optimize step type rules over labelled rows of {"row_id", "steps_json", "human_judge", "expected_result"}."""
+
+    args = parse_parameters()
+    args.async_client = True
+    client = ClientManager(args=args)
+    try:
+        return await OfflineRuleOptimizer(client, args).run(rows)
+    finally:
+        try:
+            await client.aclose()
+        except Exception:
+            pass
+
+
+def rule_optimizer_report() -> list[str]:
+    counters = metrics.snapshot()["counters"]
+    rows = counters.get("rule_opt.rows", 0)
+    if not rows:
+        return []
+    unplanned = counters.get("rule_opt.rows_unplanned", 0)
+    return [
+        f"rows {int(rows)}, left out because planning failed {int(unplanned)} ({unplanned / rows:.1%})",
+        f"labelled steps {int(counters.get('rule_opt.examples', 0))}, candidates scored {int(counters.get('rule_opt.candidates', 0))}, "
+        f"rules rewritten {int(counters.get('rule_opt.rules_written', 0))}"
+    ]
+
+
+metrics.add_report_section("Offline rule optimizer", rule_optimizer_report)
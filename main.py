@@ -14,61 +14,81 @@ from parsers.document_parser import (
     extract_steps_from_left_pane,
     extract_steps_from_right_pane,
 )
-from llm.worker import compare_operations_async, optimize_prompttions_async
+from llm.worker import compare_operations_async, optimize_prompttions_async, build_steps_json
+from llm.worker.batch_judge import run_batch_judgement
+from llm.worker.rule_optimizer import optimize_rules_offline
 from concurrent.futures import ThreadPoolExecutor
 from utils.parameters import parse_parameters
+from utils.metrics import metrics
 
 
-def process_page(
-    page_url: str,
-    human_judge: str = None,
-    expected_result: str = None,
-    work_type: str = "C",
-):
+def scrape_page(page_url: str):
+    """Open a CIP item page and return (issue_type, standard_steps, judge_comment, actual_steps)."""
 
     driver = webdriver.Edge()
 
-    driver.get(page_url)
-    driver.maximize_window()
+    try:
+        driver.get(page_url)
+        driver.maximize_window()
+
+        sign_in_button = WebDriverWait(driver, 20).until(
+            EC.element_to_be_clickable((By.CLASS_NAME, "signInColor"))
+        )
+        sign_in_button.click()
 
-    sign_in_button = WebDriverWait(driver, 20).until(
-        EC.element_to_be_clickable((By.CLASS_NAME, "signInColor"))
-    )
-    sign_in_button.click()
+        WebDriverWait(driver, 20).until(EC.presence_of_element_located((By.ID, "leftPane")))
 
-    WebDriverWait(driver, 20).until(EC.presence_of_element_located((By.ID, "leftPane")))
+        WebDriverWait(driver, 20).until(
+            EC.presence_of_element_located((By.CLASS_NAME, "right-pane.col"))
+        )
 
-    WebDriverWait(driver, 20).until(
-        EC.presence_of_element_located((By.CLASS_NAME, "right-pane.col"))
-    )
+        issue_type = driver.find_element(By.CLASS_NAME, "textColorRed").text
+        print(f"Issue Type: {issue_type}")
 
-    issue_type = driver.find_element(By.CLASS_NAME, "textColorRed").text
-    print(f"Issue Type: {issue_type}")
+        standard_steps = extract_steps_from_left_pane(driver)
 
-    standard_steps = extract_steps_from_left_pane(driver)
+        print(f"Standard steps extracted: {len(standard_steps)}")
+        judge_comment, actual_steps = extract_steps_from_right_pane(driver)
+
+        print(f"Actual steps extracted: {len(actual_steps)}")
+    finally:
+        driver.quit()
 
-    print(f"Standard steps extracted: {len(standard_steps)}")
-    judge_comment, actual_steps = extract_steps_from_right_pane(driver)
+    return issue_type, standard_steps, judge_comment, actual_steps
 
-    print(f"Actual steps extracted: {len(actual_steps)}")
+
+def validate_steps(standard_steps, actual_steps) -> str | None:
+    """Return an error message when the scraped steps cannot be compared."""
 
     if not standard_steps:
         print("Error: No standard steps found in the left pane.")
-        driver.quit()
-        return "Error", "No standard steps found."
+        return "No standard steps found."
 
     if not actual_steps:
         print("Error: No actual steps found in the right pane.")
-        driver.quit()
-        return "Error", "No actual steps found."
+        return "No actual steps found."
 
     if len(standard_steps) != len(actual_steps):
         print("Error: Mismatched number of steps.")
-        driver.quit()
-        return "Error", "Mismatched number of steps."
+        return "Mismatched number of steps."
+
+    return None
+
+
+def process_page(
+    page_url: str,
+    human_judge: str = None,
+    expected_result: str = None,
+    work_type: str = "C",
+):
+
+    issue_type, standard_steps, judge_comment, actual_steps = scrape_page(page_url)
+
+    error = validate_steps(standard_steps, actual_steps)
+    if error:
+        return "Error", -1, error
 
     print("All checks passed.")
-    driver.quit()
 
     print("Comparing steps...")
     selected_work_type = (work_type or "C").upper()
@@ -80,6 +100,12 @@ def process_page(
 
     report = asyncio.run(work(standard_steps, actual_steps, issue_type, judge_comment, human_judge, expected_result))
 
+    return report_to_row(report)
+
+
+def report_to_row(report):
+    """Normalize a worker report and return (final_result, step_number, reason)."""
+
     # Normalize report shape (some paths may return JSON strings or final_summary as a string)
     if isinstance(report, str):
         try:
@@ -118,9 +144,21 @@ def process_page(
 
 
 def process_excel(file_path: str, concurrency: int, work_type: str = "C"):
+    if (work_type or "C").upper() == "B":
+        return process_excel_batch(file_path, concurrency=concurrency)
+    if (work_type or "C").upper() == "R":
+        return process_excel_rules(file_path, concurrency=concurrency)
     return asyncio.run(process_excel_async(file_path, concurrency=concurrency, work_type=work_type))
 
 
+def _clean_url(page_url) -> str:
+    if page_url is None:
+        return ""
+    if isinstance(page_url, float) and math.isnan(page_url):
+        return ""
+    return str(page_url).strip()
+
+
 async def _process_one_page(
     idx: int,
     page_url: str,
@@ -131,12 +169,7 @@ async def _process_one_page(
     executor: ThreadPoolExecutor,
 ):
 
-    if page_url is None:
-        url = ""
-    elif isinstance(page_url, float) and math.isnan(page_url):
-        url = ""
-    else:
-        url = str(page_url).strip()
+    url = _clean_url(page_url)
     if not url:
         return idx, page_url, "Error", -1, "Empty URL"
 
@@ -173,6 +206,80 @@ async def process_excel_async(file_path: str, concurrency: int = 10, work_type:
         for task in asyncio.as_completed(tasks):
             results.append(await task)
 
+    return save_results(df, results, file_path)
+
+
+def _scrape_row(idx: int, page_url):
+    url = _clean_url(page_url)
+    if not url:
+        return idx, None, "Empty URL"
+    try:
+        _, standard_steps, _, actual_steps = scrape_page(url)
+    except Exception as e:
+        print(f"Error processing {page_url}: {e}")
+        return idx, None, str(e)
+    error = validate_steps(standard_steps, actual_steps)
+    if error:
+        return idx, None, error
+    return idx, build_steps_json(standard_steps, actual_steps), None
+
+
+def process_excel_batch(file_path: str, concurrency: int = 10):
+    """Re-judge a whole export through the offline Batch API (work_type B)."""
+
+    df = pd.read_excel(file_path, engine='openpyxl')
+    print(df.head())
+
+    links = df["permalink"].tolist()
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        scraped = list(executor.map(_scrape_row, range(len(links)), links))
+
+    results = []
+    rows = []
+    for idx, steps_json, error in scraped:
+        if error:
+            results.append((idx, links[idx], "Error", -1, error))
+        else:
+            rows.append({"row_id": idx, "steps_json": steps_json})
+
+    reports = run_batch_judgement(rows) if rows else {}
+    for row in rows:
+        idx = row["row_id"]
+        final_result, step_number, reason = report_to_row(reports.get(idx))
+        results.append((idx, links[idx], final_result, step_number, reason))
+
+    return save_results(df, results, file_path)
+
+
+def process_excel_rules(file_path: str, concurrency: int = 10):
+    """Optimize the step type rules against a whole labelled export (work_type R).
+
+    Uses the "vendor judgement" and "结果分析" columns as labels; rule files are
+    only rewritten when a candidate improves held-out accuracy, no Excel is written.
+    """
+
+    df = pd.read_excel(file_path, engine='openpyxl')
+    print(df.head())
+
+    links = df["permalink"].tolist()
+    vender_judges = df["vendor judgement"].tolist()
+    reasons = df["结果分析"].tolist()
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        scraped = list(executor.map(_scrape_row, range(len(links)), links))
+
+    rows = [
+        {"row_id": idx, "steps_json": steps_json, "human_judge": vender_judges[idx], "expected_result": reasons[idx]}
+        for idx, steps_json, error in scraped
+        if not error and pd.notna(vender_judges[idx])
+    ]
+    print(f"Labelled rows: {len(rows)} of {len(links)}")
+    return asyncio.run(optimize_rules_offline(rows)) if rows else []
+
+
+def save_results(df, results, file_path: str) -> str:
+
     for idx, url, final_result, step_number, reason in results:
         df.at[idx, 'final_result'] = final_result
         df.at[idx, 'step_number'] = step_number
@@ -191,6 +298,10 @@ async def process_excel_async(file_path: str, concurrency: int = 10, work_type:
     return output_file
 
 
+def print_run_report():
+    print(metrics.format_report())
+
+
 def is_url(string):
     url_pattern = re.compile(r'https?://\S+')
     return url_pattern.match(string)
@@ -206,10 +317,12 @@ if __name__ == "__main__":
     if is_url(test_file_or_url):
         print(f"Detected page URL: {test_file_or_url}")
         process_page(test_file_or_url, work_type=args.work_type)
+        print_run_report()
 
     elif is_excel_file(test_file_or_url):
         print(f"Detected Excel file: {test_file_or_url}")
         process_excel(test_file_or_url, args.concurrency, work_type=args.work_type)
+        print_run_report()
 
     else:
         print("The provided argument is neither a valid URL nor an Excel file path. Use --test_file to specify a URL or Excel path.")
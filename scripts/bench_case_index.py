@@ -0,0 +1,89 @@
+import argparse
+import json
+import random
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from llm.tools.case_index import MinHashCaseIndex
+from llm.tools.case_store import CaseStore
+
+WORDS = (
+    "click open the settings menu page header quick links dropdown select row verify tab window "
+    "search box results banner ad toolbar icon top right corner scroll down wait until loaded "
+    "navigate to url enter text press enter button visible theme dark light profile sign in account "
+    "video play pause volume carousel slide next previous notification popup close accept cookies"
+).split()
+
+
+def synthetic_desc(rng: random.Random) -> str:
+    standard = " ".join(rng.choice(WORDS) for _ in range(rng.randint(15, 40)))
+    return f"Standard Text: {standard}\nActual Text: {standard}\nActual Image:"
+
+
+def perturb(text: str, rng: random.Random) -> str:
+    words = text.split(" ")
+    i = rng.randrange(len(words))
+    words[i] = rng.choice(WORDS)
+    return "  ".join(words).replace("\n", " \n ")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark MinHash near-match retrieval over example cases")
+    parser.add_argument("--cases", type=int, default=100_000)
+    parser.add_argument("--queries", type=int, default=2_000)
+    parser.add_argument("--k", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    cases = [
+        {"step_type": "UI_INTERACTION", "step_raw_desc": synthetic_desc(rng), "step_success_reason": f"reason {i}"}
+        for i in range(args.cases)
+    ]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "cases.json"
+        path.write_text(json.dumps(cases, ensure_ascii=False), encoding="utf-8")
+        store = CaseStore(path)
+        started = time.perf_counter()
+        store.cases()
+        print(f"loaded {args.cases} cases into the store in {time.perf_counter() - started:.1f}s")
+
+        index = MinHashCaseIndex(store)
+        started = time.perf_counter()
+        size = len(index)
+        print(f"indexed {size} cases in {time.perf_counter() - started:.1f}s")
+
+        targets = [rng.randrange(size) for _ in range(args.queries)]
+        timings, hits = [], 0
+        for target in targets:
+            query = perturb(cases[target]["step_raw_desc"], rng)
+            started = time.perf_counter()
+            matches = index.query(query, k=args.k)
+            timings.append(time.perf_counter() - started)
+            hits += any(case is cases[target] or case["step_raw_desc"] == cases[target]["step_raw_desc"] for _, case in matches)
+
+        misses = []
+        for _ in range(args.queries):
+            started = time.perf_counter()
+            index.query(synthetic_desc(rng), k=args.k)
+            misses.append(time.perf_counter() - started)
+
+    for label, values in (("perturbed queries", timings), ("unrelated queries", misses)):
+        values = sorted(values)
+        print(
+            f"{label}: p50 {statistics.median(values) * 1e3:.3f} ms, "
+            f"p99 {values[int(len(values) * 0.99) - 1] * 1e3:.3f} ms"
+        )
+    print(f"recall@{args.k} for one-word edits with whitespace changes: {hits / len(targets):.1%}")
+
+
+if __name__ == "__main__":
+    main()
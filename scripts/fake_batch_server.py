@@ -0,0 +1,182 @@
+import argparse
+import json
+import re
+import threading
+import time
+import uuid
+from email.parser import BytesParser
+from email.policy import default as default_policy
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+# Local stand-in for the OpenAI Files + Batch endpoints, for exercising
+# `--work_type B` without a real deployment:
+#
+#   python scripts/fake_batch_server.py --port 8765
+#   OPENAI_BASE_URL=http://127.0.0.1:8765/v1 OPENAI_APIKEY=local \
+#       python main.py --mode openai --model fake --work_type B --batch_poll_interval 1 --test_file_or_url test.xlsx
+#
+# Planner requests ("plan-*") get one step per "=== Step Number N ===" block;
+# judge requests ("judge-*") are answered Correct unless --fail_step matches.
+
+FILES: dict[str, bytes] = {}
+BATCHES: dict[str, dict] = {}
+LOCK = threading.Lock()
+
+STEP_RE = re.compile(r"=== Step Number (\d+) ===\nStandard Text: (.*?)\nStandard Image", re.DOTALL)
+
+
+def _plan_reply(body: dict) -> str:
+    texts = []
+    for message in body.get("messages", []):
+        content = message.get("content")
+        if isinstance(content, list):
+            texts.extend(part.get("text", "") for part in content if isinstance(part, dict))
+    steps = [
+        {"step_number": int(n), "step_type": "Navigation & URL Redirection", "text": text.strip()}
+        for n, text in STEP_RE.findall("\n".join(texts))
+    ]
+    if body.get("response_format"):
+        return json.dumps({"steps": steps}, ensure_ascii=False)
+    return "```python\n" + json.dumps(steps, ensure_ascii=False) + "\n```"
+
+
+def _judge_reply(custom_id: str, fail_step: int | None) -> str:
+    index = int(custom_id.rsplit("-", 1)[-1])
+    if fail_step is not None and index + 1 == fail_step:
+        summary = {"final_result": "Incorrect", "reason": "Stand-in failure."}
+    else:
+        summary = {"final_result": "Correct", "reason": "Stand-in pass."}
+    return json.dumps({"final_summary": summary})
+
+
+def _run_batch(batch_id: str, fail_step: int | None) -> None:
+    with LOCK:
+        batch = BATCHES[batch_id]
+        lines = FILES[batch["input_file_id"]].decode("utf-8").splitlines()
+
+    out = []
+    for raw in lines:
+        if not raw.strip():
+            continue
+        request = json.loads(raw)
+        custom_id = request["custom_id"]
+        body = request["body"]
+        content = _plan_reply(body) if custom_id.startswith("plan-") else _judge_reply(custom_id, fail_step)
+        out.append(json.dumps({
+            "id": f"batch_req_{uuid.uuid4().hex[:12]}",
+            "custom_id": custom_id,
+            "response": {
+                "status_code": 200,
+                "request_id": uuid.uuid4().hex,
+                "body": {
+                    "object": "chat.completion",
+                    "model": body.get("model"),
+                    "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+                    "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+                },
+            },
+            "error": None,
+        }))
+
+    output_id = f"file-{uuid.uuid4().hex[:12]}"
+    with LOCK:
+        FILES[output_id] = ("\n".join(out) + "\n").encode("utf-8")
+        batch.update({
+            "status": "completed",
+            "output_file_id": output_id,
+            "completed_at": int(time.time()),
+            "request_counts": {"total": len(out), "completed": len(out), "failed": 0},
+        })
+
+
+class Handler(BaseHTTPRequestHandler):
+    fail_step: int | None = None
+
+    def _send_json(self, payload: dict, status: int = 200) -> None:
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _body(self) -> bytes:
+        return self.rfile.read(int(self.headers.get("Content-Length") or 0))
+
+    def do_POST(self):
+        if self.path.endswith("/files"):
+            raw = self._body()
+            header = f"Content-Type: {self.headers['Content-Type']}\r\n\r\n".encode("utf-8")
+            message = BytesParser(policy=default_policy).parsebytes(header + raw)
+            data = b""
+            for part in message.iter_parts():
+                if part.get_param("name", header="content-disposition") == "file":
+                    data = part.get_payload(decode=True)
+            file_id = f"file-{uuid.uuid4().hex[:12]}"
+            with LOCK:
+                FILES[file_id] = data
+            return self._send_json({"id": file_id, "object": "file", "bytes": len(data), "created_at": int(time.time()),
+                                    "filename": "batch.jsonl", "purpose": "batch", "status": "processed"})
+
+        if self.path.endswith("/batches"):
+            request = json.loads(self._body() or b"{}")
+            batch_id = f"batch_{uuid.uuid4().hex[:12]}"
+            batch = {
+                "id": batch_id,
+                "object": "batch",
+                "endpoint": request.get("endpoint"),
+                "input_file_id": request.get("input_file_id"),
+                "completion_window": request.get("completion_window"),
+                "status": "in_progress",
+                "created_at": int(time.time()),
+                "output_file_id": None,
+                "error_file_id": None,
+                "request_counts": {"total": 0, "completed": 0, "failed": 0},
+            }
+            with LOCK:
+                BATCHES[batch_id] = batch
+            threading.Timer(0.5, _run_batch, args=(batch_id, self.fail_step)).start()
+            return self._send_json(batch)
+
+        self._send_json({"error": {"message": f"unknown path {self.path}"}}, status=404)
+
+    def do_GET(self):
+        m = re.search(r"/batches/([^/]+)$", self.path)
+        if m:
+            with LOCK:
+                batch = dict(BATCHES.get(m.group(1)) or {})
+            if not batch:
+                return self._send_json({"error": {"message": "batch not found"}}, status=404)
+            return self._send_json(batch)
+
+        m = re.search(r"/files/([^/]+)/content$", self.path)
+        if m:
+            with LOCK:
+                data = FILES.get(m.group(1))
+            if data is None:
+                return self._send_json({"error": {"message": "file not found"}}, status=404)
+            self.send_response(200)
+            self.send_header("Content-Type", "application/octet-stream")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+            return
+
+        self._send_json({"error": {"message": f"unknown path {self.path}"}}, status=404)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--fail_step", type=int, default=None, help="Answer Incorrect for this 1-based step position")
+    args = parser.parse_args()
+
+    Handler.fail_step = args.fail_step
+    server = ThreadingHTTPServer(("127.0.0.1", args.port), Handler)
+    print(f"Fake batch endpoint on http://127.0.0.1:{args.port}/v1")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,62 @@
 import sys
 import os
+import hashlib
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from functools import lru_cache
 from pathlib import Path
 import re
 from enums.issue_enum import IssueEnum, SceneEnum, ScenarioEnum
+from utils.metrics import metrics
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+try:
+    import msvcrt
+except ImportError:  # POSIX
+    msvcrt = None
+
+# msvcrt locks are mandatory byte-range locks: lock one byte far past any real
+# content, so readers and O_APPEND writers of the locked file are not blocked.
+_MSVCRT_LOCK_OFFSET = 0x7FFFFFFF
+
+
+@contextmanager
+def exclusive_lock(fd: int):
+    """Hold an exclusive lock on the open file `fd` that other processes honour (flock or msvcrt.locking)."""
+
+    if fcntl is not None:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+        return
+    if msvcrt is None:
+        yield
+        return
+    position = os.lseek(fd, 0, os.SEEK_CUR)
+    os.lseek(fd, _MSVCRT_LOCK_OFFSET, os.SEEK_SET)
+    while True:
+        try:
+            # LK_LOCK retries for about ten seconds before giving up; keep waiting.
+            msvcrt.locking(fd, msvcrt.LK_LOCK, 1)
+            break
+        except OSError:
+            continue
+    os.lseek(fd, position, os.SEEK_SET)
+    try:
+        yield
+    finally:
+        os.lseek(fd, _MSVCRT_LOCK_OFFSET, os.SEEK_SET)
+        msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+        os.lseek(fd, position, os.SEEK_SET)
+
 
 def resource_path(relative_path: str) -> str:
     """
@@ -29,12 +83,21 @@ def resource_path(relative_path: str) -> str:
     return str(repo_root / p)
 
 
-def load_prompt(filename: str) -> str:
+_INCLUDE_PATTERN = re.compile(r"@@INCLUDE:\s*(.+?)\s*@@")
 
-    if filename is None:
-        raise ValueError("load_prompt() expected a non-None filename")
+# Seconds between mtime checks of a cached prompt; edits on disk are picked up after at most this long.
+PROMPT_CHECK_INTERVAL = 2.0
 
-    include_pattern = re.compile(r"@@INCLUDE:\s*(.+?)\s*@@")
+
+@dataclass
+class _PromptEntry:
+    text: str
+    version: str
+    deps: list[tuple[str, int, int]]
+    checked_at: float
+
+
+def _resolve_prompt(filename: str, deps: list[tuple[str, int, int]]) -> str:
 
     def _load_inner(name: str, depth: int, seen: set[str]) -> str:
         if depth > 10:
@@ -48,78 +111,167 @@ def load_prompt(filename: str) -> str:
         if not prompt_path.exists():
             raise FileNotFoundError(f"Prompt file not found: {prompt_path}")
 
+        stat = prompt_path.stat()
+        deps.append((str(prompt_path), stat.st_mtime_ns, stat.st_size))
         text = prompt_path.read_text(encoding="utf-8")
 
         def _replace(match: re.Match) -> str:
             included = match.group(1).strip()
             return _load_inner(included, depth + 1, seen | {name})
 
-        return include_pattern.sub(_replace, text)
+        return _INCLUDE_PATTERN.sub(_replace, text)
 
     return _load_inner(filename, 0, set())
 
 
+def _deps_changed(deps: list[tuple[str, int, int]]) -> bool:
+    for path, mtime_ns, size in deps:
+        try:
+            stat = Path(path).stat()
+        except OSError:
+            return True
+        if stat.st_mtime_ns != mtime_ns or stat.st_size != size:
+            return True
+    return False
+
+
+class PromptRegistry:
+    """Process-wide cache of prompt files with their @@INCLUDE directives resolved.
+
+    Each entry remembers the files it was built from (mtime and size). They
+    are re-checked at most every `check_interval` seconds, so steady-state
+    lookups do no filesystem I/O while edits on disk are still hot-reloaded.
+    `version()` is the sha256 of the resolved text. Writers in this process
+    call `invalidate()` so their change is visible immediately.
+    """
+
+    def __init__(self, check_interval: float = PROMPT_CHECK_INTERVAL):
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._entries: dict[str, _PromptEntry] = {}
+
+    def _entry(self, filename: str) -> _PromptEntry:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(filename)
+        if entry is not None:
+            if now - entry.checked_at < self.check_interval:
+                metrics.incr("prompt_registry.hit")
+                return entry
+            if not _deps_changed(entry.deps):
+                entry.checked_at = now
+                metrics.incr("prompt_registry.hit")
+                return entry
+
+        deps: list[tuple[str, int, int]] = []
+        text = _resolve_prompt(filename, deps)
+        version = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        if entry is not None and entry.version != version:
+            metrics.incr("prompt_registry.reload")
+            print(f"[prompts] reloaded {filename}")
+        metrics.incr("prompt_registry.miss")
+        entry = _PromptEntry(text=text, version=version, deps=deps, checked_at=now)
+        with self._lock:
+            self._entries[filename] = entry
+        return entry
+
+    def get(self, filename: str) -> str:
+        return self._entry(filename).text
+
+    def version(self, filename: str) -> str:
+        return self._entry(filename).version
+
+    def invalidate(self, filename: str | None = None) -> None:
+        """Drop `filename` and every prompt that includes it; everything when None."""
+
+        with self._lock:
+            if filename is None:
+                self._entries.clear()
+                return
+            target = str(Path(resource_path(filename)))
+            for name in [n for n, e in self._entries.items() if n == filename or any(d[0] == target for d in e.deps)]:
+                self._entries.pop(name, None)
+
+
+prompt_registry = PromptRegistry()
+
+
+def load_prompt(filename: str) -> str:
+
+    if filename is None:
+        raise ValueError("load_prompt() expected a non-None filename")
+
+    return prompt_registry.get(filename)
+
+
+# Built once at import; get_prompt_file() memoizes the llm/prompt3 preference per key.
+_PROMPT_FILES = {
+    # Issue-type prompts (values)
+    IssueEnum.FEATURE_NOT_FOUND.value: "llm/prompts/image_feature_not_found_prompt.txt",
+    IssueEnum.NO_ISSUE_FOUND.value: "llm/prompts/image_no_issue_found_prompt.txt",
+    IssueEnum.ISSUE_FOUND.value: "llm/prompts/image_issue_found_prompt.txt",
+
+    # Step-type prompts: accept BOTH enum value ("UI Interaction") and enum name ("UI_INTERACTION")
+    SceneEnum.UI_INTERACTION.value: "llm/prompt3/UI_INTERACTION.txt",
+    SceneEnum.UI_INTERACTION.name: "llm/prompt3/UI_INTERACTION.txt",
+    SceneEnum.STATE_VERIFICATION.value: "llm/prompt3/STATE_VERIFICATION.txt",
+    SceneEnum.STATE_VERIFICATION.name: "llm/prompt3/STATE_VERIFICATION.txt",
+    SceneEnum.CONDITIONAL.value: "llm/prompt3/CONDITIONAL.txt",
+    SceneEnum.CONDITIONAL.name: "llm/prompt3/CONDITIONAL.txt",
+    SceneEnum.NAVIGATION.value: "llm/prompt3/NAVIGATION.txt",
+    SceneEnum.NAVIGATION.name: "llm/prompt3/NAVIGATION.txt",
+    SceneEnum.WAITING.value: "llm/prompt3/WAITING.txt",
+    SceneEnum.WAITING.name: "llm/prompt3/WAITING.txt",
+    SceneEnum.DESCRIPTIVE.value: "llm/prompt3/DESCRIPTIVE.txt",
+    SceneEnum.DESCRIPTIVE.name: "llm/prompt3/DESCRIPTIVE.txt",
+    SceneEnum.SCROLL.value: "llm/prompt3/SCROLL.txt",
+    SceneEnum.SCROLL.name: "llm/prompt3/SCROLL.txt",
+    SceneEnum.INPUT.value: "llm/prompt3/INPUT.txt",
+    SceneEnum.INPUT.name: "llm/prompt3/INPUT.txt",
+    ScenarioEnum.ACCESSIBILITY_KEYBOARD_NAVIGATION.value: "llm/prompt4/Accessibility & Keyboard Navigation.txt",
+    ScenarioEnum.ACCESSIBILITY_KEYBOARD_NAVIGATION.name: "llm/prompt4/Accessibility & Keyboard Navigation.txt",
+    ScenarioEnum.ADVERTISING_VERIFICATION_REPORTING.value: "llm/prompt4/Advertising Verification & Reporting.txt",
+    ScenarioEnum.ADVERTISING_VERIFICATION_REPORTING.name: "llm/prompt4/Advertising Verification & Reporting.txt",
+    ScenarioEnum.APPEARANCE_THEME_SETTINGS.value: "llm/prompt4/Appearance & Theme Settings.txt",
+    ScenarioEnum.APPEARANCE_THEME_SETTINGS.name: "llm/prompt4/Appearance & Theme Settings.txt",
+    ScenarioEnum.AUTHENTICATION_USER_PROFILE_MANAGEMENT.value: "llm/prompt4/Authentication & User Profile Management.txt",
+    ScenarioEnum.AUTHENTICATION_USER_PROFILE_MANAGEMENT.name: "llm/prompt4/Authentication & User Profile Management.txt",
+    ScenarioEnum.BROWSER_SETTINGS_CONFIGURATION.value: "llm/prompt4/Browser Settings & Configuration.txt",
+    ScenarioEnum.BROWSER_SETTINGS_CONFIGURATION.name: "llm/prompt4/Browser Settings & Configuration.txt",
+    ScenarioEnum.CAROUSEL_SLIDER_CONTROLS.value: "llm/prompt4/Carousel & Slider Controls.txt",
+    ScenarioEnum.CAROUSEL_SLIDER_CONTROLS.name: "llm/prompt4/Carousel & Slider Controls.txt",
+    ScenarioEnum.ENVIRONMENT_PRECONDITION_SETUP.value: "llm/prompt4/Environment & Precondition Setup.txt",
+    ScenarioEnum.ENVIRONMENT_PRECONDITION_SETUP.name: "llm/prompt4/Environment & Precondition Setup.txt",
+    ScenarioEnum.LOCALIZATION_INTERNATIONALIZATION.value: "llm/prompt4/Localization & Internationalization.txt",
+    ScenarioEnum.LOCALIZATION_INTERNATIONALIZATION.name: "llm/prompt4/Localization & Internationalization.txt",
+    ScenarioEnum.MEDIA_PLAYBACK_AUDIO_CONTROL.value: "llm/prompt4/Media Playback & Audio Control.txt",
+    ScenarioEnum.MEDIA_PLAYBACK_AUDIO_CONTROL.name: "llm/prompt4/Media Playback & Audio Control.txt",
+    ScenarioEnum.MODALS_POPUPS_NOTIFICATIONS_HANDLING.value: "llm/prompt4/Modals, Popups & Notifications Handling.txt",
+    ScenarioEnum.MODALS_POPUPS_NOTIFICATIONS_HANDLING.name: "llm/prompt4/Modals, Popups & Notifications Handling.txt",
+    ScenarioEnum.NAVIGATION_URL_REDIRECTION.value: "llm/prompt4/Navigation & URL Redirection.txt",
+    ScenarioEnum.NAVIGATION_URL_REDIRECTION.name: "llm/prompt4/Navigation & URL Redirection.txt",
+    ScenarioEnum.SEARCH_FUNCTIONALITY_SERP_MODULE_VALIDATION.value: "llm/prompt4/Search Functionality & SERP Module Validation.txt",
+    ScenarioEnum.SEARCH_FUNCTIONALITY_SERP_MODULE_VALIDATION.name: "llm/prompt4/Search Functionality & SERP Module Validation.txt",
+    ScenarioEnum.TAB_WINDOW_MANAGEMENT.value: "llm/prompt4/Tab & Window Management.txt",
+    ScenarioEnum.TAB_WINDOW_MANAGEMENT.name: "llm/prompt4/Tab & Window Management.txt",
+    ScenarioEnum.UI_VISIBILITY_LAYOUT_RENDERING_VERIFICATION.value: "llm/prompt4/UI Visibility, Layout & Rendering Verification.txt",
+    ScenarioEnum.UI_VISIBILITY_LAYOUT_RENDERING_VERIFICATION.name: "llm/prompt4/UI Visibility, Layout & Rendering Verification.txt",
+    ScenarioEnum.WIDGETS_TASKBAR_OS_LEVEL_INTEGRATIONS.value: "llm/prompt4/Widgets, Taskbar & OS-Level Integrations.txt",
+    ScenarioEnum.WIDGETS_TASKBAR_OS_LEVEL_INTEGRATIONS.name: "llm/prompt4/Widgets, Taskbar & OS-Level Integrations.txt",
+    ScenarioEnum.FUNCTIONAL_LAYOUT_SETTING.value: "llm/prompt4/Functional Layout Setting.txt",
+    ScenarioEnum.FUNCTIONAL_LAYOUT_SETTING.name: "llm/prompt4/Functional Layout Setting.txt",
+}
+
+
 def get_prompt_file(issue_type: str) -> str | None:
     key = str(issue_type).strip() if issue_type is not None else ""
+    return _prompt_file_for(key)
+
+
+@lru_cache(maxsize=None)
+def _prompt_file_for(key: str) -> str | None:
 
-    prompt_files = {
-        # Issue-type prompts (values)
-        IssueEnum.FEATURE_NOT_FOUND.value: "llm/prompts/image_feature_not_found_prompt.txt",
-        IssueEnum.NO_ISSUE_FOUND.value: "llm/prompts/image_no_issue_found_prompt.txt",
-        IssueEnum.ISSUE_FOUND.value: "llm/prompts/image_issue_found_prompt.txt",
-
-        # Step-type prompts: accept BOTH enum value ("UI Interaction") and enum name ("UI_INTERACTION")
-        SceneEnum.UI_INTERACTION.value: "llm/prompt3/UI_INTERACTION.txt",
-        SceneEnum.UI_INTERACTION.name: "llm/prompt3/UI_INTERACTION.txt",
-        SceneEnum.STATE_VERIFICATION.value: "llm/prompt3/STATE_VERIFICATION.txt",
-        SceneEnum.STATE_VERIFICATION.name: "llm/prompt3/STATE_VERIFICATION.txt",
-        SceneEnum.CONDITIONAL.value: "llm/prompt3/CONDITIONAL.txt",
-        SceneEnum.CONDITIONAL.name: "llm/prompt3/CONDITIONAL.txt",
-        SceneEnum.NAVIGATION.value: "llm/prompt3/NAVIGATION.txt",
-        SceneEnum.NAVIGATION.name: "llm/prompt3/NAVIGATION.txt",
-        SceneEnum.WAITING.value: "llm/prompt3/WAITING.txt",
-        SceneEnum.WAITING.name: "llm/prompt3/WAITING.txt",
-        SceneEnum.DESCRIPTIVE.value: "llm/prompt3/DESCRIPTIVE.txt",
-        SceneEnum.DESCRIPTIVE.name: "llm/prompt3/DESCRIPTIVE.txt",
-        SceneEnum.SCROLL.value: "llm/prompt3/SCROLL.txt",
-        SceneEnum.SCROLL.name: "llm/prompt3/SCROLL.txt",
-        SceneEnum.INPUT.value: "llm/prompt3/INPUT.txt",
-        SceneEnum.INPUT.name: "llm/prompt3/INPUT.txt",
-        ScenarioEnum.ACCESSIBILITY_KEYBOARD_NAVIGATION.value: "llm/prompt4/Accessibility & Keyboard Navigation.txt",
-        ScenarioEnum.ACCESSIBILITY_KEYBOARD_NAVIGATION.name: "llm/prompt4/Accessibility & Keyboard Navigation.txt",
-        ScenarioEnum.ADVERTISING_VERIFICATION_REPORTING.value: "llm/prompt4/Advertising Verification & Reporting.txt",
-        ScenarioEnum.ADVERTISING_VERIFICATION_REPORTING.name: "llm/prompt4/Advertising Verification & Reporting.txt",
-        ScenarioEnum.APPEARANCE_THEME_SETTINGS.value: "llm/prompt4/Appearance & Theme Settings.txt",
-        ScenarioEnum.APPEARANCE_THEME_SETTINGS.name: "llm/prompt4/Appearance & Theme Settings.txt",
-        ScenarioEnum.AUTHENTICATION_USER_PROFILE_MANAGEMENT.value: "llm/prompt4/Authentication & User Profile Management.txt",
-        ScenarioEnum.AUTHENTICATION_USER_PROFILE_MANAGEMENT.name: "llm/prompt4/Authentication & User Profile Management.txt",
-        ScenarioEnum.BROWSER_SETTINGS_CONFIGURATION.value: "llm/prompt4/Browser Settings & Configuration.txt",
-        ScenarioEnum.BROWSER_SETTINGS_CONFIGURATION.name: "llm/prompt4/Browser Settings & Configuration.txt",
-        ScenarioEnum.CAROUSEL_SLIDER_CONTROLS.value: "llm/prompt4/Carousel & Slider Controls.txt",
-        ScenarioEnum.CAROUSEL_SLIDER_CONTROLS.name: "llm/prompt4/Carousel & Slider Controls.txt",
-        ScenarioEnum.ENVIRONMENT_PRECONDITION_SETUP.value: "llm/prompt4/Environment & Precondition Setup.txt",
-        ScenarioEnum.ENVIRONMENT_PRECONDITION_SETUP.name: "llm/prompt4/Environment & Precondition Setup.txt",
-        ScenarioEnum.LOCALIZATION_INTERNATIONALIZATION.value: "llm/prompt4/Localization & Internationalization.txt",
-        ScenarioEnum.LOCALIZATION_INTERNATIONALIZATION.name: "llm/prompt4/Localization & Internationalization.txt",
-        ScenarioEnum.MEDIA_PLAYBACK_AUDIO_CONTROL.value: "llm/prompt4/Media Playback & Audio Control.txt",
-        ScenarioEnum.MEDIA_PLAYBACK_AUDIO_CONTROL.name: "llm/prompt4/Media Playback & Audio Control.txt",
-        ScenarioEnum.MODALS_POPUPS_NOTIFICATIONS_HANDLING.value: "llm/prompt4/Modals, Popups & Notifications Handling.txt",
-        ScenarioEnum.MODALS_POPUPS_NOTIFICATIONS_HANDLING.name: "llm/prompt4/Modals, Popups & Notifications Handling.txt",
-        ScenarioEnum.NAVIGATION_URL_REDIRECTION.value: "llm/prompt4/Navigation & URL Redirection.txt",
-        ScenarioEnum.NAVIGATION_URL_REDIRECTION.name: "llm/prompt4/Navigation & URL Redirection.txt",
-        ScenarioEnum.SEARCH_FUNCTIONALITY_SERP_MODULE_VALIDATION.value: "llm/prompt4/Search Functionality & SERP Module Validation.txt",
-        ScenarioEnum.SEARCH_FUNCTIONALITY_SERP_MODULE_VALIDATION.name: "llm/prompt4/Search Functionality & SERP Module Validation.txt",
-        ScenarioEnum.TAB_WINDOW_MANAGEMENT.value: "llm/prompt4/Tab & Window Management.txt",
-        ScenarioEnum.TAB_WINDOW_MANAGEMENT.name: "llm/prompt4/Tab & Window Management.txt",
-        ScenarioEnum.UI_VISIBILITY_LAYOUT_RENDERING_VERIFICATION.value: "llm/prompt4/UI Visibility, Layout & Rendering Verification.txt",
-        ScenarioEnum.UI_VISIBILITY_LAYOUT_RENDERING_VERIFICATION.name: "llm/prompt4/UI Visibility, Layout & Rendering Verification.txt",
-        ScenarioEnum.WIDGETS_TASKBAR_OS_LEVEL_INTEGRATIONS.value: "llm/prompt4/Widgets, Taskbar & OS-Level Integrations.txt",
-        ScenarioEnum.WIDGETS_TASKBAR_OS_LEVEL_INTEGRATIONS.name: "llm/prompt4/Widgets, Taskbar & OS-Level Integrations.txt",
-        ScenarioEnum.FUNCTIONAL_LAYOUT_SETTING.value: "llm/prompt4/Functional Layout Setting.txt",
-        ScenarioEnum.FUNCTIONAL_LAYOUT_SETTING.name: "llm/prompt4/Functional Layout Setting.txt",
-    }
-
-    prompt_path = prompt_files.get(key)
+    prompt_path = _PROMPT_FILES.get(key)
     if not prompt_path:
         return None
 
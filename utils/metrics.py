@@ -0,0 +1,102 @@
+import threading
+from collections import defaultdict
+
+
+class Metrics:
+    """Process-wide counters and timings shared by every row of a run.
+
+    Rows are processed in worker threads (each with its own event loop), so
+    every update goes through a single lock.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: dict[str, float] = defaultdict(float)
+        self._samples: dict[str, list[float]] = defaultdict(list)
+        self._sections: list[tuple[str, object]] = []
+
+    def incr(self, name: str, value: float = 1) -> None:
+        with self._lock:
+            self._counters[name] += value
+
+    def observe(self, name: str, value: float) -> None:
+        with self._lock:
+            self._samples[name].append(float(value))
+
+    def counter(self, name: str) -> float:
+        with self._lock:
+            return self._counters.get(name, 0)
+
+    def samples(self, name: str) -> list[float]:
+        with self._lock:
+            return list(self._samples.get(name, []))
+
+    def rate(self, numerator: str, denominator: str) -> float | None:
+        with self._lock:
+            den = self._counters.get(denominator, 0)
+            if not den:
+                return None
+            return self._counters.get(numerator, 0) / den
+
+    def add_report_section(self, title: str, build_lines) -> None:
+        """Register a callable returning summary lines printed after the raw counters."""
+
+        with self._lock:
+            if all(t != title for t, _ in self._sections):
+                self._sections.append((title, build_lines))
+
+    def reset(self) -> None:
+        with self._lock:
+            self._counters.clear()
+            self._samples.clear()
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            counters = dict(self._counters)
+            samples = {k: list(v) for k, v in self._samples.items()}
+
+        timings = {}
+        for name, values in samples.items():
+            if not values:
+                continue
+            ordered = sorted(values)
+            timings[name] = {
+                "count": len(ordered),
+                "mean": sum(ordered) / len(ordered),
+                "p50": _percentile(ordered, 0.50),
+                "p95": _percentile(ordered, 0.95),
+                "max": ordered[-1],
+            }
+        return {"counters": counters, "timings": timings}
+
+    def format_report(self) -> str:
+        snap = self.snapshot()
+        lines = ["=== Run metrics ==="]
+        for name in sorted(snap["counters"]):
+            value = snap["counters"][name]
+            shown = int(value) if float(value).is_integer() else round(value, 4)
+            lines.append(f"{name}: {shown}")
+        for name in sorted(snap["timings"]):
+            t = snap["timings"][name]
+            lines.append(
+                f"{name}: n={t['count']} mean={t['mean']:.3f} p50={t['p50']:.3f} "
+                f"p95={t['p95']:.3f} max={t['max']:.3f}"
+            )
+        with self._lock:
+            sections = list(self._sections)
+        for title, build_lines in sections:
+            section_lines = build_lines()
+            if section_lines:
+                lines.append(f"=== {title} ===")
+                lines.extend(section_lines)
+        return "\n".join(lines)
+
+
+def _percentile(ordered: list[float], q: float) -> float:
+    if not ordered:
+        return 0.0
+    idx = min(len(ordered) - 1, max(0, int(round(q * (len(ordered) - 1)))))
+    return ordered[idx]
+
+
+metrics = Metrics()
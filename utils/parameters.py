@@ -38,7 +38,58 @@ def parse_parameters(argv=None, *, allow_unknown: bool | None = None):
     parser.add_argument("--test_file_or_url", type=str, default = "Q:\\VSCode\\TianYang\\CIP\\test.xlsx", help="Path to the test file")
     parser.add_argument("--timeout", type=int, default=120, help="Request timeout in seconds")
     parser.add_argument("--concurrency", type=int, default=10, help="Number of pages to process concurrently")
-    parser.add_argument("--work_type", type=str, default="C", help="Type of work: C or O")
+    parser.add_argument("--work_type", type=str, default="C", help="Type of work: C (compare), O (optimize), B (offline batch compare, Excel input only) or R (offline rule optimization over a labelled Excel export)")
+    parser.add_argument("--structured_output", action="store_true", help="Send JSON-schema response_format constraints and parse replies with a single json.loads")
+    parser.add_argument("--batch_model", type=str, default=None, help="Model/deployment used for batch submissions (defaults to --model)")
+    parser.add_argument("--batch_dir", type=str, default=".batches", help="Folder where batch JSONL input/output files are kept")
+    parser.add_argument("--batch_poll_interval", type=float, default=30, help="Seconds between batch status polls")
+    parser.add_argument("--batch_completion_window", type=str, default="24h", help="Completion window requested for each batch")
+    parser.add_argument("--hedge", action="store_true", help="Race a duplicate request when a call exceeds the adaptive latency threshold")
+    parser.add_argument("--hedge_kinds", type=str, default="judge", help="Comma-separated call kinds that may be hedged")
+    parser.add_argument("--hedge_model", type=str, default=None, help="Model/deployment for the duplicate request (defaults to --model)")
+    parser.add_argument("--hedge_quantile", type=float, default=0.95, help="Latency quantile after which a duplicate is sent")
+    parser.add_argument("--hedge_min_samples", type=int, default=20, help="Observed calls needed before the quantile is trusted")
+    parser.add_argument("--hedge_delay", type=float, default=30, help="Hedge delay in seconds until enough latencies are observed")
+    parser.add_argument("--hedge_min_delay", type=float, default=5, help="Lower bound for the hedge delay in seconds")
+    parser.add_argument("--cascade_model", type=str, default=None, help="Cheaper model that judges steps first; enables the judge cascade")
+    parser.add_argument("--cascade_min_confidence", type=float, default=0.8, help="Minimum self-reported confidence to accept a cheap-model Correct")
+    parser.add_argument("--cascade_audit_rate", type=float, default=0.0, help="Fraction of accepted cheap verdicts also judged by the primary model to measure agreement")
+    parser.add_argument("--routing", action="store_true", help="Pick model, reasoning effort and output-token cap per call kind and step type")
+    parser.add_argument("--routing_table", type=str, default=None, help="JSON file overriding the built-in routing table (implies --routing)")
+    parser.add_argument("--plan_cache_dir", type=str, default="", help="Folder of the persistent planner cache, e.g. .cache/plans (one JSON file per case); off when empty (default)")
+    parser.add_argument("--stream_plan", action="store_true", help="Stream the planner reply and start judging each step as soon as its plan entry is complete (one step at a time; not with --judge_window or --speculative_judge)")
+    parser.add_argument("--plan_chunk_size", type=int, default=0, help="Plan cases longer than this many steps in overlapping windows concurrently (0 disables)")
+    parser.add_argument("--plan_chunk_overlap", type=int, default=2, help="Steps shared by neighbouring planner windows")
+    parser.add_argument("--step_classifier", action="store_true", help="Assign step types with the local classifier and call the planner LLM only when it is unsure")
+    parser.add_argument("--step_classifier_min_confidence", type=float, default=0.3, help="Minimum classifier margin for every step of a case to skip the planner LLM")
+    parser.add_argument("--step_classifier_min_examples", type=int, default=200, help="Training examples the classifier needs, across every planner step type, before it may skip the planner LLM; below that it only runs in shadow mode")
+    parser.add_argument("--step_classifier_shadow", action="store_true", help="Run the classifier but always call the planner LLM, only measuring agreement (no --step_classifier needed)")
+    parser.add_argument("--image_prep", action="store_true", help="Downsize and re-encode screenshots and pick the image detail level per step type before upload")
+    parser.add_argument("--image_max_edge", type=int, default=1568, help="Longest image edge in pixels after preparation (0 keeps the size)")
+    parser.add_argument("--image_format", type=str, default="webp", choices=["webp", "jpeg", "png"], help="Encoding used for prepared images")
+    parser.add_argument("--image_quality", type=int, default=85, help="Quality for lossy prepared image formats")
+    parser.add_argument("--image_detail", type=str, default="policy", choices=["policy", "auto", "low", "high"], help="Image detail level; 'policy' picks it per step type")
+    parser.add_argument("--image_store_dir", type=str, default="", help="Folder of the content-addressed image store (e.g. .cache/images), kept across runs; empty string keeps it in memory only")
+    parser.add_argument("--image_store_items", type=int, default=256, help="Images kept decoded in the in-memory LRU")
+    parser.add_argument("--image_fetch_workers", type=int, default=8, help="Images fetched and hashed concurrently per row")
+    parser.add_argument("--image_fetch_timeout", type=float, default=30, help="Per-image download timeout in seconds")
+    parser.add_argument("--image_fetch_retries", type=int, default=2, help="Retries for an image download on connection errors, timeouts and 429/5xx")
+    parser.add_argument("--speculative_judge", action="store_true", help="Judge all steps of a row concurrently assuming earlier steps are Correct; same result as the sequential loop")
+    parser.add_argument("--speculative_window", type=int, default=0, help="Maximum steps judged ahead of the first undecided one (0 = all)")
+    parser.add_argument("--judge_window", type=int, default=0, help="Judge this many consecutive steps per LLM call (0 or 1 = one call per step)")
+    parser.add_argument("--case_near_match", action="store_true", help="Add the step_success_reason of near-duplicate example cases when no case matches exactly")
+    parser.add_argument("--case_near_k", type=int, default=2, help="Near-duplicate example cases added per step")
+    parser.add_argument("--case_near_min_similarity", type=float, default=0.6, help="Minimum estimated Jaccard similarity of a near-duplicate example case")
+    parser.add_argument("--short_circuit", action="store_true", help="Run the deterministic pre-judge rules (missing actual step, identical screenshot, copied text) before each judge call")
+    parser.add_argument("--short_circuit_rules", type=str, default=None, help="JSON file overriding the per-step-type rule actions (implies --short_circuit)")
+    parser.add_argument("--history_encoding", type=str, default="json", choices=["json", "ranges"], help="How earlier Correct steps are sent to the judge: full JSON entries or step ranges (\"steps 1-14: Correct\")")
+    parser.add_argument("--history_shadow", action="store_true", help="Also judge each step with the other history encoding and report verdict agreement and token counts")
+    parser.add_argument("--optimize_candidates", type=int, default=0, help="Optimization: rule candidates proposed and judged in parallel per round (0 or 1 = one sequential rewrite per round)")
+    parser.add_argument("--optimize_search_rounds", type=int, default=3, help="Optimization: maximum candidate-search rounds per step")
+    parser.add_argument("--rule_opt_holdout", type=float, default=0.3, help="Offline rule optimization (work_type R): fraction of labelled rows held out for scoring rules, half to pick the best candidate and half to accept it")
+    parser.add_argument("--rule_opt_candidates", type=int, default=4, help="Offline rule optimization (work_type R): candidate rules proposed per step type rule")
+    parser.add_argument("--rule_edit_mode", type=str, default="patch", choices=["patch", "full"], help="Optimization: the model returns add/replace/delete clause edits applied locally (patch) or regenerates the whole rule (full)")
+
     if argv is None:
         argv = sys.argv[1:]
 
@@ -49,4 +100,10 @@ def parse_parameters(argv=None, *, allow_unknown: bool | None = None):
     if unknown and not allow_unknown:
         parser.error(f"unrecognized arguments: {' '.join(unknown)}")
 
+    if args.stream_plan:
+        # The streaming path judges each step as its plan entry arrives, one at a time.
+        ignored = [flag for flag, on in (("--judge_window", args.judge_window > 1), ("--speculative_judge", args.speculative_judge)) if on]
+        if ignored:
+            parser.error(f"--stream_plan judges one step at a time and cannot be combined with {' / '.join(ignored)}")
+
     return args
\ No newline at end of file